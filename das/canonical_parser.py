@@ -1,11 +1,11 @@
 from enum import Enum, auto
 import datetime
 import subprocess
-import pickle
 import sys
 from das.logger import logger
 from das.expression_hasher import ExpressionHasher
-from das.database.key_value_schema import CollectionNames as KeyPrefix, build_redis_key
+from das.database.key_value_schema import CollectionNames as KeyPrefix, build_redis_key, pattern_key_tag, split_tagged_key
+from das.database.handle_codec import encode_handle, encode_document, decode_document, encode_redis_members
 from das.database.mongo_schema import CollectionNames as MongoCollections
 from das.key_value_file import write_key_value, key_value_generator, key_value_targets_generator, sort_file
 import das.key_value_file
@@ -103,7 +103,7 @@ class CanonicalParser:
         if len(bulk_insertion_no_duplicates) != len(bulk_insertion):
             logger().error(f"Striped {len(bulk_insertion_no_duplicates) - len(bulk_insertion)} too large documents")
         try:
-            collection.insert_many(bulk_insertion, ordered=False)
+            collection.insert_many([encode_document(document) for document in bulk_insertion], ordered=False)
         except Exception as e:
             if not self.allow_duplicates:
                 logger().error(str(e))
@@ -136,7 +136,7 @@ class CanonicalParser:
         template = open(self.temporary_file_name[KeyPrefix.TEMPLATES], "w")
         for tag in [MongoCollections.LINKS_ARITY_1, MongoCollections.LINKS_ARITY_2, MongoCollections.LINKS_ARITY_N]:
             mongo_collection = self.db.mongo_db[tag]
-            for expression in mongo_collection.find():
+            for expression in map(decode_document, mongo_collection.find()):
                 elements = [expression[k] for k in expression.keys() if k.startswith("key")]
                 for target in elements:
                     write_key_value(outgoing, expression["_id"], target)
@@ -175,8 +175,12 @@ class CanonicalParser:
                         keys.append([WILDCARD, WILDCARD, WILDCARD, elements[2]])
                         keys.append([WILDCARD, WILDCARD, WILDCARD, WILDCARD])
                 for key in keys:
-                    write_key_value(patterns, key, [expression["_id"], *elements])
-                write_key_value(template, expression["composite_type_hash"], [expression["_id"], *elements])
+                    write_key_value(patterns, key, [expression["_id"], *elements], tag=pattern_key_tag(key, WILDCARD))
+                write_key_value(
+                    template,
+                    expression["composite_type_hash"],
+                    [expression["_id"], *elements],
+                    tag=expression["named_type_hash"])
                 write_key_value(template, expression["named_type_hash"], [expression["_id"], *elements])
         for file in [outgoing, incoming, patterns, template]:
             file.close()
@@ -215,10 +219,10 @@ class CanonicalParser:
             if key_count % 100000 == 0:
                 logger().info(f"Added {key_count} keys (line count = {das.key_value_file.KEY_VALUE_LINE_COUNTER})")
             try:
-                if use_targets:
-                    self.db.redis.sadd(build_redis_key(collection_name, key), *[pickle.dumps(v) for v in value])
-                else:
-                    self.db.redis.sadd(build_redis_key(collection_name, key), *value)
+                key, tag = split_tagged_key(key)
+                redis_key = build_redis_key(collection_name, encode_handle(key), encode_handle(tag))
+                self.db.redis.sadd(redis_key, *encode_redis_members(collection_name, value))
+                self.db.invalidate_key_value(collection_name, key)
             except:
                 logger().error(f"Error in key-value file {collection_name} on line {das.key_value_file.KEY_VALUE_LINE_COUNTER}")
                 assert False
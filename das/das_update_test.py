@@ -2,8 +2,10 @@ import tempfile
 import shutil
 import os
 import pytest
+from das import distributed_atom_space
 from das.distributed_atom_space import DistributedAtomSpace, WILDCARD, QueryOutputFormat
 from das.database.db_interface import UNORDERED_LINK_TYPES
+from das.database.memory_db import MemoryDB
 
 das = DistributedAtomSpace()
 transaction = das.open_transaction()
@@ -190,3 +192,33 @@ def test_get_links_with_patterns():
         set([human, gorilla]),
         [human, mammal],
     ])
+
+def test_mmap_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(distributed_atom_space, 'MMAP_INDEX_DIR', str(tmp_path))
+    directory = str(tmp_path / das.database_name)
+    for expressions in [['(Similarity "human" "monkey")'], ['(Inheritance "gorilla" "mammal")']]:
+        transaction = das.open_transaction()
+        for expression in expressions:
+            transaction.add_toplevel_expression(expression)
+        das.commit_transaction(transaction)
+    # Only the first commit is written, the second one waits for
+    # MMAP_INDEX_WRITE_INTERVAL
+    index_db = MemoryDB.open_index(directory)
+    assert index_db.link_exists(similarity, [human, monkey])
+    assert not index_db.link_exists(inheritance, [gorilla, mammal])
+    assert len(das.mmap_index_pending) == 1
+    das.write_mmap_index()
+    assert not das.mmap_index_pending
+    index_db = MemoryDB.open_index(directory)
+    assert index_db.link_exists(similarity, [human, monkey])
+    assert index_db.link_exists(inheritance, [gorilla, mammal])
+    # The index directory is a symlink to the last version, the previous
+    # version is kept for the readers which opened it
+    assert os.path.islink(directory)
+    versions = [name for name in os.listdir(tmp_path) if name.startswith(f'{das.database_name}.version-')]
+    assert len(versions) == 2
+    das.write_mmap_index()
+    das.mmap_index_pending.append(([], [], None))
+    das.write_mmap_index()
+    assert len([name for name in os.listdir(tmp_path) if name.startswith(f'{das.database_name}.version-')]) == 2
+    assert MemoryDB.open_index(directory).link_exists(inheritance, [gorilla, mammal])
@@ -0,0 +1,166 @@
+import asyncio
+from concurrent.futures import Executor
+from contextvars import copy_context
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from das.expression_hasher import ExpressionHasher
+from das.database.handle_codec import decode_handle
+from das.database.key_value_schema import CollectionNames as KeyPrefix, LOAD_MARKER_KEY, pattern_key_tag
+from das.database.redis_mongo_db import RedisMongoDB
+from .db_interface import WILDCARD
+
+class AsyncRedisMongoDB:
+    """
+    TODO: documentation
+    """
+
+    def __init__(self, db: RedisMongoDB, redis, executor: Optional[Executor] = None):
+        self.db = db
+        self.redis = redis
+        self.executor = executor
+
+    def __repr__(self):
+        return "<Async Redis + MongoDB>"
+
+    async def run_sync(self, function, *args):
+        # Blocking calls (e.g. MongoDB) run in the executor with the caller's context
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(copy_context().run, function, *args))
+
+    async def _retrieve_key_values(self, prefix: str, keys: List[str], tags: Optional[List[str]] = None) -> List[List[Any]]:
+        if tags is None:
+            tags = [None] * len(keys)
+        if self.db.key_value_cache is not None:
+            self.db._set_key_value_cache_marker(await self._current_load_marker())
+        answer, missing = self.db._get_cached_key_values(prefix, keys, validate=False)
+        if not missing:
+            return answer
+        if len(missing) == 1:
+            position = missing[0]
+            replies = [await self.redis.smembers(self.db._build_redis_key(prefix, keys[position], tags[position]))]
+        else:
+            pipeline = self.redis.pipeline(transaction=False)
+            for position in missing:
+                pipeline.smembers(self.db._build_redis_key(prefix, keys[position], tags[position]))
+            replies = await pipeline.execute()
+        return self.db._set_key_values(prefix, keys, missing, replies, answer)
+
+    async def _retrieve_key_value(self, prefix: str, key: str, tag: Optional[str] = None) -> List[Any]:
+        return (await self._retrieve_key_values(prefix, [key], [tag]))[0]
+
+    async def _current_load_marker(self) -> Optional[str]:
+        # Same as RedisMongoDB._current_load_marker()
+        if self.db._load_marker_expired():
+            self.db._update_load_marker(await self.redis.get(LOAD_MARKER_KEY))
+        return self.db.load_marker
+
+    async def _prefetched_data_current(self) -> bool:
+        return await self._current_load_marker() == self.db.prefetch_load_marker
+
+    async def _atom_exists(self, existence_filter, handle: str, arity: int) -> bool:
+        if existence_filter is not None:
+            exists = existence_filter.check(handle)
+            if exists or (exists is False and await self._prefetched_data_current()):
+                return exists
+        document = await self.run_sync(self.db._retrieve_mongo_document, handle, arity)
+        if document is not None and existence_filter is not None:
+            existence_filter.add([handle])
+        return document is not None
+
+    def get_node_handle(self, node_type: str, node_name: str) -> str:
+        return self.db.get_node_handle(node_type, node_name)
+
+    def get_link_handle(self, link_type: str, target_handles: List[str]) -> str:
+        return self.db.get_link_handle(link_type, target_handles)
+
+    async def node_exists(self, node_type: str, node_name: str) -> bool:
+        node_handle = self.db.get_node_handle(node_type, node_name)
+        return await self._atom_exists(self.db.node_existence_filter, node_handle, 0)
+
+    async def link_exists(self, link_type: str, target_handles: List[str]) -> bool:
+        link_handle = self.db.get_link_handle(link_type, target_handles)
+        return await self._atom_exists(self.db.link_existence_filter, link_handle, len(target_handles))
+
+    async def get_link_targets(self, link_handle: str) -> List[str]:
+        return (await self.get_link_targets_many([link_handle]))[0]
+
+    async def get_link_targets_many(self, link_handles: List[str]) -> List[List[str]]:
+        answer = []
+        for link_handle, targets in zip(link_handles, await self._retrieve_key_values(KeyPrefix.OUTGOING_SET, link_handles)):
+            if not targets:
+                raise ValueError(f"Invalid handle: {link_handle}")
+            answer.append([decode_handle(h) for h in targets])
+        return answer
+
+    async def is_ordered(self, link_handle: str) -> bool:
+        return await self.run_sync(self.db.is_ordered, link_handle)
+
+    async def get_matched_links(self, link_type: str, target_handles: List[str]) -> List[Any]:
+        return (await self.get_matched_links_many([(link_type, target_handles)]))[0]
+
+    async def get_matched_links_many(self, patterns: List[Tuple[str, List[str]]]) -> List[List[Any]]:
+        answer = [[] for _ in patterns]
+        exact_positions = []
+        exact_checks = []
+        pattern_positions = []
+        pattern_hashes = []
+        pattern_tags = []
+        for position, (link_type, target_handles) in enumerate(patterns):
+            if link_type != WILDCARD and WILDCARD not in target_handles:
+                try:
+                    link_handle = self.db.get_link_handle(link_type, target_handles)
+                except ValueError:
+                    continue
+                exact_positions.append(position)
+                exact_checks.append(self._atom_exists(self.db.link_existence_filter, link_handle, len(target_handles)))
+                answer[position] = [link_handle]
+            else:
+                pattern = self.db._get_pattern(link_type, target_handles)
+                if pattern is not None:
+                    pattern_positions.append(position)
+                    pattern_hashes.append(ExpressionHasher.composite_hash(pattern))
+                    pattern_tags.append(pattern_key_tag(pattern, WILDCARD))
+        exists, matched = await asyncio.gather(
+            asyncio.gather(*exact_checks),
+            self._retrieve_key_values(KeyPrefix.PATTERNS, pattern_hashes, pattern_tags))
+        for position, link_exists in zip(exact_positions, exists):
+            if not link_exists:
+                answer[position] = []
+        for position, links in zip(pattern_positions, matched):
+            answer[position] = links
+        return answer
+
+    async def get_matched_type_template(self, template: List[Any]) -> List[Any]:
+        template_hash, tag = self.db._get_template_key(template)
+        return await self._retrieve_key_value(KeyPrefix.TEMPLATES, template_hash, tag)
+
+    async def get_matched_type(self, link_type: str) -> List[Any]:
+        named_type_hash = self.db._get_atom_type_hash(link_type)
+        return await self._retrieve_key_value(KeyPrefix.TEMPLATES, named_type_hash)
+
+    async def get_node_name(self, node_handle: str) -> str:
+        answer = await self._retrieve_key_value(KeyPrefix.NAMED_ENTITIES, node_handle)
+        if not answer:
+            raise ValueError(f"Invalid handle: {node_handle}")
+        return answer[0].decode()
+
+    async def get_all_nodes(self, node_type: str, names: bool = False) -> List[str]:
+        return await self.run_sync(self.db.get_all_nodes, node_type, names)
+
+    async def get_matched_node_name(self, node_type: str, substring: str, prefix: bool = False, case_sensitive: bool = True) -> str:
+        return await self.run_sync(self.db.get_matched_node_name, node_type, substring, prefix, case_sensitive)
+
+    async def get_atom_as_dict(self, handle: str, arity: int = -1) -> Dict:
+        return await self.run_sync(self.db.get_atom_as_dict, handle, arity)
+
+    async def get_atoms_as_dict(self, handles: List[str], arity: int = -1) -> List[Dict]:
+        return await self.run_sync(self.db.get_atoms_as_dict, handles, arity)
+
+    async def get_atom_as_deep_representation(self, handle: str, arity: int = -1) -> Dict:
+        return await self.run_sync(self.db.get_atom_as_deep_representation, handle, arity)
+
+    async def get_atoms_as_deep_representation(self, handles: List[str], arity: int = -1) -> List[Dict]:
+        return await self.run_sync(self.db.get_atoms_as_deep_representation, handles, arity)
+
+    async def count_atoms(self) -> Tuple[int, int]:
+        return await self.run_sync(self.db.count_atoms)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+
+import pytest
+from pymongo import MongoClient as MongoDBClient
+from redis import Redis
+
+from das.database.db_interface import WILDCARD
+from das.database.redis_mongo_db import RedisMongoDB
+from das.database.async_redis_mongo_db import AsyncRedisMongoDB
+from das import distributed_atom_space
+from das.distributed_atom_space import DistributedAtomSpace, QueryOutputFormat
+from das.pattern_matcher.pattern_matcher import And, Link, LogicalExpression, Node, Not, Or, PatternMatchingAnswer, Variable
+
+class AsyncRedisStandIn:
+    """
+    Stand-in for redis.asyncio.Redis which forwards the commands used by
+    AsyncRedisMongoDB to a synchronous client.
+    """
+
+    class Pipeline:
+        def __init__(self, pipeline):
+            self.pipeline = pipeline
+        def smembers(self, key):
+            self.pipeline.smembers(key)
+            return self
+        async def execute(self):
+            await asyncio.sleep(0)
+            return self.pipeline.execute()
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = 0
+        # Like the actual clients, stand-ins created in a running event loop
+        # can't be used in other loops
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+
+    def _check_loop(self):
+        if self.loop is not None and asyncio.get_running_loop() is not self.loop:
+            raise RuntimeError("Client used in a different event loop")
+
+    async def smembers(self, key):
+        self._check_loop()
+        self.commands += 1
+        await asyncio.sleep(0)
+        return self.redis.smembers(key)
+
+    async def get(self, key):
+        # Load marker checks (not counted since they depend on timing)
+        self._check_loop()
+        await asyncio.sleep(0)
+        return self.redis.get(key)
+
+    def pipeline(self, transaction=True):
+        self._check_loop()
+        self.commands += 1
+        return AsyncRedisStandIn.Pipeline(self.redis.pipeline(transaction=transaction))
+
+@pytest.fixture()
+def db():
+    hostname = os.environ.get('DAS_MONGODB_HOSTNAME')
+    port = os.environ.get('DAS_MONGODB_PORT')
+    username = os.environ.get('DAS_DATABASE_USERNAME')
+    password = os.environ.get('DAS_DATABASE_PASSWORD')
+    mongo_db = MongoDBClient(f'mongodb://{username}:{password}@{hostname}:{port}')['das']
+    redis = Redis(host=os.environ.get('DAS_REDIS_HOSTNAME'), port=os.environ.get('DAS_REDIS_PORT'), decode_responses=False)
+    db = RedisMongoDB(redis, mongo_db)
+    db.prefetch()
+    return db
+
+def test_async_lookups(db):
+    async_db = AsyncRedisMongoDB(db, AsyncRedisStandIn(db.redis))
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    link = db.get_link_handle('Inheritance', [human, mammal])
+    patterns = [
+        ('Inheritance', [WILDCARD, mammal]),
+        ('Inheritance', [human, mammal]),
+        ('Inheritance', [mammal, human]),
+        (WILDCARD, [human, WILDCARD]),
+        ('blah', [WILDCARD, mammal]),
+    ]
+
+    async def lookups():
+        return await asyncio.gather(
+            async_db.node_exists('Concept', 'human'),
+            async_db.node_exists('Concept', 'blah'),
+            async_db.link_exists('Inheritance', [human, mammal]),
+            async_db.get_matched_links_many(patterns),
+            async_db.get_matched_type_template(['Inheritance', 'Concept', 'Concept']),
+            async_db.get_matched_type('Similarity'),
+            async_db.get_link_targets(link),
+            async_db.get_node_name(human),
+            async_db.get_atom_as_dict(human))
+
+    answer = asyncio.run(lookups())
+    assert answer[:3] == [True, False, True]
+    assert [sorted(links) for links in answer[3]] == [sorted(links) for links in db.get_matched_links_many(patterns)]
+    assert sorted(answer[4]) == sorted(db.get_matched_type_template(['Inheritance', 'Concept', 'Concept']))
+    assert sorted(answer[5]) == sorted(db.get_matched_type('Similarity'))
+    assert sorted(answer[6]) == sorted([human, mammal])
+    assert answer[7] == 'human'
+    assert answer[8]['name'] == 'human'
+    with pytest.raises(ValueError):
+        asyncio.run(async_db.get_link_targets(human))
+
+def test_default_matched_async(db):
+    class BlockingNode(LogicalExpression):
+        def __init__(self, name):
+            self.node = Node('Concept', name)
+        def matched(self, db, answer):
+            return self.node.matched(db, answer)
+    async_db = AsyncRedisMongoDB(db, AsyncRedisStandIn(db.redis))
+    mammal = Node('Concept', 'mammal')
+    query = And([BlockingNode('human'), Link('Inheritance', [Variable('V1'), mammal], True)])
+    answer = PatternMatchingAnswer()
+    expected = PatternMatchingAnswer()
+    assert asyncio.run(query.matched_async(async_db, answer))
+    assert query.matched(db, expected)
+    assert answer.assignments == expected.assignments
+    assert not asyncio.run(BlockingNode('blah').matched_async(async_db, PatternMatchingAnswer()))
+
+def test_query_async(db, monkeypatch):
+    das = DistributedAtomSpace()
+    clients = []
+    def new_client(*args):
+        clients.append(AsyncRedisStandIn(das.redis))
+        return clients[-1]
+    monkeypatch.setattr(distributed_atom_space, 'new_async_redis_client', new_client)
+    async_db = AsyncRedisMongoDB(das.db, AsyncRedisStandIn(das.redis))
+    mammal = Node('Concept', 'mammal')
+    queries = [
+        And([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Inheritance', [Variable('V2'), mammal], True),
+            Not(Link('Similarity', [Variable('V1'), Variable('V2')], False)),
+        ]),
+        Or([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Similarity', [Variable('V1'), Node('Concept', 'human')], False),
+        ]),
+    ]
+    for query in queries:
+        for output_format in [QueryOutputFormat.HANDLE, QueryOutputFormat.ATOM_INFO]:
+            expected = das.query(query, output_format)
+            # Sets cached by das.query() would be answered without Redis
+            das.db.invalidate_key_values()
+            answer = asyncio.run(das.query_async(query, output_format))
+            if output_format == QueryOutputFormat.HANDLE:
+                answer_assignments = PatternMatchingAnswer()
+                expected_assignments = PatternMatchingAnswer()
+                assert query.matched(das.db, expected_assignments) == \
+                    asyncio.run(query.matched_async(async_db, answer_assignments))
+                assert answer_assignments.assignments == expected_assignments.assignments
+            else:
+                assert len(answer) == len(expected)
+    # Each asyncio.run() has its own event loop and client
+    assert len(clients) == len(queries) * 2
+    assert all(client.commands > 0 for client in clients)
+
+def test_query_async_limit(db, monkeypatch):
+    das = DistributedAtomSpace()
+    monkeypatch.setattr(distributed_atom_space, 'new_async_redis_client', lambda *args: AsyncRedisStandIn(das.redis))
+    mammal = Node('Concept', 'mammal')
+    query = Link('Inheritance', [Variable('V1'), mammal], True)
+    answer = eval(asyncio.run(das.query_async(query, QueryOutputFormat.ATOM_INFO, limit=2)))
+    assert len(answer) == 2
+    assert all(a['V1']['name'] in ['chimp', 'human', 'monkey', 'rhino'] for a in answer)
+    assert len(eval(asyncio.run(das.query_async(query, QueryOutputFormat.ATOM_INFO, limit=10)))) == 4
+    assert asyncio.run(das.query_async(Node('Concept', 'blah'), limit=1)) == ''
+    query = Not(query)
+    assert len(asyncio.run(das.query_async(query, limit=1))) == len(das.query(query))
+
+def test_query_async_in_one_loop(db, monkeypatch):
+    das = DistributedAtomSpace()
+    clients = []
+    def new_client(*args):
+        clients.append(AsyncRedisStandIn(das.redis))
+        return clients[-1]
+    monkeypatch.setattr(distributed_atom_space, 'new_async_redis_client', new_client)
+    query = Link('Inheritance', [Variable('V1'), Node('Concept', 'mammal')], True)
+    async def queries():
+        return await asyncio.gather(das.query_async(query), das.query_async(query))
+    first, second = asyncio.run(queries())
+    assert first == second == das.query(query)
+    assert len(clients) == 1
+    assert asyncio.run(das.query_async(query)) == first
+    assert len(clients) == 2
@@ -0,0 +1,231 @@
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from das.database.handle_index import HandleIndex, digests_to_handles
+
+def gather_ranges(starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    # Indexes of the ranges [starts[i], starts[i] + sizes[i]), one after another
+    return np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(int(sizes.sum()))
+
+class TypeNameTable:
+    # Atom type names interned as small ints
+
+    def __init__(self, names: Optional[List[str]] = None):
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for name in names or []:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name: str) -> int:
+        type_id = self.ids.get(name, None)
+        if type_id is None:
+            type_id = len(self.names)
+            self.ids[name] = type_id
+            self.names.append(name)
+        return type_id
+
+    def get_id(self, name: str) -> Optional[int]:
+        return self.ids.get(name, None)
+
+    def get_name(self, type_id: int) -> str:
+        return self.names[type_id]
+
+    def id_array(self, type_ids: List[int]) -> np.ndarray:
+        dtype = np.min_scalar_type(max(len(self.names) - 1, 0))
+        return np.array(type_ids, dtype=dtype)
+
+    def remap(self, other: 'TypeNameTable', type_ids: List[int]) -> np.ndarray:
+        mapping = np.array([self.intern(name) for name in other.names], dtype=np.int64)
+        if not len(mapping):
+            return np.zeros(0, dtype=np.int64)
+        return mapping[np.asarray(type_ids, dtype=np.int64)]
+
+class StringColumn:
+    # UTF-8 buffer plus an array of offsets
+
+    def __init__(self, values: List[str]):
+        encoded = [value.encode('utf-8') for value in values]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=self.offsets[1:])
+        self.buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    @classmethod
+    def from_arrays(cls, offsets: np.ndarray, buffer: np.ndarray) -> 'StringColumn':
+        column = cls.__new__(cls)
+        column.offsets = offsets
+        column.buffer = buffer
+        return column
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> str:
+        return self.buffer[self.offsets[position]:self.offsets[position + 1]].tobytes().decode('utf-8')
+
+class AtomTypeTable:
+    # Columnar (handle -> type id) cache
+
+    def __init__(self, type_names: TypeNameTable, handles: List[str], type_ids: List[int], **columns):
+        self.type_names = type_names
+        self.index = HandleIndex(handles, type_id=type_names.id_array(type_ids), **columns)
+        self.type_order = None
+        self.type_offsets = None
+
+    @classmethod
+    def from_arrays(cls, type_names: TypeNameTable, arrays: Dict[str, np.ndarray]) -> 'AtomTypeTable':
+        table = cls.__new__(cls)
+        table.type_names = type_names
+        arrays = dict(arrays)
+        table.type_order = arrays.pop('type_order', None)
+        table.type_offsets = arrays.pop('type_offsets', None)
+        columns = {name: array for name, array in arrays.items() if name != 'keys'}
+        table.index = HandleIndex.from_sorted(arrays['keys'], **columns)
+        return table
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        answer = {'keys': self.index.keys, **self.index.columns}
+        if self.type_order is not None:
+            answer['type_order'] = self.type_order
+            answer['type_offsets'] = self.type_offsets
+        return answer
+
+    def build_type_index(self) -> None:
+        # Positions of the atoms of type t are type_order[type_offsets[t]:type_offsets[t + 1]]
+        type_ids = self.index.columns['type_id']
+        dtype = np.uint32 if len(type_ids) < 2 ** 32 else np.int64
+        self.type_order = np.argsort(type_ids, kind='stable').astype(dtype)
+        self.type_offsets = np.zeros(len(self.type_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(type_ids, minlength=len(self.type_names)), out=self.type_offsets[1:])
+
+    def __len__(self):
+        return len(self.index)
+
+    def _new_rows(self, handles: List[str]) -> np.ndarray:
+        # Rows of the handles which aren't in the table (first occurrence only)
+        first_rows = {}
+        for row, handle in enumerate(handles):
+            first_rows.setdefault(handle, row)
+        rows = np.fromiter(first_rows.values(), dtype=np.int64, count=len(first_rows))
+        return rows[self.positions([handles[row] for row in rows]) < 0]
+
+    def _merge_arrays(self, added: 'AtomTypeTable') -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        # Atoms of added must not be in this table
+        keys = np.concatenate([self.index.keys, added.index.keys])
+        order = np.argsort(keys, kind='stable')
+        arrays = {'keys': keys[order]}
+        for name, column in self.index.columns.items():
+            arrays[name] = np.concatenate([column, added.index.columns[name]])[order]
+        arrays['type_id'] = self.type_names.id_array(arrays['type_id'].astype(np.int64))
+        return arrays, order
+
+    def merged(self, handles: List[str], type_ids: List[int], **columns) -> 'AtomTypeTable':
+        rows = self._new_rows(handles)
+        if not len(rows):
+            return self
+        added = AtomTypeTable(
+            self.type_names,
+            [handles[row] for row in rows],
+            [type_ids[row] for row in rows],
+            **{name: np.asarray(values)[rows] for name, values in columns.items()})
+        arrays, _ = self._merge_arrays(added)
+        table = AtomTypeTable.from_arrays(self.type_names, arrays)
+        if self.type_order is not None:
+            table.build_type_index()
+        return table
+
+    def position(self, handle: str) -> int:
+        return self.index.position(handle)
+
+    def positions(self, handles: List[str]) -> np.ndarray:
+        return self.index.positions(handles)
+
+    def contains(self, handle: str) -> bool:
+        return self.index.contains(handle)
+
+    def get_type(self, handle: str) -> Optional[str]:
+        position = self.index.position(handle)
+        if position < 0:
+            return None
+        return self.type_name_at(position)
+
+    def type_name_at(self, position: int) -> str:
+        return self.type_names.get_name(int(self.index.columns['type_id'][position]))
+
+    def positions_of_type(self, type_name: str) -> np.ndarray:
+        type_id = self.type_names.get_id(type_name)
+        if type_id is None:
+            return np.zeros(0, dtype=np.int64)
+        if self.type_order is not None:
+            if type_id + 1 >= len(self.type_offsets):
+                # Type interned after the type index was built
+                return np.zeros(0, dtype=np.int64)
+            return self.type_order[self.type_offsets[type_id]:self.type_offsets[type_id + 1]]
+        return np.flatnonzero(self.index.columns['type_id'] == type_id)
+
+    def count_of_type(self, type_name: str) -> int:
+        type_id = self.type_names.get_id(type_name)
+        if type_id is None:
+            return 0
+        if self.type_order is not None:
+            if type_id + 1 >= len(self.type_offsets):
+                return 0
+            return int(self.type_offsets[type_id + 1] - self.type_offsets[type_id])
+        return int(np.count_nonzero(self.index.columns['type_id'] == type_id))
+
+    def handles_at(self, positions: np.ndarray) -> List[str]:
+        return digests_to_handles(self.index.keys[positions])
+
+class NodeTable(AtomTypeTable):
+
+    def __init__(self, type_names: TypeNameTable, handles: List[str], type_ids: List[int], names: List[str]):
+        # 'row' puts names in the order of the sorted handles
+        super().__init__(type_names, handles, type_ids, row=np.arange(len(handles), dtype=np.int64))
+        rows = self.index.columns.pop('row')
+        self.names = StringColumn([names[row] for row in rows])
+
+    @classmethod
+    def from_arrays(cls, type_names: TypeNameTable, arrays: Dict[str, np.ndarray]) -> 'NodeTable':
+        arrays = dict(arrays)
+        names = StringColumn.from_arrays(arrays.pop('name_offsets'), arrays.pop('name_buffer'))
+        table = super().from_arrays(type_names, arrays)
+        table.names = names
+        return table
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            **super().to_arrays(),
+            'name_offsets': self.names.offsets,
+            'name_buffer': self.names.buffer,
+        }
+
+    def merged(self, handles: List[str], type_ids: List[int], names: List[str]) -> 'NodeTable':
+        rows = self._new_rows(handles)
+        if not len(rows):
+            return self
+        added = NodeTable(
+            self.type_names,
+            [handles[row] for row in rows],
+            [type_ids[row] for row in rows],
+            [names[row] for row in rows])
+        arrays, order = self._merge_arrays(added)
+        name_starts = np.concatenate([
+            self.names.offsets[:-1],
+            added.names.offsets[:-1] + len(self.names.buffer)])[order]
+        name_sizes = np.concatenate([np.diff(self.names.offsets), np.diff(added.names.offsets)])[order]
+        arrays['name_offsets'] = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(name_sizes, out=arrays['name_offsets'][1:])
+        arrays['name_buffer'] = np.concatenate([self.names.buffer, added.names.buffer])[gather_ranges(name_starts, name_sizes)]
+        table = NodeTable.from_arrays(self.type_names, arrays)
+        if self.type_order is not None:
+            table.build_type_index()
+        return table
+
+    def name_at(self, position: int) -> str:
+        return self.names[position]
+
+    def names_at(self, positions: np.ndarray) -> List[str]:
+        return [self.names[position] for position in positions]
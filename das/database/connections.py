@@ -0,0 +1,97 @@
+import os
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple, Union
+
+import redis
+import redis.cluster
+import pymongo
+
+from das.logger import logger
+
+# Clients are shared by the DistributedAtomSpaces connected to the same endpoint
+
+MONGODB_MAX_POOL_SIZE = int(os.environ.get('DAS_MONGODB_MAX_POOL_SIZE', 100))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get('DAS_MONGODB_CONNECT_TIMEOUT_MS', 20000))
+# 0 means no timeout
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get('DAS_MONGODB_SOCKET_TIMEOUT_MS', 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get('DAS_MONGODB_MAX_IDLE_TIME_MS', 0))
+
+# Per Redis node. Unbounded unless it's set.
+REDIS_MAX_CONNECTIONS = int(os.environ['DAS_REDIS_MAX_CONNECTIONS']) if os.environ.get('DAS_REDIS_MAX_CONNECTIONS') else None
+REDIS_POOL_TIMEOUT = float(os.environ.get('DAS_REDIS_POOL_TIMEOUT', 20))
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('DAS_REDIS_CONNECT_TIMEOUT', 20))
+# 0 means no timeout
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('DAS_REDIS_SOCKET_TIMEOUT', 0))
+REDIS_SOCKET_KEEPALIVE = os.environ.get('DAS_REDIS_SOCKET_KEEPALIVE', 'true').lower() == 'true'
+# 0 disables the health checks
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('DAS_REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+MongoEndpoint = Tuple[str, str, str, str]
+RedisEndpoint = Tuple[str, str, bool]
+
+_lock = Lock()
+_mongo_clients: Dict[MongoEndpoint, pymongo.MongoClient] = {}
+_redis_clients: Dict[RedisEndpoint, Union[redis.Redis, redis.cluster.RedisCluster]] = {}
+
+def get_mongo_client(hostname: str, port: str, username: str, password: str) -> pymongo.MongoClient:
+    endpoint = (hostname, port, username, password)
+    with _lock:
+        client = _mongo_clients.get(endpoint, None)
+        if client is None:
+            logger().info(f"Connecting to MongoDB at {hostname}:{port}")
+            client = pymongo.MongoClient(
+                f'mongodb://{username}:{password}@{hostname}:{port}',
+                maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS or None,
+                maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS or None)
+            _mongo_clients[endpoint] = client
+        return client
+
+def _redis_parameters(hostname: str, port: str, cluster: bool, blocking_pool_class: Optional[type]) -> Dict[str, Any]:
+    parameters = dict(
+        host=hostname,
+        port=port,
+        decode_responses=False,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT or None,
+        socket_keepalive=REDIS_SOCKET_KEEPALIVE,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL)
+    if REDIS_MAX_CONNECTIONS:
+        if cluster:
+            parameters['max_connections'] = REDIS_MAX_CONNECTIONS
+        else:
+            pool = blocking_pool_class(max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT, **parameters)
+            parameters = dict(connection_pool=pool)
+    return parameters
+
+def get_redis_client(hostname: str, port: str, cluster: bool) -> Union[redis.Redis, redis.cluster.RedisCluster]:
+    endpoint = (hostname, port, cluster)
+    with _lock:
+        client = _redis_clients.get(endpoint, None)
+        if client is None:
+            parameters = _redis_parameters(hostname, port, cluster, redis.BlockingConnectionPool)
+            if cluster:
+                logger().info(f"Connecting to Redis cluster at {hostname}:{port}")
+                client = redis.cluster.RedisCluster(**parameters)
+            else:
+                logger().info(f"Connecting to standalone Redis at {hostname}:{port}")
+                client = redis.Redis(**parameters)
+            _redis_clients[endpoint] = client
+        return client
+
+def new_async_redis_client(hostname: str, port: str, cluster: bool):
+    # Not shared: asyncio clients are bound to their event loop
+    import redis.asyncio
+    parameters = _redis_parameters(hostname, port, cluster, redis.asyncio.BlockingConnectionPool)
+    if cluster:
+        return redis.asyncio.RedisCluster(**parameters)
+    return redis.asyncio.Redis(**parameters)
+
+def close_connections() -> None:
+    # DistributedAtomSpaces created before can't be used afterwards
+    with _lock:
+        for client in [*_mongo_clients.values(), *_redis_clients.values()]:
+            client.close()
+        _mongo_clients.clear()
+        _redis_clients.clear()
@@ -0,0 +1,50 @@
+import os
+import pytest
+import redis
+
+from das.database import connections
+from das.database.connections import get_mongo_client, get_redis_client, close_connections
+from das.distributed_atom_space import DistributedAtomSpace
+
+def _endpoints():
+    return (
+        (os.environ.get('DAS_MONGODB_HOSTNAME'), os.environ.get('DAS_MONGODB_PORT')),
+        (os.environ.get('DAS_REDIS_HOSTNAME'), os.environ.get('DAS_REDIS_PORT')),
+    )
+
+def test_shared_clients():
+    (mongo_hostname, mongo_port), (redis_hostname, redis_port) = _endpoints()
+    username = os.environ.get('DAS_DATABASE_USERNAME')
+    password = os.environ.get('DAS_DATABASE_PASSWORD')
+    mongo_client = get_mongo_client(mongo_hostname, mongo_port, username, password)
+    assert get_mongo_client(mongo_hostname, mongo_port, username, password) is mongo_client
+    redis_client = get_redis_client(redis_hostname, redis_port, False)
+    assert get_redis_client(redis_hostname, redis_port, False) is redis_client
+    das1 = DistributedAtomSpace(database_name='das')
+    das2 = DistributedAtomSpace(database_name='das')
+    assert das1.redis is das2.redis is redis_client
+    assert das1.mongo_db.client is das2.mongo_db.client
+    assert das1.db is not das2.db
+
+def test_redis_connection_limit(monkeypatch):
+    (_, _), (redis_hostname, redis_port) = _endpoints()
+    monkeypatch.setattr(connections, 'REDIS_MAX_CONNECTIONS', None)
+    parameters = connections._redis_parameters(redis_hostname, redis_port, False, redis.BlockingConnectionPool)
+    assert 'max_connections' not in parameters and 'connection_pool' not in parameters
+    monkeypatch.setattr(connections, 'REDIS_MAX_CONNECTIONS', 2)
+    parameters = connections._redis_parameters(redis_hostname, redis_port, False, redis.BlockingConnectionPool)
+    pool = parameters['connection_pool']
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == 2
+    assert pool.timeout == connections.REDIS_POOL_TIMEOUT
+    parameters = connections._redis_parameters(redis_hostname, redis_port, True, redis.BlockingConnectionPool)
+    assert parameters['max_connections'] == 2
+
+def test_close_connections(monkeypatch):
+    monkeypatch.setattr(connections, '_mongo_clients', {})
+    monkeypatch.setattr(connections, '_redis_clients', {})
+    (_, _), (redis_hostname, redis_port) = _endpoints()
+    redis_client = get_redis_client(redis_hostname, redis_port, False)
+    close_connections()
+    assert not connections._redis_clients
+    assert get_redis_client(redis_hostname, redis_port, False) is not redis_client
@@ -1,9 +1,19 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Callable
 
 WILDCARD = '*'
 UNORDERED_LINK_TYPES = ['Similarity', 'Set']
 
+def _iterate_pages(get_page: Callable[..., Tuple[int, List[Any]]], *args, page_size: Optional[int] = None) -> Iterator[Any]:
+    # Cursors follow the SSCAN convention: 0 starts a scan and is returned
+    # when the last page is reached
+    cursor = 0
+    while True:
+        cursor, page = get_page(*args, cursor=cursor, page_size=page_size)
+        yield from page
+        if cursor == 0:
+            return
+
 class DBInterface(ABC):
     """
     TODO: documentation
@@ -56,16 +66,77 @@ class DBInterface(ABC):
         pass
 
     @abstractmethod
-    def get_matched_node_name(self, node_type: str, substring: str) -> str:
+    def get_matched_node_name(self, node_type: str, substring: str, prefix: bool = False, case_sensitive: bool = True) -> str:
         pass
 
     #############################
 
+    def get_matched_links_many(self, patterns: List[Tuple[str, List[str]]]) -> List[List[Any]]:
+        return [self.get_matched_links(link_type, target_handles) for link_type, target_handles in patterns]
+
+    def get_link_targets_many(self, handles: List[str]) -> List[List[str]]:
+        return [self.get_link_targets(handle) for handle in handles]
+
+    # Paged variants of get_matched_*(). Each call returns (cursor, page) and
+    # the scan is over when the returned cursor is 0. Pages may be empty and,
+    # as with SSCAN, an element may be returned more than once.
+
+    def get_matched_links_page(self, link_type: str, target_handles: List[str], cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        return 0, self.get_matched_links(link_type, target_handles) if cursor == 0 else []
+
+    def get_matched_type_template_page(self, template: List[Any], cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        return 0, self.get_matched_type_template(template) if cursor == 0 else []
+
+    def get_matched_type_page(self, link_named_type: str, cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        return 0, self.get_matched_type(link_named_type) if cursor == 0 else []
+
+    def iter_matched_links(self, link_type: str, target_handles: List[str], page_size: Optional[int] = None) -> Iterator[Any]:
+        return _iterate_pages(self.get_matched_links_page, link_type, target_handles, page_size=page_size)
+
+    def iter_matched_type_template(self, template: List[Any], page_size: Optional[int] = None) -> Iterator[Any]:
+        return _iterate_pages(self.get_matched_type_template_page, template, page_size=page_size)
+
+    def iter_matched_type(self, link_named_type: str, page_size: Optional[int] = None) -> Iterator[Any]:
+        return _iterate_pages(self.get_matched_type_page, link_named_type, page_size=page_size)
+
+    def count_matched_links(self, link_type: str, target_handles: List[str]) -> int:
+        return len(self.get_matched_links(link_type, target_handles))
+
+    def count_matched_links_many(self, patterns: List[Tuple[str, List[str]]]) -> List[int]:
+        return [self.count_matched_links(link_type, target_handles) for link_type, target_handles in patterns]
+
+    def count_matched_type_template(self, template: List[Any]) -> int:
+        return len(self.get_matched_type_template(template))
+
+    def count_matched_type(self, link_named_type: str) -> int:
+        return len(self.get_matched_type(link_named_type))
+
+    def invalidate_key_value(self, prefix: str, key: str) -> None:
+        pass
+
+    def invalidate_key_values(self) -> None:
+        pass
+
+    def count_nodes(self, node_type: str) -> int:
+        return len(self.get_all_nodes(node_type))
+
+    def get_node_type(self, node_handle: str) -> str:
+        node = self.get_atom_as_dict(node_handle, 0)
+        if not node or "name" not in node:
+            raise ValueError(f"Invalid handle: {node_handle}")
+        return node["type"]
+
     def get_atom_as_dict(self, handle: str, arity: int):
         pass
 
+    def get_atoms_as_dict(self, handles: List[str], arity: int = -1) -> List[Dict]:
+        return [self.get_atom_as_dict(handle, arity) for handle in handles]
+
     def get_atom_as_deep_representation(self, handle: str, arity: int):
         pass
 
+    def get_atoms_as_deep_representation(self, handles: List[str], arity: int = -1) -> List[Dict]:
+        return [self.get_atom_as_deep_representation(handle, arity) for handle in handles]
+
     def count_atoms(self):
         pass
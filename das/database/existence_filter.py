@@ -0,0 +1,64 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+
+from das.database.handle_index import HandleIndex, handles_to_digests, HANDLE_HEX_SIZE
+
+def _bit_masks(positions: np.ndarray) -> np.ndarray:
+    return np.left_shift(np.uint64(1), positions & np.uint64(7)).astype(np.uint8)
+
+class BloomFilter:
+    # Handles are MD5 digests, so bit positions are derived from the two
+    # halves of the digest (h1 + i * h2) with no extra hashing
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.bit_count = max(int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))), 8)
+        self.hash_count = max(int(round((self.bit_count / capacity) * math.log(2))), 1)
+        self.bits = np.zeros((self.bit_count + 7) // 8, dtype=np.uint8)
+        self._steps = np.arange(self.hash_count, dtype=np.uint64)
+
+    def _bit_positions(self, digests: np.ndarray) -> np.ndarray:
+        halves = np.ascontiguousarray(digests).view('<u8').reshape(-1, 2)
+        h1 = halves[:, 0:1]
+        h2 = halves[:, 1:2] | np.uint64(1)
+        return (h1 + self._steps * h2) % np.uint64(self.bit_count)
+
+    def add_many(self, handles: List[str]) -> None:
+        self.add_digests(handles_to_digests(handles))
+
+    def add_digests(self, digests: np.ndarray) -> None:
+        if not len(digests):
+            return
+        positions = self._bit_positions(digests).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), _bit_masks(positions))
+
+    def __contains__(self, handle: str) -> bool:
+        if not isinstance(handle, str) or len(handle) != HANDLE_HEX_SIZE:
+            return False
+        positions = self._bit_positions(handles_to_digests([handle])).ravel()
+        return bool(np.all(self.bits[positions >> np.uint64(3)] & _bit_masks(positions)))
+
+class ExistenceFilter:
+    # check() answers None when the DB has to confirm a positive
+
+    def __init__(self, digests: np.ndarray, exact: Optional[HandleIndex] = None, false_positive_rate: float = 0.01):
+        self.bloom_filter = BloomFilter(len(digests), false_positive_rate)
+        self.bloom_filter.add_digests(digests)
+        self.exact = exact
+        # Handles added after the filter was built (not in exact)
+        self.added = set()
+
+    def add(self, handles: List[str]) -> None:
+        self.bloom_filter.add_many(handles)
+        self.added.update(handles)
+
+    def check(self, handle: str) -> Optional[bool]:
+        if handle not in self.bloom_filter:
+            return False
+        if handle in self.added:
+            return True
+        if self.exact is not None:
+            return self.exact.contains(handle)
+        return None
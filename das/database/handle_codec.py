@@ -0,0 +1,72 @@
+import os
+from typing import Any, Dict, List, Union
+
+from das.database.handle_index import HANDLE_SIZE, HANDLE_HEX_SIZE
+from das.database.key_value_schema import CollectionNames as KeyPrefix
+from das.database.member_codec import encode_members
+from das.database.mongo_schema import FieldNames as MongoFieldNames
+
+# Stores handles as 16 byte digests in Redis and MongoDB. Loaders and readers
+# of the same DB must use the same setting.
+USE_BINARY_HANDLES = os.environ.get('DAS_BINARY_HANDLES', 'false').lower() == 'true'
+
+StoredHandle = Union[str, bytes]
+
+HANDLE_FIELDS = [MongoFieldNames.ID_HASH, MongoFieldNames.TYPE, MongoFieldNames.TYPE_NAME_HASH]
+
+def _is_handle(handle: Any) -> bool:
+    return isinstance(handle, str) and len(handle) == HANDLE_HEX_SIZE
+
+def encode_handle(handle: str) -> StoredHandle:
+    if USE_BINARY_HANDLES and _is_handle(handle):
+        return bytes.fromhex(handle)
+    return handle
+
+def encode_handles(handles: List[str]) -> List[StoredHandle]:
+    if not USE_BINARY_HANDLES:
+        return handles
+    return [encode_handle(handle) for handle in handles]
+
+def decode_handle(handle: StoredHandle) -> str:
+    # Hex handles read from Redis are bytes too
+    if isinstance(handle, bytes):
+        return handle.hex() if len(handle) == HANDLE_SIZE else handle.decode()
+    return handle
+
+def _map_composite_type(composite_type: List[Any], function) -> List[Any]:
+    return [
+        _map_composite_type(element, function) if isinstance(element, list) else function(element)
+        for element in composite_type
+    ]
+
+def _map_document(document: Dict[str, Any], function) -> Dict[str, Any]:
+    answer = dict(document)
+    for field in HANDLE_FIELDS:
+        if field in answer:
+            answer[field] = function(answer[field])
+    if MongoFieldNames.KEYS in answer:
+        answer[MongoFieldNames.KEYS] = [function(key) for key in answer[MongoFieldNames.KEYS]]
+    if MongoFieldNames.COMPOSITE_TYPE in answer:
+        answer[MongoFieldNames.COMPOSITE_TYPE] = _map_composite_type(answer[MongoFieldNames.COMPOSITE_TYPE], function)
+    for field in answer:
+        if field.startswith(f'{MongoFieldNames.KEY_PREFIX.value}_'):
+            answer[field] = function(answer[field])
+    return answer
+
+def encode_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    if not USE_BINARY_HANDLES:
+        return document
+    return _map_document(document, encode_handle)
+
+def decode_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    if not USE_BINARY_HANDLES or document is None:
+        return document
+    return _map_document(document, decode_handle)
+
+def encode_redis_members(prefix: str, values: List[Any]) -> List[Any]:
+    if prefix in [KeyPrefix.PATTERNS, KeyPrefix.TEMPLATES]:
+        return encode_members(values)
+    elif prefix == KeyPrefix.NAMED_ENTITIES:
+        return values
+    else:
+        return encode_handles(values)
@@ -0,0 +1,132 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+HANDLE_SIZE = 16
+HANDLE_HEX_SIZE = 2 * HANDLE_SIZE
+
+def handles_to_digests(handles: List[str]) -> np.ndarray:
+    if not handles:
+        return np.zeros((0, HANDLE_SIZE), dtype=np.uint8)
+    return np.frombuffer(bytes.fromhex("".join(handles)), dtype=np.uint8).reshape(-1, HANDLE_SIZE)
+
+def digests_to_handles(digests: np.ndarray) -> List[str]:
+    text = np.ascontiguousarray(digests).tobytes().hex()
+    return [text[i:i + HANDLE_HEX_SIZE] for i in range(0, len(text), HANDLE_HEX_SIZE)]
+
+def _as_keys(digests: np.ndarray) -> np.ndarray:
+    # 'S16' keys sort for np.searchsorted(). Compare them as arrays: numpy
+    # strips trailing zero bytes from the elements it returns.
+    return np.ascontiguousarray(digests).view(f'S{HANDLE_SIZE}').reshape(-1)
+
+class HandleIndex:
+    # Sorted handle digests with parallel value columns
+
+    def __init__(self, handles: List[str], **columns):
+        keys = _as_keys(handles_to_digests(handles))
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+
+    @classmethod
+    def from_sorted(cls, keys: np.ndarray, **columns) -> 'HandleIndex':
+        index = cls.__new__(cls)
+        index.keys = keys
+        index.columns = dict(columns)
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _handle_key(self, handle: str) -> Optional[np.ndarray]:
+        if not isinstance(handle, str) or len(handle) != HANDLE_HEX_SIZE:
+            return None
+        try:
+            return np.array([bytes.fromhex(handle)], dtype=f'S{HANDLE_SIZE}')
+        except ValueError:
+            return None
+
+    def position(self, handle: str) -> int:
+        key = self._handle_key(handle)
+        if key is None or not len(self.keys):
+            return -1
+        position = int(np.searchsorted(self.keys, key[0]))
+        if position < len(self.keys) and self.keys[position] == key[0]:
+            return position
+        return -1
+
+    def positions(self, handles: List[str]) -> np.ndarray:
+        answer = np.full(len(handles), -1, dtype=np.int64)
+        valid = [i for i, handle in enumerate(handles) if self._handle_key(handle) is not None]
+        if not valid or not len(self.keys):
+            return answer
+        keys = _as_keys(handles_to_digests([handles[i] for i in valid]))
+        found = np.searchsorted(self.keys, keys)
+        clipped = np.minimum(found, len(self.keys) - 1)
+        hit = self.keys[clipped] == keys
+        answer[np.asarray(valid)[hit]] = found[hit]
+        return answer
+
+    def contains(self, handle: str) -> bool:
+        return self.position(handle) >= 0
+
+    def get(self, handle: str, column: str, default_value=None):
+        position = self.position(handle)
+        if position < 0:
+            return default_value
+        return self.columns[column][position]
+
+class HandleMultimap:
+    # The values of the i-th key are values[offsets[i]:offsets[i + 1]]
+
+    def __init__(self, handles: List[str], values: List[int]):
+        self._build(_as_keys(handles_to_digests(handles)), np.asarray(values, dtype=np.int64))
+
+    @classmethod
+    def from_digests(cls, keys: np.ndarray, values: np.ndarray) -> 'HandleMultimap':
+        multimap = cls.__new__(cls)
+        multimap._build(keys, np.asarray(values, dtype=np.int64))
+        return multimap
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'HandleMultimap':
+        multimap = cls.__new__(cls)
+        multimap.index = HandleIndex.from_sorted(arrays['keys'])
+        multimap.offsets = arrays['offsets']
+        multimap.values = arrays['values']
+        return multimap
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {'keys': self.index.keys, 'offsets': self.offsets, 'values': self.values}
+
+    def _build(self, keys: np.ndarray, values: np.ndarray) -> None:
+        order = np.lexsort((values, keys))
+        keys = keys[order]
+        values = values[order]
+        if len(keys):
+            distinct = np.ones(len(keys), dtype=bool)
+            distinct[1:] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])
+            keys = keys[distinct]
+            values = values[distinct]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(first)
+        self.index = HandleIndex.from_sorted(keys[starts])
+        self.offsets = np.append(starts, len(keys)).astype(np.int64)
+        self.values = values.astype(np.min_scalar_type(int(values.max()))) if len(values) else values
+
+    def __len__(self):
+        return len(self.index)
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.repeat(self.index.keys, np.diff(self.offsets)), self.values.astype(np.int64)
+
+    def get(self, handle: str) -> np.ndarray:
+        position = self.index.position(handle)
+        if position < 0:
+            return self.values[:0]
+        return self.values[self.offsets[position]:self.offsets[position + 1]]
+
+    def count(self, handle: str) -> int:
+        position = self.index.position(handle)
+        return int(self.offsets[position + 1] - self.offsets[position]) if position >= 0 else 0
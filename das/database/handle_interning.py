@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, List, Optional
+
+# Ids are only comparable within a table. Outside an interning_scope(),
+# handles go to a process-wide table which is never released.
+
+class HandleTable:
+    """
+    TODO: documentation
+    """
+
+    __slots__ = ('lock', 'handle_ids', 'handles')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.handle_ids: Dict[str, int] = {}
+        self.handles: List[str] = []
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __deepcopy__(self, memo):
+        # Copies of an assignment share the table of its ids
+        return self
+
+    def intern(self, handle: str) -> int:
+        handle_id = self.handle_ids.get(handle, None)
+        if handle_id is None:
+            with self.lock:
+                handle_id = self.handle_ids.get(handle, None)
+                if handle_id is None:
+                    handle_id = len(self.handles)
+                    self.handles.append(handle)
+                    self.handle_ids[handle] = handle_id
+        return handle_id
+
+    def handle(self, handle_id: int) -> str:
+        return self.handles[handle_id]
+
+_default_table = HandleTable()
+_scope_table: ContextVar[Optional[HandleTable]] = ContextVar('handle_table', default=None)
+
+def current_table() -> HandleTable:
+    table = _scope_table.get()
+    return _default_table if table is None else table
+
+@contextmanager
+def interning_scope():
+    # Also used by asyncio tasks started in the scope
+    token = _scope_table.set(HandleTable())
+    try:
+        yield
+    finally:
+        _scope_table.reset(token)
+
+def intern_handle(handle: str) -> int:
+    return current_table().intern(handle)
+
+def intern_handles(handles: List[str]) -> List[int]:
+    table = current_table()
+    return [table.intern(handle) for handle in handles]
+
+def handle_from_id(handle_id: int) -> str:
+    return current_table().handle(handle_id)
+
+def interned_count() -> int:
+    return len(current_table())
@@ -1,4 +1,6 @@
+import os
 from enum import Enum
+from typing import Any, List, Optional, Union
 
 class CollectionNames(str, Enum):
     INCOMING_SET = 'incomming_set'
@@ -7,5 +9,64 @@ class CollectionNames(str, Enum):
     TEMPLATES = 'templates'
     NAMED_ENTITIES = 'names'
 
-def build_redis_key(prefix, key):
+class KeyLayout(str, Enum):
+    # prefix:key
+    FLAT = 'flat'
+    # prefix:{tag}:key (or prefix:{key} when the tag is the key itself). Only
+    # the part between braces is hashed by Redis Cluster, so keys sharing a
+    # tag are stored in the same slot.
+    HASH_TAG = 'hash_tag'
+
+# The layout is a property of the stored data so loaders and readers of the
+# same DB must use the same setting.
+REDIS_KEY_LAYOUT = KeyLayout(os.environ.get('DAS_REDIS_KEY_LAYOUT', KeyLayout.FLAT.value))
+
+# Separates the tag from the key in the temporary key-value files written by
+# the loaders. It's not an hex digit so it can't be mistaken for a handle.
+KEY_TAG_SEPARATOR = '/'
+
+RedisKey = Union[str, bytes]
+
+# Set to a new random value by the loaders each time they write to the DB so
+# readers can tell a reloaded DB apart from the one they've cached
+LOAD_MARKER_KEY = 'das_load_marker'
+
+def pattern_key_tag(pattern: List[str], wildcard: str) -> str:
+    """
+    Tag of the key of the pattern [link_type_hash, target_handles...]. Pattern
+    keys of the same link type share the tag. Patterns with a wildcard link
+    type would all fall in the same slot so they are tagged by their first
+    non-wildcard target instead.
+    """
+    for handle in pattern:
+        if handle != wildcard:
+            return handle
+    return wildcard
+
+def template_key_tag(template: List[Any]) -> Optional[str]:
+    # Templates are tagged by the named type hash of the link type
+    return template[0] if template and isinstance(template[0], str) else None
+
+def split_tagged_key(key: str):
+    tag, separator, key = key.rpartition(KEY_TAG_SEPARATOR)
+    return key, (tag if separator else None)
+
+def _as_bytes(value: RedisKey) -> bytes:
+    return value if isinstance(value, bytes) else value.encode()
+
+def build_redis_key(prefix, key: RedisKey, tag: Optional[RedisKey] = None) -> RedisKey:
+    if isinstance(key, bytes) or isinstance(tag, bytes):
+        # Binary handle (see handle_codec.USE_BINARY_HANDLES)
+        key = _as_bytes(key)
+        if REDIS_KEY_LAYOUT == KeyLayout.HASH_TAG:
+            if tag is None or _as_bytes(tag) == key:
+                key = b"{" + key + b"}"
+            else:
+                key = b"{" + _as_bytes(tag) + b"}:" + key
+        return prefix.encode() + b":" + key
+    if REDIS_KEY_LAYOUT == KeyLayout.HASH_TAG:
+        if tag is None or tag == key:
+            key = "{" + key + "}"
+        else:
+            key = "{" + tag + "}:" + key
     return prefix + ":" + key
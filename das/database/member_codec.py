@@ -0,0 +1,144 @@
+import pickle
+import sys
+from collections.abc import Sequence
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from das.database.handle_index import HANDLE_SIZE, HANDLE_HEX_SIZE
+
+# Binary members are MEMBER_HEADER | link digest | target digests. Pickled
+# members start with 0x80 so both formats can be in the same set.
+MEMBER_MAGIC = 0xDA
+MEMBER_FORMAT_VERSION = 1
+MEMBER_HEADER = bytes([MEMBER_MAGIC, MEMBER_FORMAT_VERSION])
+MEMBER_HEADER_SIZE = len(MEMBER_HEADER)
+
+USE_BINARY_MEMBERS = True
+
+def _is_handle(handle: Any) -> bool:
+    return isinstance(handle, str) and len(handle) == HANDLE_HEX_SIZE
+
+def encode_member(link_handle: str, targets: Tuple[str, ...]) -> bytes:
+    if not USE_BINARY_MEMBERS or not _is_handle(link_handle) or not all(_is_handle(t) for t in targets):
+        return pickle.dumps((link_handle, tuple(targets)))
+    return MEMBER_HEADER + bytes.fromhex(link_handle + "".join(targets))
+
+def encode_members(values: List[Tuple[str, Tuple[str, ...]]]) -> List[bytes]:
+    return [encode_member(link_handle, targets) for link_handle, targets in values]
+
+def _digest_arrays(groups: Dict[int, List[bytes]]) -> Dict[int, np.ndarray]:
+    answer = {}
+    for size, group in groups.items():
+        atom_count = (size - MEMBER_HEADER_SIZE) // HANDLE_SIZE
+        data = np.frombuffer(b"".join(group), dtype=np.uint8).reshape(len(group), size)
+        answer[atom_count - 1] = data[:, MEMBER_HEADER_SIZE:].reshape(len(group), atom_count, HANDLE_SIZE)
+    return answer
+
+def member_digests(members: List[bytes]) -> Dict[int, np.ndarray]:
+    # arity -> (N, arity + 1, 16) uint8 view of the binary members
+    groups = {}
+    for member in members:
+        if member[0] == MEMBER_MAGIC:
+            groups.setdefault(len(member), []).append(member)
+    return _digest_arrays(groups)
+
+def _hex_column(digests: np.ndarray) -> List[str]:
+    text = digests.tobytes().hex()
+    return [text[start:start + HANDLE_HEX_SIZE] for start in range(0, len(text), HANDLE_HEX_SIZE)]
+
+def _hex_members(data: np.ndarray) -> Iterator[Tuple[str, Tuple[str, ...]]]:
+    # One hex conversion per column instead of one per handle
+    links = _hex_column(data[:, 0])
+    targets = [_hex_column(data[:, column]) for column in range(1, data.shape[1])]
+    return zip(links, zip(*targets)) if targets else ((link, ()) for link in links)
+
+class MemberArray(Sequence):
+    """
+    TODO: documentation
+    """
+
+    # Digests are converted to hex when read. others has the members which
+    # can't be encoded as digests.
+    __slots__ = ('digests', 'others')
+
+    def __init__(self, digests: Dict[int, np.ndarray], others: List[Tuple[Any, Any]] = ()):
+        self.digests = {arity: data for arity, data in digests.items() if len(data)}
+        self.others = list(others)
+
+    def __len__(self):
+        return sum(len(data) for data in self.digests.values()) + len(self.others)
+
+    def __iter__(self):
+        for data in self.digests.values():
+            yield from _hex_members(data)
+        yield from self.others
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        for data in self.digests.values():
+            if 0 <= index < len(data):
+                return next(_hex_members(data[index:index + 1]))
+            index -= len(data)
+        if index < 0:
+            raise IndexError(index)
+        return self.others[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, MemberArray)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(data.nbytes for data in self.digests.values()) + \
+            sys.getsizeof(self.others)
+
+    def targets(self, positions: List[int]) -> Iterator[Tuple[Any, ...]]:
+        # Targets at positions of each member. Only those are converted to hex.
+        for data in self.digests.values():
+            columns = [_hex_column(data[:, 1 + position]) for position in positions]
+            yield from zip(*columns) if columns else (() for _ in range(len(data)))
+        for _, targets in self.others:
+            yield tuple(targets[position] for position in positions)
+
+def concat_members(groups: List[Any]) -> MemberArray:
+    # groups are MemberArrays or lists of (link, targets) tuples
+    digests = {}
+    others = []
+    for group in groups:
+        if isinstance(group, MemberArray):
+            for arity, data in group.digests.items():
+                digests.setdefault(arity, []).append(data)
+            others.extend(group.others)
+        else:
+            others.extend(group)
+    return MemberArray({arity: np.concatenate(arrays) for arity, arrays in digests.items()}, others)
+
+def decode_members(members: List[bytes]) -> MemberArray:
+    groups = {}
+    binary = set()
+    for member in members:
+        if member[0] == MEMBER_MAGIC:
+            groups.setdefault(len(member), []).append(member)
+            binary.add(member)
+    others = []
+    for member in members:
+        if member[0] != MEMBER_MAGIC:
+            link_handle, targets = pickle.loads(member)
+            if _is_handle(link_handle) and all(_is_handle(t) for t in targets):
+                # Sets updated by newer loaders may have both formats
+                member = MEMBER_HEADER + bytes.fromhex(link_handle + "".join(targets))
+                if member not in binary:
+                    groups.setdefault(len(member), []).append(member)
+                    binary.add(member)
+            else:
+                others.append((link_handle, tuple(targets)))
+    return MemberArray(_digest_arrays(groups), dict.fromkeys(others))
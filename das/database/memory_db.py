@@ -0,0 +1,550 @@
+import re
+from itertools import product
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from das.expression import Expression
+from das.expression_hasher import ExpressionHasher
+from das.key_value_file import key_value_generator, key_value_targets_generator
+from das.database.columnar_cache import TypeNameTable, AtomTypeTable, NodeTable, gather_ranges
+from das.database.handle_index import HandleMultimap, HANDLE_SIZE, handles_to_digests, digests_to_handles
+from das.database.key_value_schema import CollectionNames as KeyPrefix, split_tagged_key
+from das.database.mongo_schema import FieldNames as MongoFieldNames
+from das.database.name_index import TrigramIndex
+from das.database.prefetch_snapshot import load_snapshot, save_snapshot
+from das.database.redis_mongo_db import REGEX_METACHARACTERS
+
+from .db_interface import DBInterface, WILDCARD, UNORDERED_LINK_TYPES
+
+# Longer links are only indexed by [WILDCARD, *targets] in the pattern index
+MAX_PATTERN_INDEX_ARITY = 3
+# Default number of links returned by each call of the paged lookups
+MEMORY_SCAN_PAGE_SIZE = 1000
+
+# Tells index files apart from prefetch snapshots
+INDEX_FINGERPRINT = {"index": "memory_db"}
+INDEX_TABLES = ['incoming_set', 'patterns', 'templates']
+
+# (handle, type name, name)
+NodeRecord = Tuple[str, str, str]
+# (handle, type name, composite type, composite type hash, targets)
+LinkRecord = Tuple[str, str, List[Any], str, List[str]]
+# (nodes, links, (pattern hashes, link handles) or None)
+AtomRecords = Tuple[List[NodeRecord], List[LinkRecord], Optional[Tuple[List[str], List[str]]]]
+
+def _pattern_keys(named_type_hash: str, targets: List[str]) -> List[List[str]]:
+    if len(targets) > MAX_PATTERN_INDEX_ARITY:
+        return [[WILDCARD, *targets]]
+    keys = []
+    for mask in product([False, True], repeat=len(targets) + 1):
+        if any(mask):
+            keys.append([WILDCARD if wildcard else handle for handle, wildcard in zip([named_type_hash, *targets], mask)])
+    return keys
+
+class MemoryDB(DBInterface):
+    """
+    TODO: documentation
+    """
+
+    def __init__(self, pattern_black_list: Optional[List[str]] = None):
+        self.pattern_black_list = pattern_black_list if pattern_black_list is not None else []
+        self.clear()
+
+    def __repr__(self):
+        return "<In-memory DB>"
+
+    def clear(self) -> None:
+        self.named_type_hash = {}
+        self.named_type_hash_reverse = {}
+        self.named_types = {}
+        self.symbol_hash = {}
+        self.parent_type = {}
+        self.terminal_hash = {}
+        self.type_documents = {}
+        self.type_names = TypeNameTable()
+        self.nodes = NodeTable(self.type_names, [], [], [])
+        self.nodes.build_type_index()
+        self.links = AtomTypeTable(self.type_names, [], [], composite_type_id=np.zeros(0, dtype=np.uint32))
+        self.links.build_type_index()
+        # Targets of the link at position p are targets[target_offsets[p]:target_offsets[p + 1]]
+        self.target_offsets = np.zeros(1, dtype=np.int64)
+        self.targets = np.zeros((0, HANDLE_SIZE), dtype=np.uint8)
+        self.composite_types = []
+        self.composite_type_hashes = []
+        self.incoming_set = HandleMultimap([], [])
+        self.patterns = HandleMultimap([], [])
+        self.templates = HandleMultimap([], [])
+        self.node_name_index = None
+
+    def _get_atom_type_hash(self, atom_type):
+        named_type_hash = self.named_type_hash.get(atom_type, None)
+        if named_type_hash is None:
+            named_type_hash = ExpressionHasher.named_type_hash(atom_type)
+            self.named_type_hash[atom_type] = named_type_hash
+            self.named_type_hash_reverse[named_type_hash] = atom_type
+        return named_type_hash
+
+    # Loading
+
+    def add_type_documents(self, documents: Iterable[Dict]) -> None:
+        # Documents of the atom_types collection
+        for document in documents:
+            self.type_documents[document[MongoFieldNames.ID_HASH]] = document
+        for document in self.type_documents.values():
+            named_type = document[MongoFieldNames.TYPE_NAME]
+            named_type_hash = document[MongoFieldNames.TYPE_NAME_HASH]
+            type_document = self.type_documents.get(document[MongoFieldNames.TYPE], None)
+            self.named_type_hash[named_type] = named_type_hash
+            self.named_type_hash_reverse[named_type_hash] = named_type
+            if type_document is not None:
+                self.named_types[named_type] = type_document[MongoFieldNames.TYPE_NAME]
+                self.parent_type[named_type_hash] = type_document[MongoFieldNames.TYPE_NAME_HASH]
+            self.symbol_hash[named_type] = document[MongoFieldNames.ID_HASH]
+
+    def add_expressions(self, expressions: Iterable[Expression]) -> None:
+        # Expressions built by the parsers
+        type_documents = []
+        nodes = []
+        links = []
+        for expression in expressions:
+            if expression.typedef_name is not None:
+                type_documents.append(expression.to_dict())
+            elif expression.terminal_name is not None:
+                nodes.append((expression.hash_code, expression.named_type, expression.terminal_name))
+            elif expression.elements:
+                links.append((
+                    expression.hash_code,
+                    expression.named_type,
+                    expression.composite_type,
+                    expression.composite_type_hash,
+                    expression.elements))
+        self.add_type_documents(type_documents)
+        self._add_atoms(nodes, links)
+
+    def load_key_value_files(self, file_names: Dict[str, str], type_documents: Iterable[Dict] = ()) -> None:
+        # File names are keyed by KeyPrefix (see SharedData.temporary_file_name)
+        self.add_atom_records(*self.read_key_value_files(file_names, type_documents))
+
+    def read_key_value_files(self, file_names: Dict[str, str], type_documents: Iterable[Dict] = ()) -> AtomRecords:
+        # Node types aren't in the files, so they're found by hashing the
+        # name with each known type
+        self.add_type_documents(type_documents)
+        nodes = []
+        type_names = list(self.named_type_hash.keys())
+        for handle, names, _ in key_value_generator(file_names[KeyPrefix.NAMED_ENTITIES], merge_rest=True):
+            node_type = self._find_node_type(handle, names[0], type_names)
+            if node_type is not None:
+                nodes.append((handle, node_type, names[0]))
+        link_types = {}
+        link_targets = {}
+        link_composite_type_hashes = {}
+        for key, members, _ in key_value_targets_generator(file_names[KeyPrefix.TEMPLATES]):
+            key, tag = split_tagged_key(key)
+            link_type = self.named_type_hash_reverse.get(key, None) if tag is None else None
+            for link_handle, targets in members:
+                if link_type is not None:
+                    link_types[link_handle] = link_type
+                    link_targets[link_handle] = list(targets)
+                else:
+                    link_composite_type_hashes[link_handle] = key
+        node_type_hashes = {handle: self._get_atom_type_hash(node_type) for handle, node_type, _ in nodes}
+        composite_types = {}
+
+        def composite_type(handle):
+            # [type hash, *composite types of the targets], with node types
+            # in place of the nodes (as built by the parsers)
+            answer = node_type_hashes.get(handle, None) or composite_types.get(handle, None)
+            if answer is None:
+                targets = link_targets.get(handle, None)
+                if targets is None:
+                    return handle
+                answer = [self._get_atom_type_hash(link_types[handle]), *[composite_type(t) for t in targets]]
+                composite_types[handle] = answer
+            return answer
+
+        links = []
+        for link_handle, link_type in link_types.items():
+            links.append((
+                link_handle,
+                link_type,
+                composite_type(link_handle),
+                link_composite_type_hashes.get(link_handle, None),
+                link_targets[link_handle]))
+        patterns = None
+        if file_names.get(KeyPrefix.PATTERNS, None) is not None:
+            pattern_hashes = []
+            pattern_links = []
+            for key, members, _ in key_value_targets_generator(file_names[KeyPrefix.PATTERNS]):
+                key, _ = split_tagged_key(key)
+                for link_handle, _ in members:
+                    pattern_hashes.append(key)
+                    pattern_links.append(link_handle)
+            patterns = (pattern_hashes, pattern_links)
+        return nodes, links, patterns
+
+    def add_atom_records(self, nodes: List[NodeRecord], links: List[LinkRecord], patterns: Optional[Tuple[List[str], List[str]]] = None) -> None:
+        # Records read by read_key_value_files(), possibly from several loads
+        self._add_atoms(nodes, links, patterns)
+
+    def _find_node_type(self, handle: str, name: str, type_names: List[str]) -> Optional[str]:
+        for position, type_name in enumerate(type_names):
+            if ExpressionHasher.terminal_hash(type_name, name) == handle:
+                # Nodes of the same type tend to come together
+                type_names.insert(0, type_names.pop(position))
+                return type_name
+        return None
+
+    def _merge_nodes(self, nodes: List[NodeRecord]) -> None:
+        self.nodes = self.nodes.merged(
+            [record[0] for record in nodes],
+            [self.type_names.intern(record[1]) for record in nodes],
+            [record[2] for record in nodes])
+
+    def _merge_links(self, links: List[LinkRecord]) -> Tuple[List[LinkRecord], List[int], np.ndarray]:
+        # (new links, their positions, new positions of the old links)
+        records = list({record[0]: record for record in links}.values())
+        found = self.links.positions([record[0] for record in records]) >= 0
+        records = [record for record, exists in zip(records, found) if not exists]
+        old = self.links
+        if not records:
+            return records, [], np.arange(len(old), dtype=np.int64)
+        composite_type_ids = {composite_type_hash: i for i, composite_type_hash in enumerate(self.composite_type_hashes)}
+        link_composite_type_ids = []
+        for record in records:
+            composite_type_hash = record[3] if record[3] is not None else str(record[2])
+            composite_type_id = composite_type_ids.get(composite_type_hash, None)
+            if composite_type_id is None:
+                composite_type_id = len(self.composite_types)
+                composite_type_ids[composite_type_hash] = composite_type_id
+                self.composite_types.append(record[2])
+                self.composite_type_hashes.append(composite_type_hash)
+            link_composite_type_ids.append(composite_type_id)
+        added = AtomTypeTable(
+            self.type_names,
+            [record[0] for record in records],
+            [self.type_names.intern(record[1]) for record in records],
+            composite_type_id=np.array(link_composite_type_ids, dtype=np.uint32),
+            row=np.arange(len(records), dtype=np.int64))
+        rows = added.index.columns.pop('row')
+        added_sizes = np.array([len(records[row][4]) for row in rows], dtype=np.int64)
+        added_targets = handles_to_digests([target for row in rows for target in records[row][4]])
+
+        keys = np.concatenate([old.index.keys, added.index.keys])
+        order = np.argsort(keys, kind='stable')
+        type_ids = np.concatenate([old.index.columns['type_id'], added.index.columns['type_id']]).astype(np.int64)
+        composite_type_id = np.concatenate([
+            old.index.columns['composite_type_id'],
+            added.index.columns['composite_type_id']]).astype(np.uint32)
+        target_starts = np.concatenate([
+            self.target_offsets[:-1],
+            np.cumsum(added_sizes) - added_sizes + len(self.targets)])[order]
+        target_sizes = np.concatenate([np.diff(self.target_offsets), added_sizes])[order]
+        self.target_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(target_sizes, out=self.target_offsets[1:])
+        self.targets = np.concatenate([self.targets, added_targets])[gather_ranges(target_starts, target_sizes)]
+        self.links = AtomTypeTable.from_arrays(self.type_names, {
+            'keys': keys[order],
+            'type_id': self.type_names.id_array(type_ids[order]),
+            'composite_type_id': composite_type_id[order],
+        })
+        self.links.build_type_index()
+
+        merged_positions = np.empty(len(order), dtype=np.int64)
+        merged_positions[order] = np.arange(len(order))
+        positions = np.empty(len(records), dtype=np.int64)
+        positions[rows] = merged_positions[len(old):]
+        return records, positions.tolist(), merged_positions[:len(old)]
+
+    def _merge_index(self, index: HandleMultimap, position_map: np.ndarray, keys: List[str], values: List[int]) -> HandleMultimap:
+        # Old positions are translated with position_map
+        new_keys, new_values = HandleMultimap(keys, values).pairs()
+        old_keys, old_values = index.pairs()
+        return HandleMultimap.from_digests(
+            np.concatenate([old_keys, new_keys]),
+            np.concatenate([position_map[old_values], new_values]))
+
+    def _add_atoms(self, nodes: List[NodeRecord], links: List[LinkRecord], patterns: Optional[Tuple[List[str], List[str]]] = None) -> None:
+        # Tables are merged as arrays, in memory even if they're memory mapped
+        self._merge_nodes(nodes)
+        links, positions, position_map = self._merge_links(links)
+        incoming_keys, incoming_values = [], []
+        template_keys, template_values = [], []
+        pattern_keys, pattern_values = [], []
+        for (handle, link_type, _, composite_type_hash, targets), position in zip(links, positions):
+            named_type_hash = self._get_atom_type_hash(link_type)
+            for target in targets:
+                incoming_keys.append(target)
+                incoming_values.append(position)
+            if composite_type_hash is not None:
+                template_keys.append(composite_type_hash)
+                template_values.append(position)
+            template_keys.append(named_type_hash)
+            template_values.append(position)
+            if patterns is None and link_type not in self.pattern_black_list:
+                for key in _pattern_keys(named_type_hash, targets):
+                    pattern_keys.append(ExpressionHasher.composite_hash(key))
+                    pattern_values.append(position)
+        if patterns is not None:
+            pattern_keys, pattern_links = patterns
+            pattern_values = self.links.positions(pattern_links)
+            found = pattern_values >= 0
+            pattern_keys = [key for key, ok in zip(pattern_keys, found) if ok]
+            pattern_values = pattern_values[found]
+        self.incoming_set = self._merge_index(self.incoming_set, position_map, incoming_keys, incoming_values)
+        self.templates = self._merge_index(self.templates, position_map, template_keys, template_values)
+        self.patterns = self._merge_index(self.patterns, position_map, pattern_keys, pattern_values)
+        self.node_name_index = None
+
+    # Index files
+
+    def save_index(self, directory: str) -> None:
+        # One .npy file per array, memory mapped by open_index()
+        arrays = {}
+        arrays.update({f'nodes_{name}': array for name, array in self.nodes.to_arrays().items()})
+        arrays.update({f'links_{name}': array for name, array in self.links.to_arrays().items()})
+        arrays['target_offsets'] = self.target_offsets
+        arrays['targets'] = self.targets
+        for table in INDEX_TABLES:
+            arrays.update({f'{table}_{name}': array for name, array in getattr(self, table).to_arrays().items()})
+        metadata = {
+            "type_names": self.type_names.names,
+            "type_documents": list(self.type_documents.values()),
+            "composite_types": self.composite_types,
+            "composite_type_hashes": self.composite_type_hashes,
+            "pattern_black_list": self.pattern_black_list,
+        }
+        save_snapshot(directory, INDEX_FINGERPRINT, arrays, metadata)
+
+    @classmethod
+    def open_index(cls, directory: str) -> 'MemoryDB':
+        # Tables are memory mapped read-only. Atoms added afterwards are kept in memory.
+        snapshot = load_snapshot(directory, INDEX_FINGERPRINT)
+        if snapshot is None:
+            raise ValueError(f"Invalid index directory: {directory}")
+        arrays, metadata = snapshot
+        db = cls(metadata["pattern_black_list"])
+        db.add_type_documents(metadata["type_documents"])
+        db.type_names = TypeNameTable(metadata["type_names"])
+        tables = {}
+        for name, array in arrays.items():
+            table, _, column = name.partition('_')
+            if table in ['nodes', 'links']:
+                tables.setdefault(table, {})[column] = array
+        db.nodes = NodeTable.from_arrays(db.type_names, tables['nodes'])
+        db.links = AtomTypeTable.from_arrays(db.type_names, tables['links'])
+        db.target_offsets = arrays['target_offsets']
+        db.targets = arrays['targets']
+        db.composite_types = metadata["composite_types"]
+        db.composite_type_hashes = metadata["composite_type_hashes"]
+        for table in INDEX_TABLES:
+            setattr(db, table, HandleMultimap.from_arrays({
+                column: arrays[f'{table}_{column}'] for column in ['keys', 'offsets', 'values']
+            }))
+        return db
+
+    # Lookups
+
+    def _members(self, positions: np.ndarray) -> List[Tuple[str, Tuple[str, ...]]]:
+        # (link handle, (targets...)) of the links at the passed positions,
+        # the same format used by RedisMongoDB
+        if not len(positions):
+            return []
+        positions = np.asarray(positions, dtype=np.int64)
+        link_handles = self.links.handles_at(positions)
+        starts = self.target_offsets[positions]
+        counts = self.target_offsets[positions + 1] - starts
+        targets = digests_to_handles(self.targets[gather_ranges(starts, counts)])
+        answer = []
+        start = 0
+        for link_handle, count in zip(link_handles, counts.tolist()):
+            answer.append((link_handle, tuple(targets[start:start + count])))
+            start += count
+        return answer
+
+    def _targets_at(self, position: int) -> List[str]:
+        return digests_to_handles(self.targets[self.target_offsets[position]:self.target_offsets[position + 1]])
+
+    def _page(self, positions: np.ndarray, cursor: int, page_size: Optional[int]) -> Tuple[int, List[Any]]:
+        end = cursor + (page_size or MEMORY_SCAN_PAGE_SIZE)
+        return (end if end < len(positions) else 0), self._members(positions[cursor:end])
+
+    def _build_named_type_hash_template(self, template: Union[str, List[Any]]) -> List[Any]:
+        if isinstance(template, str):
+            return self._get_atom_type_hash(template)
+        else:
+            return [self._build_named_type_hash_template(element) for element in template]
+
+    def _build_named_type_template(self, template: Union[str, List[Any]]) -> List[Any]:
+        if isinstance(template, str):
+            return self.named_type_hash_reverse.get(template, None)
+        else:
+            return [self._build_named_type_template(element) for element in template]
+
+    def _get_pattern_hash(self, link_type: str, target_handles: List[str]) -> str:
+        link_type_hash = WILDCARD if link_type == WILDCARD else self._get_atom_type_hash(link_type)
+        if link_type in UNORDERED_LINK_TYPES:
+            target_handles = sorted(target_handles)
+        return ExpressionHasher.composite_hash([link_type_hash, *target_handles])
+
+    def _get_template_hash(self, template: List[Any]) -> str:
+        return ExpressionHasher.composite_hash(self._build_named_type_hash_template(template))
+
+    # DB interface methods
+
+    def node_exists(self, node_type: str, node_name: str) -> bool:
+        return self.nodes.contains(self.get_node_handle(node_type, node_name))
+
+    def link_exists(self, link_type: str, target_handles: List[str]) -> bool:
+        return self.links.contains(self.get_link_handle(link_type, target_handles))
+
+    def get_node_handle(self, node_type: str, node_name: str) -> str:
+        return ExpressionHasher.terminal_hash(node_type, node_name)
+
+    def get_link_handle(self, link_type: str, target_handles: List[str]) -> str:
+        return ExpressionHasher.expression_hash(self._get_atom_type_hash(link_type), target_handles)
+
+    def get_link_targets(self, link_handle: str) -> List[str]:
+        position = self.links.position(link_handle)
+        if position < 0:
+            raise ValueError(f"Invalid handle: {link_handle}")
+        return self._targets_at(position)
+
+    def get_incoming_links(self, atom_handle: str) -> List[str]:
+        return self.links.handles_at(self.incoming_set.get(atom_handle).astype(np.int64))
+
+    def is_ordered(self, link_handle: str) -> bool:
+        if not self.links.contains(link_handle):
+            raise ValueError(f'Invalid handle: {link_handle}')
+        return True
+
+    def get_matched_links(self, link_type: str, target_handles: List[str]):
+        if link_type != WILDCARD and WILDCARD not in target_handles:
+            link_handle = self.get_link_handle(link_type, target_handles)
+            return [link_handle] if self.links.contains(link_handle) else []
+        return self._members(self.patterns.get(self._get_pattern_hash(link_type, target_handles)))
+
+    def get_matched_links_page(self, link_type: str, target_handles: List[str], cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        if link_type != WILDCARD and WILDCARD not in target_handles:
+            return super().get_matched_links_page(link_type, target_handles, cursor, page_size)
+        return self._page(self.patterns.get(self._get_pattern_hash(link_type, target_handles)), cursor, page_size)
+
+    def count_matched_links(self, link_type: str, target_handles: List[str]) -> int:
+        if link_type != WILDCARD and WILDCARD not in target_handles:
+            return len(self.get_matched_links(link_type, target_handles))
+        return self.patterns.count(self._get_pattern_hash(link_type, target_handles))
+
+    def get_all_nodes(self, node_type: str, names: bool = False) -> List[str]:
+        positions = self.nodes.positions_of_type(node_type)
+        return self.nodes.names_at(positions) if names else self.nodes.handles_at(positions)
+
+    def count_nodes(self, node_type: str) -> int:
+        return self.nodes.count_of_type(node_type)
+
+    def get_matched_type_template(self, template: List[Any]) -> List[str]:
+        return self._members(self.templates.get(self._get_template_hash(template)))
+
+    def get_matched_type_template_page(self, template: List[Any], cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        return self._page(self.templates.get(self._get_template_hash(template)), cursor, page_size)
+
+    def count_matched_type_template(self, template: List[Any]) -> int:
+        return self.templates.count(self._get_template_hash(template))
+
+    def get_matched_type(self, link_type: str) -> List[str]:
+        return self._members(self.templates.get(self._get_atom_type_hash(link_type)))
+
+    def get_matched_type_page(self, link_type: str, cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        return self._page(self.templates.get(self._get_atom_type_hash(link_type)), cursor, page_size)
+
+    def count_matched_type(self, link_type: str) -> int:
+        return self.templates.count(self._get_atom_type_hash(link_type))
+
+    def get_node_name(self, node_handle: str) -> str:
+        position = self.nodes.position(node_handle)
+        if position < 0:
+            raise ValueError(f"Invalid handle: {node_handle}")
+        return self.nodes.name_at(position)
+
+    def get_matched_node_name(self, node_type: str, substring: str, prefix: bool = False, case_sensitive: bool = True) -> str:
+        literal = substring[1:] if substring.startswith('^') else substring
+        if not any(c in REGEX_METACHARACTERS for c in literal):
+            if self.node_name_index is None:
+                self.node_name_index = TrigramIndex(self.nodes)
+            positions = self.node_name_index.search(
+                node_type,
+                literal,
+                prefix=prefix or substring.startswith('^'),
+                case_sensitive=case_sensitive)
+            return self.nodes.handles_at(positions)
+        regex = re.compile(f'^(?:{substring})' if prefix else substring, 0 if case_sensitive else re.IGNORECASE)
+        positions = self.nodes.positions_of_type(node_type)
+        return [
+            handle
+            for handle, name in zip(self.nodes.handles_at(positions), self.nodes.names_at(positions))
+            if regex.search(name)
+        ]
+
+    def get_link_type(self, link_handle: str) -> str:
+        link_type = self.links.get_type(link_handle)
+        if link_type is None:
+            raise ValueError(f"Invalid handle: {link_handle}")
+        return link_type
+
+    def get_link_types_many(self, link_handles: List[str]) -> List[str]:
+        return [self.get_link_type(link_handle) for link_handle in link_handles]
+
+    def get_node_type(self, node_handle: str) -> str:
+        node_type = self.nodes.get_type(node_handle)
+        if node_type is None:
+            raise ValueError(f"Invalid handle: {node_handle}")
+        return node_type
+
+    #################################
+
+    def get_atom_as_dict(self, handle, arity=-1) -> dict:
+        position = self.nodes.position(handle) if arity <= 0 else -1
+        if position >= 0:
+            return {
+                "handle": handle,
+                "type": self.nodes.type_name_at(position),
+                "name": self.nodes.name_at(position),
+            }
+        position = self.links.position(handle)
+        if position >= 0:
+            composite_type_id = int(self.links.index.columns['composite_type_id'][position])
+            return {
+                "handle": handle,
+                "type": self.links.type_name_at(position),
+                "template": self._build_named_type_template(self.composite_types[composite_type_id]),
+                "targets": self._targets_at(position),
+            }
+        return {}
+
+    def get_atom_as_deep_representation(self, handle: str, arity=-1) -> Dict:
+        return self.get_atoms_as_deep_representation([handle], arity)[0]
+
+    def get_atoms_as_deep_representation(self, handles: List[str], arity=-1) -> List[Dict]:
+        # Subtrees shared by many atoms are expanded only once per call
+        expanded = {}
+
+        def expand(handle):
+            answer = expanded.get(handle, None)
+            if answer is None:
+                position = self.nodes.position(handle)
+                if position >= 0:
+                    answer = {"type": self.nodes.type_name_at(position), "name": self.nodes.name_at(position)}
+                else:
+                    position = self.links.position(handle)
+                    if position < 0:
+                        raise ValueError(f"Invalid handle: {handle}")
+                    answer = {
+                        "type": self.links.type_name_at(position),
+                        "targets": [expand(target) for target in self._targets_at(position)],
+                    }
+                expanded[handle] = answer
+            return answer
+
+        return [expand(handle) for handle in handles]
+
+    def count_atoms(self) -> Tuple[int, int]:
+        return (len(self.nodes), len(self.links))
@@ -0,0 +1,294 @@
+import os
+
+import pytest
+import numpy as np
+from pymongo import MongoClient as MongoDBClient
+from redis import Redis
+
+from das.database.db_interface import DBInterface, WILDCARD
+from das.database.handle_index import HandleMultimap
+from das.database.key_value_schema import CollectionNames as KeyPrefix
+from das.database.memory_db import MemoryDB
+from das.database.redis_mongo_db import RedisMongoDB
+from das.distributed_atom_space import DistributedAtomSpace
+from das.key_value_file import write_key_value
+from das.parser_actions import KnowledgeBaseFile
+from das.parser_threads import SharedData, ParserThread, BuildConnectivityThread, BuildPatternsThread, \
+    BuildTypeTemplatesThread
+from das.pattern_matcher.pattern_matcher import CONFIG, And, Link, LinkTemplate, Node, Not, Or, PatternMatchingAnswer, \
+    TypedVariable, Variable
+
+ANIMALS = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'samples', 'animals.metta')
+
+@pytest.fixture()
+def db():
+    hostname = os.environ.get('DAS_MONGODB_HOSTNAME')
+    port = os.environ.get('DAS_MONGODB_PORT')
+    username = os.environ.get('DAS_DATABASE_USERNAME')
+    password = os.environ.get('DAS_DATABASE_PASSWORD')
+    mongo_db = MongoDBClient(f'mongodb://{username}:{password}@{hostname}:{port}')['das']
+    redis = Redis(host=os.environ.get('DAS_REDIS_HOSTNAME'), port=os.environ.get('DAS_REDIS_PORT'), decode_responses=False)
+    db = RedisMongoDB(redis, mongo_db)
+    db.prefetch()
+    return db
+
+@pytest.fixture(scope="module")
+def memory_das():
+    das = DistributedAtomSpace(in_memory=True)
+    das.load_knowledge_base(ANIMALS)
+    return das
+
+def _parse(file_name, shared_data):
+    ParserThread(KnowledgeBaseFile(None, file_name, shared_data)).run()
+    return shared_data
+
+def test_handle_multimap():
+    a = '0' * 31 + 'a'
+    b = '0' * 31 + 'b'
+    multimap = HandleMultimap([b, a, b, a, b], [3, 1, 2, 1, 2])
+    assert len(multimap) == 2
+    assert list(multimap.get(a)) == [1]
+    assert list(multimap.get(b)) == [2, 3]
+    assert multimap.count(b) == 2
+    assert multimap.count('c' * 32) == 0
+    assert len(multimap.get('blah')) == 0
+    keys, values = multimap.pairs()
+    copy = HandleMultimap.from_digests(keys, values)
+    assert list(copy.get(b)) == [2, 3]
+    copy = HandleMultimap.from_arrays(multimap.to_arrays())
+    assert list(copy.get(a)) == [1]
+
+def test_default_get_node_type(memory_das):
+    assert 'get_node_type' not in DBInterface.__abstractmethods__
+    human = memory_das.db.get_node_handle('Concept', 'human')
+    mammal = memory_das.db.get_node_handle('Concept', 'mammal')
+    link = memory_das.db.get_link_handle('Inheritance', [human, mammal])
+    assert DBInterface.get_node_type(memory_das.db, human) == 'Concept'
+    with pytest.raises(ValueError):
+        DBInterface.get_node_type(memory_das.db, link)
+    with pytest.raises(ValueError):
+        DBInterface.get_node_type(memory_das.db, 'blah')
+
+def test_matches_redis_mongo_db(db, memory_das):
+    memory_db = memory_das.db
+    assert memory_db.count_atoms() == db.count_atoms()
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    assert memory_db.get_node_handle('Concept', 'human') == human
+    assert memory_db.node_exists('Concept', 'human')
+    assert not memory_db.node_exists('Concept', 'blah')
+    assert memory_db.link_exists('Inheritance', [human, mammal])
+    assert not memory_db.link_exists('Inheritance', [mammal, human])
+    assert memory_db.get_node_name(human) == 'human'
+    with pytest.raises(ValueError):
+        memory_db.get_node_name('blah')
+    assert sorted(memory_db.get_all_nodes('Concept')) == sorted(db.get_all_nodes('Concept'))
+    assert sorted(memory_db.get_all_nodes('Concept', True)) == sorted(db.get_all_nodes('Concept', True))
+    assert memory_db.count_nodes('Concept') == db.count_nodes('Concept')
+    assert sorted(memory_db.get_matched_node_name('Concept', 'ma')) == sorted(db.get_matched_node_name('Concept', 'ma'))
+    assert sorted(memory_db.get_matched_node_name('Concept', '^h.m')) == [human]
+    assert sorted(memory_db.get_matched_node_name('Concept', 'hu|ma', prefix=True)) == sorted([
+        human, memory_db.get_node_handle('Concept', 'mammal')])
+
+    patterns = [
+        ('Inheritance', [WILDCARD, mammal]),
+        ('Inheritance', [human, WILDCARD]),
+        ('Inheritance', [human, mammal]),
+        ('Inheritance', [mammal, human]),
+        ('Similarity', [WILDCARD, human]),
+        ('Similarity', [human, WILDCARD]),
+        (WILDCARD, [human, WILDCARD]),
+        (WILDCARD, [WILDCARD, WILDCARD]),
+        ('blah', [WILDCARD, mammal]),
+    ]
+    for link_type, targets in patterns:
+        expected = db.get_matched_links(link_type, targets)
+        assert sorted(memory_db.get_matched_links(link_type, targets)) == sorted(expected)
+        assert memory_db.count_matched_links(link_type, targets) == len(expected)
+    assert [sorted(links) for links in memory_db.get_matched_links_many(patterns)] == \
+        [sorted(links) for links in db.get_matched_links_many(patterns)]
+    template = ['Inheritance', 'Concept', 'Concept']
+    assert sorted(memory_db.get_matched_type_template(template)) == \
+        sorted(db.get_matched_type_template(template))
+    assert memory_db.count_matched_type_template(template) == db.count_matched_type_template(template)
+    assert sorted(memory_db.get_matched_type('Similarity')) == sorted(db.get_matched_type('Similarity'))
+    assert memory_db.count_matched_type('Similarity') == db.count_matched_type('Similarity')
+    assert sorted(memory_db.iter_matched_type('Similarity', page_size=5)) == \
+        sorted(db.get_matched_type('Similarity'))
+
+    links = [link for link, _ in db.get_matched_type('Inheritance')]
+    for link in links:
+        assert memory_db.get_link_targets(link) == db.get_atom_as_dict(link)['targets']
+        assert memory_db.get_atom_as_dict(link) == db.get_atom_as_dict(link)
+        assert memory_db.get_atom_as_deep_representation(link) == db.get_atom_as_deep_representation(link)
+        assert memory_db.get_link_type(link) == 'Inheritance'
+    assert memory_db.get_atom_as_dict(human) == db.get_atom_as_dict(human)
+    assert memory_db.get_atom_as_dict('blah') == {}
+    assert memory_db.get_node_type(human) == 'Concept'
+    assert link in memory_db.get_incoming_links(memory_db.get_link_targets(link)[0])
+    with pytest.raises(ValueError):
+        memory_db.get_link_targets(human)
+
+def test_query(db, memory_das):
+    mammal = Node('Concept', 'mammal')
+    queries = [
+        And([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Inheritance', [Variable('V2'), mammal], True),
+            Not(Link('Similarity', [Variable('V1'), Variable('V2')], False)),
+        ]),
+        Or([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Similarity', [Variable('V1'), Node('Concept', 'human')], False),
+        ]),
+    ]
+    for query in queries:
+        expected = PatternMatchingAnswer()
+        answer = PatternMatchingAnswer()
+        assert query.matched(memory_das.db, answer) == query.matched(db, expected)
+        assert answer.assignments == expected.assignments
+        assert answer.negation == expected.negation
+
+def test_query_pattern_black_list():
+    # Links of blacklisted types aren't in the pattern index so templates
+    # looked up with bound values must not use it
+    das = DistributedAtomSpace(in_memory=True)
+    das.pattern_black_list.append('Similarity')
+    das.load_knowledge_base(ANIMALS)
+    assert das.db.get_matched_links('Similarity', [WILDCARD, WILDCARD]) == []
+    query = And([
+        Link('Inheritance', [Variable('V1'), Node('Concept', 'mammal')], True),
+        LinkTemplate('Similarity', [TypedVariable('V1', 'Concept'), TypedVariable('V2', 'Concept')], True),
+    ])
+    answer = PatternMatchingAnswer()
+    assert query.matched(das.db, answer)
+    CONFIG['query_planner'] = False
+    try:
+        expected = PatternMatchingAnswer()
+        assert query.matched(das.db, expected)
+    finally:
+        CONFIG['query_planner'] = True
+    assert answer.assignments == expected.assignments
+
+def test_link_template_bound_lookup(db, memory_das, monkeypatch):
+    template = LinkTemplate('Inheritance', [TypedVariable('V1', 'Concept'), TypedVariable('V2', 'Concept')], True)
+    for database in [db, memory_das.db]:
+        mammal = database.get_node_handle('Concept', 'mammal')
+        animal = database.get_node_handle('Concept', 'animal')
+        human = database.get_node_handle('Concept', 'human')
+        link = database.get_link_handle('Inheritance', [human, mammal])
+        expected = PatternMatchingAnswer()
+        assert template.matched(database, expected)
+        expected = {assignment for assignment in expected.assignments if assignment.mapping['V2'] in [mammal, animal]}
+        # Only the links with the bound values are looked up
+        def no_template_scan(*args):
+            assert False
+        monkeypatch.setattr(database, 'get_matched_type_template', no_template_scan)
+        answer = PatternMatchingAnswer()
+        assert template.matched_bound(database, answer, [{'V2': mammal}, {'V2': animal}, {'V2': link}])
+        assert answer.assignments == expected
+        answer = PatternMatchingAnswer()
+        assert template.matched_bound(database, answer, [{'V1': human, 'V2': mammal}])
+        assert [assignment.mapping for assignment in answer.assignments] == [{'V1': human, 'V2': mammal}]
+        assert not template.matched_bound(database, PatternMatchingAnswer(), [{'V1': mammal, 'V2': human}])
+        assert not LinkTemplate('Inheritance', [TypedVariable('V1', 'blah'), TypedVariable('V2', 'Concept')], True) \
+            .matched_bound(database, PatternMatchingAnswer(), [{'V2': mammal}])
+        monkeypatch.undo()
+
+def test_key_value_files(memory_das, tmp_path):
+    shared_data = SharedData()
+    shared_data.temporary_file_name = {s.value: str(tmp_path / f"{s.value}.txt") for s in KeyPrefix}
+    _parse(ANIMALS, shared_data)
+    shared_data.replicate_regular_expressions()
+    for thread in [BuildConnectivityThread(shared_data), BuildPatternsThread(shared_data), BuildTypeTemplatesThread(shared_data)]:
+        thread.run()
+    with open(shared_data.temporary_file_name[KeyPrefix.NAMED_ENTITIES], "w") as names:
+        for terminal in shared_data.terminals:
+            write_key_value(names, terminal.hash_code, terminal.terminal_name)
+    memory_db = MemoryDB()
+    memory_db.load_key_value_files(
+        shared_data.temporary_file_name,
+        [expression.to_dict() for expression in shared_data.typedef_expressions])
+    expected_db = memory_das.db
+    assert memory_db.count_atoms() == expected_db.count_atoms()
+    for link_type in ['Inheritance', 'Similarity']:
+        for link, _ in expected_db.get_matched_type(link_type):
+            assert memory_db.get_atom_as_dict(link) == expected_db.get_atom_as_dict(link)
+            assert memory_db.get_atom_as_deep_representation(link) == expected_db.get_atom_as_deep_representation(link)
+    for link_type, targets in [('Inheritance', [WILDCARD, WILDCARD]), (WILDCARD, [WILDCARD, WILDCARD])]:
+        assert sorted(memory_db.get_matched_links(link_type, targets)) == \
+            sorted(expected_db.get_matched_links(link_type, targets))
+
+def _assert_same_tables(memory_db, expected_db):
+    for table in ['nodes', 'incoming_set', 'patterns', 'templates']:
+        arrays = getattr(memory_db, table).to_arrays()
+        expected = getattr(expected_db, table).to_arrays()
+        assert arrays.keys() == expected.keys()
+        for name in arrays:
+            assert np.array_equal(arrays[name], expected[name]), (table, name)
+    assert np.array_equal(memory_db.links.index.keys, expected_db.links.index.keys)
+    assert np.array_equal(memory_db.target_offsets, expected_db.target_offsets)
+
+def test_add_expressions(memory_das):
+    # Atoms added in several batches are merged with the ones already there
+    shared_data = _parse(ANIMALS, SharedData())
+    expressions = [*shared_data.typedef_expressions, *shared_data.terminals, *shared_data.regular_expressions]
+    memory_db = MemoryDB()
+    memory_db.add_expressions(expressions[:len(expressions) // 2])
+    memory_db.add_expressions(expressions[len(expressions) // 3:])
+    expected_db = memory_das.db
+    assert memory_db.count_atoms() == expected_db.count_atoms()
+    for link_type in ['Inheritance', 'Similarity', WILDCARD]:
+        assert sorted(memory_db.get_matched_links(link_type, [WILDCARD, WILDCARD])) == \
+            sorted(expected_db.get_matched_links(link_type, [WILDCARD, WILDCARD]))
+    assert np.array_equal(memory_db.targets, expected_db.targets)
+    _assert_same_tables(memory_db, expected_db)
+    memory_db.clear()
+    assert memory_db.count_atoms() == (0, 0)
+    assert memory_db.get_matched_type('Inheritance') == []
+
+def test_index_files(memory_das, tmp_path):
+    expected_db = memory_das.db
+    directory = str(tmp_path / 'index')
+    expected_db.save_index(directory)
+    das = DistributedAtomSpace(mmap_index=directory)
+    memory_db = das.db
+    assert isinstance(memory_db.targets, np.memmap)
+    assert memory_db.count_atoms() == expected_db.count_atoms()
+    human = memory_db.get_node_handle('Concept', 'human')
+    assert memory_db.get_node_name(human) == 'human'
+    for link_type, targets in [('Inheritance', [WILDCARD, WILDCARD]), (WILDCARD, [human, WILDCARD])]:
+        assert sorted(memory_db.get_matched_links(link_type, targets)) == \
+            sorted(expected_db.get_matched_links(link_type, targets))
+    template = ['Inheritance', 'Concept', 'Concept']
+    assert sorted(memory_db.get_matched_type_template(template)) == \
+        sorted(expected_db.get_matched_type_template(template))
+    for link, _ in expected_db.get_matched_type('Similarity'):
+        assert memory_db.get_link_targets(link) == expected_db.get_link_targets(link)
+        assert memory_db.get_atom_as_dict(link) == expected_db.get_atom_as_dict(link)
+    # Atoms added to an opened index are kept in memory
+    shared_data = _parse(ANIMALS, SharedData())
+    memory_db.add_expressions([*shared_data.typedef_expressions, *shared_data.terminals, *shared_data.regular_expressions])
+    assert memory_db.count_atoms() == expected_db.count_atoms()
+    _assert_same_tables(memory_db, expected_db)
+    # Atoms which aren't in the index yet are merged with the mapped tables
+    expressions = [*shared_data.typedef_expressions, *shared_data.terminals, *shared_data.regular_expressions]
+    partial_db = MemoryDB()
+    partial_db.add_expressions(expressions[:len(expressions) // 2])
+    partial_directory = str(tmp_path / 'partial')
+    partial_db.save_index(partial_directory)
+    memory_db = MemoryDB.open_index(partial_directory)
+    memory_db.add_expressions(expressions)
+    assert memory_db.count_atoms() == expected_db.count_atoms()
+    _assert_same_tables(memory_db, expected_db)
+    for link, _ in expected_db.get_matched_type('Inheritance'):
+        assert memory_db.get_atom_as_dict(link) == expected_db.get_atom_as_dict(link)
+    with pytest.raises(ValueError):
+        MemoryDB.open_index(str(tmp_path / 'blah'))
+    # Index directories written before they were versioned are replaced
+    legacy_directory = tmp_path / 'legacy'
+    legacy_directory.mkdir()
+    (legacy_directory / 'manifest.json').write_text('{}')
+    expected_db.save_index(str(legacy_directory))
+    assert legacy_directory.is_symlink()
+    assert MemoryDB.open_index(str(legacy_directory)).count_atoms() == expected_db.count_atoms()
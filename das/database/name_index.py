@@ -0,0 +1,85 @@
+from typing import Optional
+
+import numpy as np
+
+from das.database.columnar_cache import NodeTable
+
+TRIGRAM_SIZE = 3
+
+def _ascii_lower(data: np.ndarray) -> np.ndarray:
+    # Only ASCII is folded so byte offsets stay valid
+    answer = np.array(data, dtype=np.uint8)
+    upper = (answer >= ord('A')) & (answer <= ord('Z'))
+    answer[upper] += ord('a') - ord('A')
+    return answer
+
+def _trigram_codes(data: np.ndarray) -> np.ndarray:
+    data = data.astype(np.uint32)
+    return (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+class TrigramIndex:
+    # trigram -> node positions. Candidates are checked against the names.
+
+    def __init__(self, node_table: NodeTable):
+        self.node_table = node_table
+        offsets = np.asarray(node_table.names.offsets)
+        data = _ascii_lower(node_table.names.buffer)
+        lengths = np.diff(offsets)
+        if len(data) < TRIGRAM_SIZE:
+            self.codes = np.zeros(0, dtype=np.uint32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.positions = np.zeros(0, dtype=np.uint32)
+            return
+        # Name (position in the node table) each byte belongs to
+        owners = np.repeat(np.arange(len(lengths), dtype=np.uint64), lengths)
+        starts = np.arange(len(data) - TRIGRAM_SIZE + 1)
+        # A trigram is valid if it doesn't cross the end of its name
+        valid = starts + TRIGRAM_SIZE <= offsets[owners[:len(starts)].astype(np.int64) + 1]
+        codes = _trigram_codes(data)[valid].astype(np.uint64)
+        pairs = np.unique((codes << np.uint64(32)) | owners[:len(starts)][valid])
+        pair_codes = (pairs >> np.uint64(32)).astype(np.uint32)
+        self.positions = (pairs & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+        self.codes, first = np.unique(pair_codes, return_index=True)
+        self.offsets = np.append(first, len(pair_codes)).astype(np.int64)
+
+    def _postings(self, code: int) -> np.ndarray:
+        index = int(np.searchsorted(self.codes, code))
+        if index >= len(self.codes) or self.codes[index] != code:
+            return np.zeros(0, dtype=np.uint32)
+        return self.positions[self.offsets[index]:self.offsets[index + 1]]
+
+    def _candidates(self, pattern: str) -> Optional[np.ndarray]:
+        # None when every name is a candidate
+        data = _ascii_lower(np.frombuffer(pattern.encode('utf-8'), dtype=np.uint8))
+        if len(data) < TRIGRAM_SIZE:
+            return None
+        postings = sorted((self._postings(code) for code in set(_trigram_codes(data).tolist())), key=len)
+        answer = postings[0]
+        for other in postings[1:]:
+            if not len(answer):
+                break
+            answer = np.intersect1d(answer, other, assume_unique=True)
+        return answer
+
+    def search(self, type_name: str, pattern: str, prefix: bool = False, case_sensitive: bool = True) -> np.ndarray:
+        candidates = None
+        if case_sensitive or pattern.isascii():
+            candidates = self._candidates(pattern)
+        type_positions = self.node_table.positions_of_type(type_name)
+        if candidates is None:
+            candidates = type_positions
+        else:
+            type_id = self.node_table.type_names.get_id(type_name)
+            if type_id is None:
+                return np.zeros(0, dtype=np.int64)
+            candidates = candidates[self.node_table.index.columns['type_id'][candidates] == type_id]
+        if not case_sensitive:
+            pattern = pattern.lower()
+        answer = []
+        for position in candidates:
+            name = self.node_table.name_at(position)
+            if not case_sensitive:
+                name = name.lower()
+            if name.startswith(pattern) if prefix else pattern in name:
+                answer.append(position)
+        return np.array(answer, dtype=np.int64)
@@ -0,0 +1,67 @@
+import os
+import json
+import shutil
+import time
+from typing import Dict, Any, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+# Snapshots are written to {directory}.version-{time}-{uuid} and directory
+# is a symlink to the current version
+VERSION_SUFFIX = '.version-'
+
+def save_snapshot(directory: str, fingerprint: Dict[str, Any], arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> None:
+    # The directory symlink is replaced atomically
+    directory = os.path.abspath(directory)
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    version_directory = f'{directory}{VERSION_SUFFIX}{time.time_ns():020d}-{uuid4().hex}'
+    os.makedirs(version_directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(version_directory, f'{name}.npy'), np.asarray(array), allow_pickle=False)
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'fingerprint': fingerprint,
+        'arrays': sorted(arrays.keys()),
+        'metadata': metadata,
+    }
+    with open(os.path.join(version_directory, MANIFEST_FILE_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    previous_version = os.readlink(directory) if os.path.islink(directory) else None
+    link = f'{version_directory}.link'
+    os.symlink(os.path.basename(version_directory), link)
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        # Snapshot written before snapshots were versioned
+        shutil.rmtree(directory)
+    os.replace(link, directory)
+    if previous_version is not None:
+        # The previous version may still be read
+        _remove_versions_before(directory, os.path.basename(previous_version))
+
+def _remove_versions_before(directory: str, version: str) -> None:
+    parent = os.path.dirname(directory)
+    prefix = os.path.basename(directory) + VERSION_SUFFIX
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if name.startswith(prefix) and name < version and os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+def load_snapshot(directory: str, fingerprint: Dict[str, Any]) -> Optional[Tuple[Dict[str, np.ndarray], Dict[str, Any]]]:
+    # Arrays are memory mapped read-only
+    directory = os.path.realpath(directory)
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != SNAPSHOT_VERSION or manifest.get('fingerprint') != fingerprint:
+        return None
+    arrays = {}
+    try:
+        for name in manifest['arrays']:
+            arrays[name] = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    return arrays, manifest['metadata']
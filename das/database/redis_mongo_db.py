@@ -1,13 +1,27 @@
 import os
+import sys
+import time
+from uuid import uuid4
 from signal import raise_signal
 from typing import List, Dict, Optional, Union, Any, Tuple
 from redis import Redis
-import pickle
+from threading import Lock
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 from pymongo.database import Database
 
 from das.expression_hasher import ExpressionHasher
-from das.database.key_value_schema import CollectionNames as KeyPrefix, build_redis_key
+from das.database.handle_index import HandleIndex
+from das.database.existence_filter import ExistenceFilter
+from das.database.columnar_cache import TypeNameTable, AtomTypeTable, NodeTable
+from das.database.prefetch_snapshot import load_snapshot, save_snapshot
+from das.database.lru_cache import LRUCache
+from das.database.name_index import TrigramIndex
+from das.database.member_codec import MemberArray, decode_members
+from das.database.handle_codec import encode_handle, encode_handles, decode_handle, decode_document
+from das.logger import logger
+from das.database.key_value_schema import CollectionNames as KeyPrefix, LOAD_MARKER_KEY, build_redis_key, pattern_key_tag, template_key_tag
 from das.database.mongo_schema import CollectionNames as MongoCollectionNames, FieldNames as MongoFieldNames
 
 from .db_interface import DBInterface, WILDCARD, UNORDERED_LINK_TYPES
@@ -15,36 +29,177 @@ from .db_interface import DBInterface, WILDCARD, UNORDERED_LINK_TYPES
 USE_CACHED_NODES = True
 USE_CACHED_LINK_TYPES = True
 USE_CACHED_NODE_TYPES = True
+USE_LINK_ROUTING_INDEX = True
+USE_EXISTENCE_FILTER = True
+# Positive answers from the existence filter are confirmed in a local sorted
+# array of handles instead of in MongoDB
+USE_EXACT_EXISTENCE_CHECK = True
+EXISTENCE_FILTER_FALSE_POSITIVE_RATE = 0.01
+# Max number of handles sent in a single '$in' query
+MONGO_IN_QUERY_CHUNK_SIZE = 10000
+
+# Substring searches by node name are answered by a trigram index built from
+# the cached node names (requires USE_CACHED_NODES)
+USE_NODE_NAME_INDEX = True
+# Searches with any of these are sent to MongoDB as regular expressions
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+# Memory budgets (in bytes) of the on-demand LRU caches used instead of the
+# caches above when they are disabled. Zero disables the on-demand cache too.
+NODE_CACHE_MEMORY_BUDGET = 256 * 1024 * 1024
+TYPE_CACHE_MEMORY_BUDGET = 64 * 1024 * 1024
+# Memory budget of the cache of expanded deep representations shared by all
+# calls. Handles are content hashes so cached expansions never get stale.
+# Cached dicts are shared and must not be modified by callers.
+DEEP_REPRESENTATION_CACHE_MEMORY_BUDGET = 0
+# Memory budget of the cache of decoded Redis sets, keyed by (prefix, key).
+# Keys written by loaders in this process are invalidated as they're written
+# and the whole cache is dropped when the load marker written by the loaders
+# of other processes changes (see key_value_schema.LOAD_MARKER_KEY and
+# LOAD_MARKER_CHECK_INTERVAL). Writes which don't go through the loaders
+# aren't seen, set it to zero if Redis is written by other tools.
+KEY_VALUE_CACHE_MEMORY_BUDGET = int(os.environ.get('DAS_KEY_VALUE_CACHE_MEMORY_BUDGET', 64 * 1024 * 1024))
+# Default number of members requested by each SSCAN in the paged lookups. It's
+# a hint, Redis may return more or fewer members per page.
+KEY_VALUE_SCAN_PAGE_SIZE = 1000
+# Number of Mongo collections scanned concurrently by prefetch()
+PREFETCH_THREADS = 4
+# When set, prefetch() saves its results in this directory and reuses them
+# (memory mapped) on the next start if the DB hasn't changed
+PREFETCH_SNAPSHOT_DIR = os.environ.get('DAS_PREFETCH_SNAPSHOT_DIR', None)
+# The load marker (see key_value_schema.LOAD_MARKER_KEY) is read from Redis at
+# most once per this number of seconds, so loads by other processes may take
+# that long to be noticed by the existence filters and the key-value cache
+LOAD_MARKER_CHECK_INTERVAL = float(os.environ.get('DAS_LOAD_MARKER_CHECK_INTERVAL', 1))
+
+# Link collections in the order used to build the link routing index
+LINK_COLLECTION_TAGS = ['1', '2', 'N']
+
+# Marks a miss in LRUCache.get() since None is cached for missing handles
+_NOT_CACHED = object()
+
+def _decode_marker(marker) -> Optional[str]:
+    return marker.decode() if isinstance(marker, bytes) else marker
+
+def _new_lazy_cache(memory_budget: int) -> Optional[LRUCache]:
+    return LRUCache(memory_budget) if memory_budget > 0 else None
+
+def _shared_value(value: Any) -> Any:
+    # Cached lists are shared so callers get a (shallow) copy. MemberArrays
+    # are never changed and copying them would convert the digests to hex.
+    return value if isinstance(value, MemberArray) else list(value)
+
+def _chunks(values: List[Any], size: int):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
 
 class NodeDocuments():
 
-    def __init__(self, collection):
+    def __init__(self, collection, table: Optional[NodeTable] = None, type_hashes: Optional[Dict[int, str]] = None, count: int = 0):
         self.mongo_collection = collection
-        self.cached_nodes = {}
-        self.count = 0
+        self.table = table
+        # type id -> composite type hash of the nodes of that type
+        self.type_hashes = type_hashes if type_hashes is not None else {}
+        self.count = count
+        self.lazy_cache = None if USE_CACHED_NODES else _new_lazy_cache(NODE_CACHE_MEMORY_BUDGET)
 
-    def add(self, node_id, document):
-        if USE_CACHED_NODES:
-            self.cached_nodes[node_id] = document
-        self.count += 1
+    def _document_at(self, position: int, handle: str) -> Dict:
+        type_id = int(self.table.index.columns['type_id'][position])
+        return {
+            MongoFieldNames.ID_HASH: handle,
+            MongoFieldNames.TYPE: self.type_hashes[type_id],
+            MongoFieldNames.TYPE_NAME: self.table.type_names.get_name(type_id),
+            MongoFieldNames.NODE_NAME: self.table.name_at(position),
+        }
 
     def get(self, handle, default_value):
         if USE_CACHED_NODES:
-            return self.cached_nodes.get(handle, default_value)
+            position = self.table.position(handle) if self.table is not None else -1
+            return self._document_at(position, handle) if position >= 0 else default_value
         else:
-            mongo_filter = {MongoFieldNames.ID_HASH: handle}
-            node = self.mongo_collection.find_one(mongo_filter)
+            if self.lazy_cache is not None:
+                node = self.lazy_cache.get(handle, _NOT_CACHED)
+                if node is not _NOT_CACHED:
+                    return node if node else default_value
+            mongo_filter = {MongoFieldNames.ID_HASH: encode_handle(handle)}
+            node = decode_document(self.mongo_collection.find_one(mongo_filter))
+            if self.lazy_cache is not None:
+                self.lazy_cache.put(handle, node)
             return node if node else default_value
 
+    def get_many(self, handles: List[str]) -> Dict[str, Dict]:
+        if USE_CACHED_NODES:
+            answer = {}
+            if self.table is None:
+                return answer
+            for handle, position in zip(handles, self.table.positions(handles)):
+                if position >= 0:
+                    answer[handle] = self._document_at(position, handle)
+            return answer
+        else:
+            answer = {}
+            misses = set()
+            for handle in handles:
+                node = self.lazy_cache.get(handle, _NOT_CACHED) if self.lazy_cache is not None else _NOT_CACHED
+                if node is _NOT_CACHED:
+                    misses.add(handle)
+                elif node:
+                    answer[handle] = node
+            for chunk in _chunks(list(misses), MONGO_IN_QUERY_CHUNK_SIZE):
+                mongo_filter = {MongoFieldNames.ID_HASH: {'$in': encode_handles(chunk)}}
+                for document in self.mongo_collection.find(mongo_filter):
+                    document = decode_document(document)
+                    answer[document[MongoFieldNames.ID_HASH]] = document
+            if self.lazy_cache is not None:
+                for handle in misses:
+                    self.lazy_cache.put(handle, answer.get(handle, None))
+            return answer
+
     def size(self):
         if USE_CACHED_NODES:
-            return len(self.cached_nodes)
+            return len(self.table) if self.table is not None else 0
         else:
             return self.count
 
     def values(self):
-        for document in self.cached_nodes.values() if USE_CACHED_NODES else self.mongo_collection.find():
-            yield document
+        if USE_CACHED_NODES:
+            if self.table is None:
+                return
+            handles = self.table.handles_at(np.arange(len(self.table)))
+            for position, handle in enumerate(handles):
+                yield self._document_at(position, handle)
+        else:
+            for document in self.mongo_collection.find():
+                yield decode_document(document)
+
+class _CollectionScan:
+    """
+    Handles and interned types (and optionally names) read from one Mongo
+    collection. Each scan has its own TypeNameTable so scans can run in
+    separate threads; ids are remapped to the shared table afterwards.
+    """
+
+    def __init__(self, collection, with_names: bool = False):
+        self.collection = collection
+        self.with_names = with_names
+        self.type_names = TypeNameTable()
+        self.handles = []
+        self.type_ids = []
+        self.names = []
+        self.type_hashes = {}
+
+    def run(self) -> '_CollectionScan':
+        projection = {MongoFieldNames.TYPE_NAME: True}
+        if self.with_names:
+            projection[MongoFieldNames.NODE_NAME] = True
+            projection[MongoFieldNames.TYPE] = True
+        for document in self.collection.find({}, projection):
+            self.handles.append(decode_handle(document[MongoFieldNames.ID_HASH]))
+            type_id = self.type_names.intern(document[MongoFieldNames.TYPE_NAME])
+            self.type_ids.append(type_id)
+            if self.with_names:
+                self.type_hashes.setdefault(type_id, decode_handle(document[MongoFieldNames.TYPE]))
+                self.names.append(document[MongoFieldNames.NODE_NAME])
+        return self
 
 class RedisMongoDB(DBInterface):
 
@@ -66,8 +221,24 @@ class RedisMongoDB(DBInterface):
         self.parent_type = None
         self.node_documents = None
         self.terminal_hash = None
+        self.type_names = None
+        self.link_types = None
+        self.node_types = None
         self.link_type_cache = None
         self.node_type_cache = None
+        self.link_routing_index = None
+        self.node_name_index = None
+        self.node_name_index_lock = Lock()
+        self.deep_representation_cache = _new_lazy_cache(DEEP_REPRESENTATION_CACHE_MEMORY_BUDGET)
+        self.key_value_cache = _new_lazy_cache(KEY_VALUE_CACHE_MEMORY_BUDGET)
+        self.key_value_cache_marker = None
+        # Marker of the last load seen by prefetch() (or add_atoms()) and the
+        # last marker read from Redis
+        self.prefetch_load_marker = None
+        self.load_marker = None
+        self.load_marker_time = None
+        self.node_existence_filter = None
+        self.link_existence_filter = None
         self.typedef_mark_hash = ExpressionHasher._compute_hash(":")
         self.typedef_base_type_hash = ExpressionHasher._compute_hash("Type")
         self.typedef_composite_type_hash = ExpressionHasher.composite_hash([
@@ -93,32 +264,39 @@ class RedisMongoDB(DBInterface):
         self.symbol_hash = {}
         self.parent_type = {}
         self.terminal_hash = {}
-        self.link_type_cache = {}
-        self.node_type_cache = {}
-        self.node_documents = NodeDocuments(self.mongo_nodes_collection)
-        if USE_CACHED_NODES:
-            for document in self.mongo_nodes_collection.find():
-                node_id = document[MongoFieldNames.ID_HASH]
-                node_type = document[MongoFieldNames.TYPE_NAME]
-                node_name = document[MongoFieldNames.NODE_NAME]
-                self.node_documents.add(node_id, document)
+        self.link_type_cache = None if USE_CACHED_LINK_TYPES else _new_lazy_cache(TYPE_CACHE_MEMORY_BUDGET)
+        self.node_type_cache = None if USE_CACHED_NODE_TYPES else _new_lazy_cache(TYPE_CACHE_MEMORY_BUDGET)
+        self.node_name_index = None
+        self.invalidate_key_values()
+        # Read before the scans so loads which finish during prefetch() are
+        # noticed afterwards
+        self.prefetch_load_marker = self.get_load_marker()
+        self._update_load_marker(self.prefetch_load_marker)
+        self._prefetch_atom_types()
+        snapshot_directory = self._get_prefetch_snapshot_directory()
+        snapshot = None
+        if snapshot_directory is not None:
+            fingerprint = self._get_prefetch_fingerprint()
+            snapshot = load_snapshot(snapshot_directory, fingerprint)
+        if snapshot is None:
+            self._prefetch_atoms()
+            if snapshot_directory is not None:
+                self._save_prefetch_snapshot(snapshot_directory, fingerprint)
         else:
-            self.node_documents.count = self.mongo_nodes_collection.count_documents({})
-        if USE_CACHED_LINK_TYPES:
-            for tag in ["1", "2", "N"]:
-                for document in self.mongo_link_collection[tag].find():
-                    self.link_type_cache[document[MongoFieldNames.ID_HASH]] = document[MongoFieldNames.TYPE_NAME]
-        if USE_CACHED_NODE_TYPES:
-            for document in self.mongo_nodes_collection.find():
-                self.node_type_cache[document[MongoFieldNames.ID_HASH]] = document[MongoFieldNames.TYPE_NAME]
+            self._load_prefetch_snapshot(*snapshot)
+        self._build_existence_filters()
+
+    def _prefetch_atom_types(self) -> None:
+        type_documents = {}
         for document in self.mongo_types_collection.find():
+            document = decode_document(document)
+            type_documents[document[MongoFieldNames.ID_HASH]] = document
+        for document in type_documents.values():
             hash_id = document[MongoFieldNames.ID_HASH]
             named_type = document[MongoFieldNames.TYPE_NAME]
             named_type_hash = document[MongoFieldNames.TYPE_NAME_HASH]
             composite_type_hash = document[MongoFieldNames.TYPE]
-            type_document = self.mongo_types_collection.find_one({
-                MongoFieldNames.ID_HASH: composite_type_hash
-            })
+            type_document = type_documents.get(composite_type_hash, None)
             self.named_type_hash[named_type] = named_type_hash
             self.named_type_hash_reverse[named_type_hash] = named_type
             if type_document is not None:
@@ -126,29 +304,383 @@ class RedisMongoDB(DBInterface):
                 self.parent_type[named_type_hash] = type_document[MongoFieldNames.TYPE_NAME_HASH]
             self.symbol_hash[named_type] = hash_id
 
-    def _retrieve_mongo_document(self, handle: str, arity=-1) -> dict:
-        mongo_filter = {"_id": handle}
+    def _prefetch_atoms(self) -> None:
+        self.type_names = TypeNameTable()
+        self.node_types = None
+        self.link_types = None
+        self.link_routing_index = None
+        scan_nodes = USE_CACHED_NODES or USE_CACHED_NODE_TYPES or USE_EXISTENCE_FILTER
+        scan_links = USE_CACHED_LINK_TYPES or USE_LINK_ROUTING_INDEX or USE_EXISTENCE_FILTER
+        with ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as executor:
+            node_scan = None
+            if scan_nodes:
+                node_scan = executor.submit(_CollectionScan(self.mongo_nodes_collection, USE_CACHED_NODES).run)
+            link_scans = []
+            if scan_links:
+                link_scans = [
+                    executor.submit(_CollectionScan(self.mongo_link_collection[tag]).run)
+                    for tag in LINK_COLLECTION_TAGS
+                ]
+            node_count = self.mongo_nodes_collection.count_documents({}) if node_scan is None else 0
+            node_scan = node_scan.result() if node_scan is not None else None
+            link_scans = [future.result() for future in link_scans]
+        type_hashes = {}
+        if node_scan is not None:
+            node_count = len(node_scan.handles)
+            type_ids = self.type_names.remap(node_scan.type_names, node_scan.type_ids)
+            if USE_CACHED_NODES:
+                self.node_types = NodeTable(self.type_names, node_scan.handles, type_ids, node_scan.names)
+                for type_id, type_hash in node_scan.type_hashes.items():
+                    type_hashes[self.type_names.get_id(node_scan.type_names.get_name(type_id))] = type_hash
+            else:
+                self.node_types = AtomTypeTable(self.type_names, node_scan.handles, type_ids)
+        self.node_documents = NodeDocuments(
+            self.mongo_nodes_collection,
+            self.node_types if USE_CACHED_NODES else None,
+            type_hashes,
+            node_count)
+        if link_scans:
+            link_handles = []
+            link_type_ids = []
+            link_collections = []
+            for collection_index, scan in enumerate(link_scans):
+                link_handles.extend(scan.handles)
+                link_type_ids.append(self.type_names.remap(scan.type_names, scan.type_ids))
+                link_collections.append(np.full(len(scan.handles), collection_index, dtype=np.uint8))
+            # Link types and link routing share the same sorted handles
+            self.link_types = AtomTypeTable(
+                self.type_names,
+                link_handles,
+                np.concatenate(link_type_ids),
+                collection=np.concatenate(link_collections))
+            if USE_LINK_ROUTING_INDEX:
+                self.link_routing_index = self.link_types.index
+        if self.node_types is not None:
+            self.node_types.build_type_index()
+
+    def add_atoms(self, node_documents: List[Dict], link_documents: List[Dict]) -> None:
+        # Called by the loaders instead of mark_load() and prefetch() after
+        # writing a few atoms (e.g. a committed transaction). Documents are
+        # in the format of the Mongo collections. The atoms are merged into
+        # the prefetched tables and existence filters so no collection is
+        # scanned again.
+        previous_marker, marker = self._swap_load_marker()
+        self._prefetch_atom_types()
+        node_handles = [document[MongoFieldNames.ID_HASH] for document in node_documents]
+        if self.node_types is not None:
+            type_ids = [self.type_names.intern(document[MongoFieldNames.TYPE_NAME]) for document in node_documents]
+            if USE_CACHED_NODES:
+                names = [document[MongoFieldNames.NODE_NAME] for document in node_documents]
+                self.node_types = self.node_types.merged(node_handles, type_ids, names)
+                for type_id, document in zip(type_ids, node_documents):
+                    self.node_documents.type_hashes.setdefault(type_id, document[MongoFieldNames.TYPE])
+                self.node_documents.table = self.node_types
+            else:
+                self.node_types = self.node_types.merged(node_handles, type_ids)
+            self.node_documents.count = len(self.node_types)
+        else:
+            self.node_documents.count = self.mongo_nodes_collection.count_documents({})
+        if self.node_documents.lazy_cache is not None:
+            for handle in node_handles:
+                self.node_documents.lazy_cache.discard(handle)
+        if node_handles:
+            self.node_name_index = None
+        link_handles = [document[MongoFieldNames.ID_HASH] for document in link_documents]
+        if self.link_types is not None:
+            self.link_types = self.link_types.merged(
+                link_handles,
+                [self.type_names.intern(document[MongoFieldNames.TYPE_NAME]) for document in link_documents],
+                collection=np.array([self._get_link_collection_index(document) for document in link_documents], dtype=np.uint8))
+            if USE_LINK_ROUTING_INDEX:
+                self.link_routing_index = self.link_types.index
+        if self.node_existence_filter is not None:
+            self.node_existence_filter.add(node_handles)
+        if self.link_existence_filter is not None:
+            self.link_existence_filter.add(link_handles)
+        if previous_marker == self.prefetch_load_marker:
+            # Nothing else was loaded since the prefetched data was read
+            self.prefetch_load_marker = marker
+        self._adopt_load_marker(previous_marker, marker)
+
+    def _get_link_collection_index(self, document: Dict) -> int:
+        arity = len(self._get_mongo_document_keys(document))
+        return LINK_COLLECTION_TAGS.index(str(arity) if arity <= 2 else 'N')
+
+    def mark_load(self) -> None:
+        # Called by the loaders after writing to the DB
+        self._adopt_load_marker(*self._swap_load_marker())
+
+    def _adopt_load_marker(self, previous_marker: Optional[str], marker: str) -> None:
+        # The keys written by this process were invalidated as they were
+        # written so the cache is still current if nothing else was loaded
+        if previous_marker == self.key_value_cache_marker:
+            self.key_value_cache_marker = marker
+        self._update_load_marker(marker)
+
+    def _swap_load_marker(self) -> Tuple[Optional[str], str]:
+        # Returns the previous marker and the new one
+        marker = uuid4().hex
+        return _decode_marker(self.redis.getset(LOAD_MARKER_KEY, marker)), marker
+
+    def get_load_marker(self) -> Optional[str]:
+        return _decode_marker(self.redis.get(LOAD_MARKER_KEY))
+
+    def _load_marker_expired(self) -> bool:
+        return self.load_marker_time is None or \
+            time.monotonic() - self.load_marker_time >= LOAD_MARKER_CHECK_INTERVAL
+
+    def _update_load_marker(self, marker) -> None:
+        self.load_marker = _decode_marker(marker)
+        self.load_marker_time = time.monotonic()
+
+    def _current_load_marker(self) -> Optional[str]:
+        if self._load_marker_expired():
+            self._update_load_marker(self.redis.get(LOAD_MARKER_KEY))
+        return self.load_marker
+
+    def _prefetched_data_current(self) -> bool:
+        # Whether nothing was loaded by other processes since the prefetched
+        # data was read
+        return self._current_load_marker() == self.prefetch_load_marker
+
+    def _get_prefetch_snapshot_directory(self) -> Optional[str]:
+        if not PREFETCH_SNAPSHOT_DIR:
+            return None
+        # DBs with the same name in different servers get different snapshots
+        address = self.mongo_db.client.address
+        server = f'{address[0]}_{address[1]}' if address else 'default'
+        return os.path.join(PREFETCH_SNAPSHOT_DIR, server, self.mongo_db.name)
+
+    def _get_prefetch_fingerprint(self) -> Dict[str, Any]:
+        # The load marker changes whenever the loaders write to the DB.
+        # Collection sizes are kept to detect DBs written by older loaders.
+        # estimated_document_count() reads collection metadata so it's O(1)
+        # regardless of the size of the DB.
+        counts = {
+            MongoCollectionNames.NODES.value: self.mongo_nodes_collection.estimated_document_count(),
+            MongoCollectionNames.ATOM_TYPES.value: self.mongo_types_collection.estimated_document_count(),
+        }
+        for tag in LINK_COLLECTION_TAGS:
+            collection = self.mongo_link_collection[tag]
+            counts[collection.name] = collection.estimated_document_count()
+        return {
+            "load_marker": self.prefetch_load_marker,
+            "counts": counts,
+            "cached_nodes": USE_CACHED_NODES,
+            "node_types": USE_CACHED_NODES or USE_CACHED_NODE_TYPES or USE_EXISTENCE_FILTER,
+            "link_types": USE_CACHED_LINK_TYPES or USE_LINK_ROUTING_INDEX or USE_EXISTENCE_FILTER,
+        }
+
+    def _save_prefetch_snapshot(self, directory: str, fingerprint: Dict[str, Any]) -> None:
+        arrays = {}
+        if self.node_types is not None:
+            arrays.update({f'nodes_{name}': array for name, array in self.node_types.to_arrays().items()})
+        if self.link_types is not None:
+            arrays.update({f'links_{name}': array for name, array in self.link_types.to_arrays().items()})
+        metadata = {
+            "type_names": self.type_names.names,
+            "node_type_hashes": {str(type_id): type_hash for type_id, type_hash in self.node_documents.type_hashes.items()},
+            "node_count": self.node_documents.count,
+        }
+        try:
+            save_snapshot(directory, fingerprint, arrays, metadata)
+        except OSError as exception:
+            logger().warning(f"Unable to save prefetch snapshot in {directory}: {exception}")
+
+    def _load_prefetch_snapshot(self, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> None:
+        self.type_names = TypeNameTable(metadata["type_names"])
+        node_arrays = {name[len('nodes_'):]: array for name, array in arrays.items() if name.startswith('nodes_')}
+        link_arrays = {name[len('links_'):]: array for name, array in arrays.items() if name.startswith('links_')}
+        self.node_types = None
+        if node_arrays:
+            table_class = NodeTable if USE_CACHED_NODES else AtomTypeTable
+            self.node_types = table_class.from_arrays(self.type_names, node_arrays)
+        self.node_documents = NodeDocuments(
+            self.mongo_nodes_collection,
+            self.node_types if USE_CACHED_NODES else None,
+            {int(type_id): type_hash for type_id, type_hash in metadata["node_type_hashes"].items()},
+            metadata["node_count"])
+        self.link_types = AtomTypeTable.from_arrays(self.type_names, link_arrays) if link_arrays else None
+        self.link_routing_index = self.link_types.index if USE_LINK_ROUTING_INDEX and link_arrays else None
+
+    def _build_existence_filters(self) -> None:
+        self.node_existence_filter = None
+        self.link_existence_filter = None
+        if not USE_EXISTENCE_FILTER:
+            return
+        node_index = self.node_types.index
+        link_index = self.link_types.index
+        self.node_existence_filter = ExistenceFilter(
+            node_index.keys,
+            node_index if USE_EXACT_EXISTENCE_CHECK else None,
+            EXISTENCE_FILTER_FALSE_POSITIVE_RATE)
+        self.link_existence_filter = ExistenceFilter(
+            link_index.keys,
+            link_index if USE_EXACT_EXISTENCE_CHECK else None,
+            EXISTENCE_FILTER_FALSE_POSITIVE_RATE)
+
+    def _get_mongo_collections(self, arity=-1, handle=None):
+        if arity < 0 and handle is not None and self.link_routing_index is not None:
+            collection_index = self.link_routing_index.get(handle, "collection")
+            if collection_index is None:
+                return []
+            return [self.mongo_link_collection[LINK_COLLECTION_TAGS[collection_index]]]
         if arity >= 0:
             if arity == 0:
-                return self.mongo_nodes_collection.find_one(mongo_filter)
+                return [self.mongo_nodes_collection]
             elif arity == 2:
-                return self.mongo_link_collection['2'].find_one(mongo_filter)
+                return [self.mongo_link_collection['2']]
             elif arity == 1:
-                return self.mongo_link_collection['1'].find_one(mongo_filter)
+                return [self.mongo_link_collection['1']]
             else:
-                return self.mongo_link_collection['N'].find_one(mongo_filter)
+                return [self.mongo_link_collection['N']]
         # The order of keys in search is important. Greater to smallest probability of proper arity
-        for collection in [self.mongo_link_collection[key] for key in ['2', '1', 'N']]:
+        return [self.mongo_link_collection[key] for key in ['2', '1', 'N']]
+
+    def _retrieve_mongo_document(self, handle: str, arity=-1) -> dict:
+        mongo_filter = {"_id": encode_handle(handle)}
+        for collection in self._get_mongo_collections(arity, handle):
             document = collection.find_one(mongo_filter)
             if document:
-                return document
+                return decode_document(document)
         return None
 
-    def _retrieve_key_value(self, prefix: str, key: str) -> List[str]:
+    def _find_mongo_documents(self, collection, handles: List[str], answer: Dict[str, Dict]) -> None:
+        for chunk in _chunks(handles, MONGO_IN_QUERY_CHUNK_SIZE):
+            mongo_filter = {MongoFieldNames.ID_HASH: {'$in': encode_handles(chunk)}}
+            for document in collection.find(mongo_filter):
+                document = decode_document(document)
+                answer[document[MongoFieldNames.ID_HASH]] = document
+
+    def _retrieve_mongo_documents(self, handles: List[str], arity=-1) -> Dict[str, Dict]:
+        answer = {}
+        pending = list(set(handles))
+        if arity < 0 and self.link_routing_index is not None:
+            positions = self.link_routing_index.positions(pending)
+            collection_indexes = self.link_routing_index.columns["collection"]
+            routed = {}
+            for handle, position in zip(pending, positions):
+                if position >= 0:
+                    routed.setdefault(collection_indexes[position], []).append(handle)
+            for collection_index, collection_handles in routed.items():
+                collection = self.mongo_link_collection[LINK_COLLECTION_TAGS[collection_index]]
+                self._find_mongo_documents(collection, collection_handles, answer)
+            return answer
+        for collection in self._get_mongo_collections(arity):
+            if not pending:
+                break
+            self._find_mongo_documents(collection, pending, answer)
+            pending = [handle for handle in pending if handle not in answer]
+        return answer
+
+    def _decode_key_value(self, prefix: str, members) -> List[str]:
         if prefix in self.use_targets:
-            return [pickle.loads(t) for t in self.redis.smembers(build_redis_key(prefix, key))]
+            return decode_members(members)
         else:
-            return [* self.redis.smembers(build_redis_key(prefix, key))]
+            return [*members]
+
+    def _build_redis_key(self, prefix: str, key: str, tag: Optional[str]):
+        return build_redis_key(prefix, encode_handle(key), encode_handle(tag))
+
+    def _get_cached_key_values(self, prefix: str, keys: List[str], validate: bool = True) -> Tuple[List[Optional[List[Any]]], List[int]]:
+        # Returns the answers found in the key-value cache (None for misses)
+        # and the positions of the missing keys
+        answer = [None] * len(keys)
+        if self.key_value_cache is not None:
+            if validate:
+                self._validate_key_value_cache()
+            for position, key in enumerate(keys):
+                cached = self.key_value_cache.get((prefix, key), None)
+                if cached is not None:
+                    answer[position] = _shared_value(cached)
+        missing = [position for position, value in enumerate(answer) if value is None]
+        return answer, missing
+
+    def _set_key_values(self, prefix: str, keys: List[str], positions: List[int], replies: List[Any], answer: List[Any]) -> List[Any]:
+        # Decodes the Redis replies for keys[positions] into answer, caching them
+        for position, members in zip(positions, replies):
+            value = self._decode_key_value(prefix, members)
+            if self.key_value_cache is not None:
+                self.key_value_cache.put((prefix, keys[position]), value)
+                value = _shared_value(value)
+            answer[position] = value
+        return answer
+
+    def _retrieve_key_value(self, prefix: str, key: str, tag: Optional[str] = None) -> List[str]:
+        answer, missing = self._get_cached_key_values(prefix, [key])
+        if missing:
+            reply = self.redis.smembers(self._build_redis_key(prefix, key, tag))
+            self._set_key_values(prefix, [key], missing, [reply], answer)
+        return answer[0]
+
+    def _retrieve_key_values(self, prefix: str, keys: List[str], tags: Optional[List[str]] = None) -> List[List[str]]:
+        # Non-transactional pipelines are also supported by RedisCluster, which
+        # groups the queued commands by node and sends one batch per node.
+        # Keys sharing a hash tag (see key_value_schema.KeyLayout) go to the
+        # same node.
+        if tags is None:
+            tags = [None] * len(keys)
+        answer, missing = self._get_cached_key_values(prefix, keys)
+        if not missing:
+            return answer
+        pipeline = self.redis.pipeline(transaction=False)
+        for position in missing:
+            pipeline.smembers(self._build_redis_key(prefix, keys[position], tags[position]))
+        return self._set_key_values(prefix, keys, missing, pipeline.execute(), answer)
+
+    def _scan_key_value(self, prefix: str, key: str, tag: Optional[str], cursor: int, page_size: Optional[int]) -> Tuple[int, List[Any]]:
+        # Paged lookups bypass the key-value cache since they're meant for sets
+        # too big to be kept in memory
+        if key is None:
+            return 0, []
+        cursor, members = self.redis.sscan(
+            self._build_redis_key(prefix, key, tag),
+            cursor,
+            count=page_size or KEY_VALUE_SCAN_PAGE_SIZE)
+        return int(cursor), self._decode_key_value(prefix, members)
+
+    def _count_key_values(self, prefix: str, keys: List[str], tags: Optional[List[str]] = None) -> List[int]:
+        # SCARD counts the members without transferring them. Note that sets
+        # with members in both the pickled and binary formats (see
+        # member_codec) count the duplicated members twice.
+        if tags is None:
+            tags = [None] * len(keys)
+        answer = [0] * len(keys)
+        missing = []
+        if self.key_value_cache is not None:
+            self._validate_key_value_cache()
+        for position, key in enumerate(keys):
+            if key is None:
+                continue
+            cached = self.key_value_cache.get((prefix, key), None) if self.key_value_cache is not None else None
+            if cached is not None:
+                answer[position] = len(cached)
+            else:
+                missing.append(position)
+        if not missing:
+            return answer
+        pipeline = self.redis.pipeline(transaction=False)
+        for position in missing:
+            pipeline.scard(self._build_redis_key(prefix, keys[position], tags[position]))
+        for position, count in zip(missing, pipeline.execute()):
+            answer[position] = int(count)
+        return answer
+
+    def _validate_key_value_cache(self) -> None:
+        self._set_key_value_cache_marker(self._current_load_marker())
+
+    def _set_key_value_cache_marker(self, marker: Optional[str]) -> None:
+        if marker != self.key_value_cache_marker:
+            self.key_value_cache.clear()
+            self.key_value_cache_marker = marker
+
+    def invalidate_key_value(self, prefix: str, key: str) -> None:
+        if self.key_value_cache is not None:
+            self.key_value_cache.discard((prefix, key))
+
+    def invalidate_key_values(self) -> None:
+        if self.key_value_cache is not None:
+            self.key_value_cache.clear()
 
     def _build_named_type_hash_template(self, template: Union[str, List[Any]]) -> List[Any]:
         if isinstance(template, str):
@@ -184,33 +716,81 @@ class RedisMongoDB(DBInterface):
                 answer.append(key)
             index += 1
 
-    def _build_deep_representation(self, handle, arity=-1):
-        answer = {}
-        document = self.node_documents.get(handle, None)
-        if document is None:
-            document = self._retrieve_mongo_document(handle, arity)
-            answer["type"] = document[MongoFieldNames.TYPE_NAME]
-            answer["targets"] = []
-            for target_handle in self._get_mongo_document_keys(document):
-                answer["targets"].append(self._build_deep_representation(target_handle))
-        else:
-            answer["type"] = document[MongoFieldNames.TYPE_NAME]
-            answer["name"] = document[MongoFieldNames.NODE_NAME]
-        return answer
+    def _build_deep_representations(self, handles: List[str], arity=-1) -> Dict[str, Dict]:
+        # Atoms are expanded breadth first so each level of the trees is fetched
+        # with one batched query per collection. Handles are expanded only once
+        # per call so subtrees shared by many atoms reuse the same dict.
+        expanded = {}
+        link_keys = {}
+        level = list(dict.fromkeys(handles))
+        level_arity = arity
+        while level:
+            pending = []
+            for handle in level:
+                if handle in expanded or handle in link_keys:
+                    continue
+                cached = self.deep_representation_cache.get(handle, None) \
+                    if self.deep_representation_cache is not None else None
+                if cached is None:
+                    pending.append(handle)
+                else:
+                    expanded[handle] = cached
+            if not pending:
+                break
+            node_documents = self.node_documents.get_many(pending) if level_arity <= 0 else {}
+            for handle, document in node_documents.items():
+                expanded[handle] = {
+                    "type": document[MongoFieldNames.TYPE_NAME],
+                    "name": document[MongoFieldNames.NODE_NAME],
+                }
+            link_handles = [handle for handle in pending if handle not in node_documents]
+            link_documents = self._retrieve_mongo_documents(link_handles, level_arity)
+            level = []
+            for handle in link_handles:
+                document = link_documents.get(handle, None)
+                if document is None:
+                    raise ValueError(f"Invalid handle: {handle}")
+                targets = self._get_mongo_document_keys(document)
+                link_keys[handle] = (document[MongoFieldNames.TYPE_NAME], targets)
+                level.extend(targets)
+            level_arity = -1
+
+        def assemble(handle):
+            answer = expanded.get(handle, None)
+            if answer is None:
+                link_type, targets = link_keys[handle]
+                answer = {
+                    "type": link_type,
+                    "targets": [assemble(target_handle) for target_handle in targets],
+                }
+                expanded[handle] = answer
+                if self.deep_representation_cache is not None:
+                    self.deep_representation_cache.put(handle, answer)
+            return answer
 
+        return {handle: assemble(handle) for handle in handles}
 
     # DB interface methods
 
+    def _atom_exists(self, existence_filter: Optional[ExistenceFilter], handle: str, arity: int) -> bool:
+        if existence_filter is not None:
+            exists = existence_filter.check(handle)
+            # Misses aren't final if other processes loaded atoms since the
+            # filter was built
+            if exists or (exists is False and self._prefetched_data_current()):
+                return exists
+        document = self._retrieve_mongo_document(handle, arity)
+        if document is not None and existence_filter is not None:
+            existence_filter.add([handle])
+        return document is not None
+
     def node_exists(self, node_type: str, node_name: str) -> bool:
         node_handle = ExpressionHasher.terminal_hash(node_type, node_name)
-        # TODO: use a specific query to nodes table
-        document = self._retrieve_mongo_document(node_handle, 0)
-        return document is not None
+        return self._atom_exists(self.node_existence_filter, node_handle, 0)
 
     def link_exists(self, link_type: str, target_handles: List[str]) -> bool:
         link_handle = ExpressionHasher.expression_hash(self._get_atom_type_hash(link_type), target_handles)
-        document = self._retrieve_mongo_document(link_handle, len(target_handles))
-        return document is not None
+        return self._atom_exists(self.link_existence_filter, link_handle, len(target_handles))
 
     def get_node_handle(self, node_type: str, node_name: str) -> str:
         return ExpressionHasher.terminal_hash(node_type, node_name)
@@ -224,7 +804,15 @@ class RedisMongoDB(DBInterface):
         if not answer:
             raise ValueError(f"Invalid handle: {link_handle}")
         #return answer[1:]
-        return [h.decode() for h in answer]
+        return [decode_handle(h) for h in answer]
+
+    def get_link_targets_many(self, link_handles: List[str]) -> List[List[str]]:
+        answer = []
+        for link_handle, targets in zip(link_handles, self._retrieve_key_values(KeyPrefix.OUTGOING_SET, link_handles)):
+            if not targets:
+                raise ValueError(f"Invalid handle: {link_handle}")
+            answer.append([decode_handle(h) for h in targets])
+        return answer
 
     def is_ordered(self, link_handle: str) -> bool:
         document = self._retrieve_mongo_document(link_handle)
@@ -232,100 +820,303 @@ class RedisMongoDB(DBInterface):
             raise ValueError(f'Invalid handle: {link_handle}')
         return True
 
-    def get_matched_links(self, link_type: str, target_handles: List[str]):
-        if link_type != WILDCARD and WILDCARD not in target_handles:
-            try:
-                link_handle = self.get_link_handle(link_type, target_handles)
-                document = self._retrieve_mongo_document(link_handle, len(target_handles))
-                return [link_handle] if document else []
-            except ValueError:
-                return []
+    def _get_pattern(self, link_type: str, target_handles: List[str]) -> Optional[List[str]]:
         if link_type == WILDCARD:
             link_type_hash = WILDCARD
         else:
             link_type_hash = self._get_atom_type_hash(link_type)
         if link_type_hash is None:
-            return []
+            return None
         if link_type in UNORDERED_LINK_TYPES:
             target_handles = sorted(target_handles)
-        pattern_hash = ExpressionHasher.composite_hash([link_type_hash, *target_handles])
-        return self._retrieve_key_value(KeyPrefix.PATTERNS, pattern_hash)
+        return [link_type_hash, *target_handles]
+
+    def _get_pattern_hash(self, link_type: str, target_handles: List[str]) -> Optional[str]:
+        pattern = self._get_pattern(link_type, target_handles)
+        return None if pattern is None else ExpressionHasher.composite_hash(pattern)
+
+    def get_matched_links(self, link_type: str, target_handles: List[str]):
+        if link_type != WILDCARD and WILDCARD not in target_handles:
+            try:
+                link_handle = self.get_link_handle(link_type, target_handles)
+                exists = self._atom_exists(self.link_existence_filter, link_handle, len(target_handles))
+                return [link_handle] if exists else []
+            except ValueError:
+                return []
+        pattern = self._get_pattern(link_type, target_handles)
+        if pattern is None:
+            return []
+        return self._retrieve_key_value(
+            KeyPrefix.PATTERNS,
+            ExpressionHasher.composite_hash(pattern),
+            pattern_key_tag(pattern, WILDCARD))
+
+    def get_matched_links_page(self, link_type: str, target_handles: List[str], cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        if link_type != WILDCARD and WILDCARD not in target_handles:
+            return super().get_matched_links_page(link_type, target_handles, cursor, page_size)
+        pattern = self._get_pattern(link_type, target_handles)
+        if pattern is None:
+            return 0, []
+        return self._scan_key_value(
+            KeyPrefix.PATTERNS,
+            ExpressionHasher.composite_hash(pattern),
+            pattern_key_tag(pattern, WILDCARD),
+            cursor,
+            page_size)
+
+    def count_matched_links(self, link_type: str, target_handles: List[str]) -> int:
+        return self.count_matched_links_many([(link_type, target_handles)])[0]
+
+    def count_matched_links_many(self, patterns: List[Tuple[str, List[str]]]) -> List[int]:
+        answer = [0] * len(patterns)
+        pattern_positions = []
+        pattern_hashes = []
+        pattern_tags = []
+        for position, (link_type, target_handles) in enumerate(patterns):
+            if link_type != WILDCARD and WILDCARD not in target_handles:
+                answer[position] = len(self.get_matched_links(link_type, target_handles))
+            else:
+                pattern = self._get_pattern(link_type, target_handles)
+                if pattern is not None:
+                    pattern_positions.append(position)
+                    pattern_hashes.append(ExpressionHasher.composite_hash(pattern))
+                    pattern_tags.append(pattern_key_tag(pattern, WILDCARD))
+        counts = self._count_key_values(KeyPrefix.PATTERNS, pattern_hashes, pattern_tags)
+        for position, count in zip(pattern_positions, counts):
+            answer[position] = count
+        return answer
+
+    def get_matched_links_many(self, patterns: List[Tuple[str, List[str]]]) -> List[List[Any]]:
+        answer = [[] for _ in patterns]
+        pattern_positions = []
+        pattern_hashes = []
+        pattern_tags = []
+        for position, (link_type, target_handles) in enumerate(patterns):
+            if link_type != WILDCARD and WILDCARD not in target_handles:
+                answer[position] = self.get_matched_links(link_type, target_handles)
+            else:
+                pattern = self._get_pattern(link_type, target_handles)
+                if pattern is not None:
+                    pattern_positions.append(position)
+                    pattern_hashes.append(ExpressionHasher.composite_hash(pattern))
+                    pattern_tags.append(pattern_key_tag(pattern, WILDCARD))
+        matched = self._retrieve_key_values(KeyPrefix.PATTERNS, pattern_hashes, pattern_tags)
+        for position, links in zip(pattern_positions, matched):
+            answer[position] = links
+        return answer
 
     def get_all_nodes(self, node_type: str, names: bool = False) -> List[str]:
         node_type_hash = self._get_atom_type_hash(node_type)
         if node_type_hash is None:
             raise ValueError(f'Invalid node type: {node_type}')
+        if USE_CACHED_NODES:
+            node_table = self.node_documents.table
+            positions = node_table.positions_of_type(node_type)
+            return node_table.names_at(positions) if names else node_table.handles_at(positions)
+        if USE_CACHED_NODE_TYPES and not names:
+            return self.node_types.handles_at(self.node_types.positions_of_type(node_type))
+        mongo_filter = {MongoFieldNames.TYPE: encode_handle(node_type_hash)}
         if names:
+            projection = {MongoFieldNames.NODE_NAME: True}
             return [\
                 document[MongoFieldNames.NODE_NAME] \
-                for document in self.node_documents.values() \
-                if document[MongoFieldNames.TYPE] == node_type_hash]
+                for document in self.mongo_nodes_collection.find(mongo_filter, projection)]
         else:
+            projection = {MongoFieldNames.ID_HASH: True}
             return [\
-                document[MongoFieldNames.ID_HASH] \
-                for document in self.node_documents.values() \
-                if document[MongoFieldNames.TYPE] == node_type_hash]
+                decode_handle(document[MongoFieldNames.ID_HASH]) \
+                for document in self.mongo_nodes_collection.find(mongo_filter, projection)]
 
-    def get_matched_type_template(self, template: List[Any]) -> List[str]:
+    def count_nodes(self, node_type: str) -> int:
+        if USE_CACHED_NODES or USE_CACHED_NODE_TYPES:
+            return self.node_types.count_of_type(node_type)
+        node_type_hash = self._get_atom_type_hash(node_type)
+        return self.mongo_nodes_collection.count_documents({MongoFieldNames.TYPE: encode_handle(node_type_hash)})
+
+    def _get_template_key(self, template: List[Any]) -> Tuple[str, Optional[str]]:
         try:
             template = self._build_named_type_hash_template(template)
             template_hash = ExpressionHasher.composite_hash(template)
         except KeyError as exception:
             raise ValueError(f'{exception}\nInvalid type')
-        return self._retrieve_key_value(KeyPrefix.TEMPLATES, template_hash)
+        return template_hash, template_key_tag(template)
+
+    def get_matched_type_template(self, template: List[Any]) -> List[str]:
+        template_hash, tag = self._get_template_key(template)
+        return self._retrieve_key_value(KeyPrefix.TEMPLATES, template_hash, tag)
+
+    def get_matched_type_template_page(self, template: List[Any], cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        template_hash, tag = self._get_template_key(template)
+        return self._scan_key_value(KeyPrefix.TEMPLATES, template_hash, tag, cursor, page_size)
+
+    def count_matched_type_template(self, template: List[Any]) -> int:
+        template_hash, tag = self._get_template_key(template)
+        return self._count_key_values(KeyPrefix.TEMPLATES, [template_hash], [tag])[0]
 
     def get_matched_type(self, link_type: str) -> List[str]:
         named_type_hash = self._get_atom_type_hash(link_type)
         return self._retrieve_key_value(KeyPrefix.TEMPLATES, named_type_hash)
 
+    def count_matched_type(self, link_type: str) -> int:
+        named_type_hash = self._get_atom_type_hash(link_type)
+        return self._count_key_values(KeyPrefix.TEMPLATES, [named_type_hash])[0]
+
+    def get_matched_type_page(self, link_type: str, cursor: int = 0, page_size: Optional[int] = None) -> Tuple[int, List[Any]]:
+        named_type_hash = self._get_atom_type_hash(link_type)
+        return self._scan_key_value(KeyPrefix.TEMPLATES, named_type_hash, None, cursor, page_size)
+
     def get_node_name(self, node_handle: str) -> str:
         answer = self._retrieve_key_value(KeyPrefix.NAMED_ENTITIES, node_handle)
         if not answer:
             raise ValueError(f"Invalid handle: {node_handle}")
         return answer[0].decode()
 
-    def get_matched_node_name(self, node_type: str, substring: str) -> str: 
+    def _get_node_name_index(self) -> TrigramIndex:
+        # Built on the first name search so it doesn't slow down prefetch()
+        with self.node_name_index_lock:
+            if self.node_name_index is None:
+                self.node_name_index = TrigramIndex(self.node_documents.table)
+            return self.node_name_index
+
+    def get_matched_node_name(self, node_type: str, substring: str, prefix: bool = False, case_sensitive: bool = True) -> str: 
+        # substring is a regex. Plain strings (optionally anchored with a
+        # leading '^') are answered by the local name index when it's enabled.
+        literal = substring[1:] if substring.startswith('^') else substring
+        if USE_CACHED_NODES and USE_NODE_NAME_INDEX and not any(c in REGEX_METACHARACTERS for c in literal):
+            node_table = self.node_documents.table
+            positions = self._get_node_name_index().search(
+                node_type,
+                literal,
+                prefix=prefix or substring.startswith('^'),
+                case_sensitive=case_sensitive)
+            return node_table.handles_at(positions)
         node_type_hash = self._get_atom_type_hash(node_type)
         mongo_filter = {
-            MongoFieldNames.TYPE: node_type_hash,
-            MongoFieldNames.NODE_NAME: {'$regex': substring}
+            MongoFieldNames.TYPE: encode_handle(node_type_hash),
+            MongoFieldNames.NODE_NAME: {'$regex': f'^(?:{substring})' if prefix else substring}
         }
-        return [document[MongoFieldNames.ID_HASH] for document in self.mongo_nodes_collection.find(mongo_filter)]
+        if not case_sensitive:
+            mongo_filter[MongoFieldNames.NODE_NAME]['$options'] = 'i'
+        return [decode_handle(document[MongoFieldNames.ID_HASH]) for document in self.mongo_nodes_collection.find(mongo_filter)]
 
     #################################
 
+    def _node_document_to_dict(self, document: Dict) -> Dict:
+        return {
+            "handle": document[MongoFieldNames.ID_HASH],
+            "type": document[MongoFieldNames.TYPE_NAME],
+            "name": document[MongoFieldNames.NODE_NAME],
+        }
+
+    def _link_document_to_dict(self, document: Dict) -> Dict:
+        return {
+            "handle": document[MongoFieldNames.ID_HASH],
+            "type": document[MongoFieldNames.TYPE_NAME],
+            "template": self._build_named_type_template(document[MongoFieldNames.COMPOSITE_TYPE]),
+            "targets": self._get_mongo_document_keys(document),
+        }
+
+    def _document_to_dict(self, document: Dict) -> Dict:
+        if MongoFieldNames.NODE_NAME in document:
+            return self._node_document_to_dict(document)
+        else:
+            return self._link_document_to_dict(document)
+
     def get_atom_as_dict(self, handle, arity=-1) -> dict:
         answer = {}
         document = self.node_documents.get(handle, None) if arity <= 0 else None
         if document is None:
             document = self._retrieve_mongo_document(handle, arity)
             if document:
-                answer["handle"] = document[MongoFieldNames.ID_HASH]
-                answer["type"] = document[MongoFieldNames.TYPE_NAME]
-                answer["template"] = self._build_named_type_template(document[MongoFieldNames.COMPOSITE_TYPE])
-                answer["targets"] = self._get_mongo_document_keys(document)
+                answer = self._document_to_dict(document)
         else:
-            answer["handle"] = document[MongoFieldNames.ID_HASH]
-            answer["type"] = document[MongoFieldNames.TYPE_NAME]
-            answer["name"] = document[MongoFieldNames.NODE_NAME]
+            answer = self._node_document_to_dict(document)
+        return answer
+
+    def get_atoms_as_dict(self, handles: List[str], arity=-1) -> List[Dict]:
+        node_documents = self.node_documents.get_many(handles) if arity <= 0 else {}
+        link_handles = [handle for handle in handles if handle not in node_documents]
+        link_documents = self._retrieve_mongo_documents(link_handles, arity)
+        answer = []
+        for handle in handles:
+            document = node_documents.get(handle, None)
+            if document is not None:
+                answer.append(self._node_document_to_dict(document))
+                continue
+            document = link_documents.get(handle, None)
+            answer.append(self._document_to_dict(document) if document else {})
         return answer
 
     def get_atom_as_deep_representation(self, handle: str, arity=-1) -> str:
-        return self._build_deep_representation(handle, arity)
+        return self._build_deep_representations([handle], arity)[handle]
+
+    def get_atoms_as_deep_representation(self, handles: List[str], arity=-1) -> List[Dict]:
+        representations = self._build_deep_representations(handles, arity)
+        return [representations[handle] for handle in handles]
 
     def get_link_type(self, link_handle: str) -> str:
         if USE_CACHED_LINK_TYPES:
-            return self.link_type_cache[link_handle]
+            link_type = self.link_types.get_type(link_handle)
+            if link_type is None:
+                raise ValueError(f"Invalid handle: {link_handle}")
+            return link_type
+        else:
+            return self._get_atom_types(self.link_type_cache, [link_handle], self._retrieve_mongo_documents)[0]
+
+    def get_link_types_many(self, link_handles: List[str]) -> List[str]:
+        if USE_CACHED_LINK_TYPES:
+            answer = []
+            for link_handle, position in zip(link_handles, self.link_types.positions(link_handles)):
+                if position < 0:
+                    raise ValueError(f"Invalid handle: {link_handle}")
+                answer.append(self.link_types.type_name_at(position))
+            return answer
         else:
-            document = self.get_atom_as_dict(link_handle)
-            return document["type"]
+            return self._get_atom_types(self.link_type_cache, link_handles, self._retrieve_mongo_documents)
 
     def get_node_type(self, node_handle: str) -> str:
         if USE_CACHED_NODE_TYPES:
-            return self.node_type_cache[node_handle]
+            node_type = self.node_types.get_type(node_handle)
+            if node_type is None:
+                raise ValueError(f"Invalid handle: {node_handle}")
+            return node_type
         else:
-            document = self.get_atom_as_dict(node_handle)
-            return document["type"]
+            return self._get_atom_types(self.node_type_cache, [node_handle], self.node_documents.get_many)[0]
+
+    def _get_atom_types(self, cache: Optional[LRUCache], handles: List[str], fetch_documents) -> List[str]:
+        # Types are read from the LRU cache and the misses are fetched from
+        # Mongo in a single batch
+        types = {}
+        misses = []
+        for handle in handles:
+            atom_type = cache.get(handle, None) if cache is not None else None
+            if atom_type is None:
+                misses.append(handle)
+            else:
+                types[handle] = atom_type
+        if misses:
+            for handle, document in fetch_documents(misses).items():
+                atom_type = sys.intern(document[MongoFieldNames.TYPE_NAME])
+                types[handle] = atom_type
+                if cache is not None:
+                    cache.put(handle, atom_type)
+        answer = []
+        for handle in handles:
+            atom_type = types.get(handle, None)
+            if atom_type is None:
+                raise ValueError(f"Invalid handle: {handle}")
+            answer.append(atom_type)
+        return answer
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        caches = {
+            "nodes": self.node_documents.lazy_cache if self.node_documents is not None else None,
+            "node_types": self.node_type_cache,
+            "link_types": self.link_type_cache,
+            "deep_representations": self.deep_representation_cache,
+            "key_values": self.key_value_cache,
+        }
+        return {name: cache.stats() for name, cache in caches.items() if cache is not None}
 
     def count_atoms(self) -> Tuple[int, int]:
         node_count = self.mongo_nodes_collection.estimated_document_count()
@@ -3,12 +3,19 @@ import re
 
 from typing import List
 import pytest
+import pickle
+import numpy as np
 from pymongo import MongoClient as MongoDBClient
 from redis import Redis
 
-from das.database.db_interface import DBInterface
+from das.expression_hasher import ExpressionHasher
+from das.database.db_interface import DBInterface, WILDCARD
+from das.database import redis_mongo_db
 from das.database.redis_mongo_db import RedisMongoDB
-from das.database.key_value_schema import CollectionNames as KeyPrefix, build_redis_key
+from das.database.member_codec import MEMBER_MAGIC, MemberArray, concat_members, decode_members, encode_members, member_digests
+from das.database import handle_codec
+from das.database import key_value_schema
+from das.database.key_value_schema import CollectionNames as KeyPrefix, KeyLayout, LOAD_MARKER_KEY, build_redis_key, pattern_key_tag
 from das.database.mongo_schema import CollectionNames as MongoCollectionNames, FieldNames as MongoFieldNames
 
 @pytest.fixture()
@@ -70,6 +77,37 @@ def test_db_creation(db: DBInterface):
     assert len(db.symbol_hash) == 18
     assert len(db.parent_type) == 18
 
+def test_link_routing_index(db: DBInterface):
+    assert len(db.link_routing_index) == 26
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    assert db._get_mongo_collections(-1, handle) == [db.mongo_link_collection['2']]
+    assert db._get_mongo_collections(-1, human) == []
+    assert db._retrieve_mongo_document(handle)['_id'] == handle
+    assert db._retrieve_mongo_document(human) is None
+
+def test_columnar_cache(db: DBInterface):
+    assert len(db.node_types) == 14
+    assert len(db.link_types) == 26
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    assert db.node_documents.table.name_at(db.node_types.position(human)) == 'human'
+    assert db.get_node_type(human) == 'Concept'
+    assert db.get_link_type(handle) == 'Inheritance'
+    assert db.get_link_types_many([handle, handle]) == ['Inheritance', 'Inheritance']
+    with pytest.raises(ValueError):
+        db.get_link_type(human)
+    with pytest.raises(ValueError):
+        db.get_node_type(handle)
+    document = db.node_documents.get(human, None)
+    assert document['_id'] == human
+    assert document['name'] == 'human'
+    assert document['named_type'] == 'Concept'
+    assert document['composite_type_hash'] == db._get_atom_type_hash('Concept')
+    assert sorted(db.node_documents.values(), key=lambda d: d['_id'])[0]['_id'] == min(db.get_all_nodes('Concept'))
+
 def test_node_exists(db: DBInterface):
     assert db.node_exists('Concept', 'human')
     assert db.node_exists('Concept', 'monkey')
@@ -88,6 +126,270 @@ def test_node_exists(db: DBInterface):
     assert not db.node_exists('blah', 'plant')
     assert not db.node_exists('Concept', 'blah')
 
+def test_existence_filter(db: DBInterface):
+    def no_mongo_access(*args, **kwargs):
+        assert False
+    db._retrieve_mongo_document = no_mongo_access
+    human = db.get_node_handle('Concept', 'human')
+    monkey = db.get_node_handle('Concept', 'monkey')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    assert db.node_exists('Concept', 'human')
+    assert not db.node_exists('Concept', 'blah')
+    assert not db.node_exists('blah', 'human')
+    assert db.link_exists('Inheritance', [human, mammal])
+    assert not db.link_exists('Inheritance', [mammal, human])
+    assert db.get_matched_links('Similarity', [monkey, human]) == [db.get_link_handle('Similarity', [monkey, human])]
+    assert db.get_matched_links('Similarity', [mammal, human]) == []
+
+def _gorilla_documents(db: DBInterface):
+    gorilla = db.get_node_handle('Concept', 'gorilla')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    concept_hash = db._get_atom_type_hash('Concept')
+    inheritance_hash = db._get_atom_type_hash('Inheritance')
+    node_document = {
+        '_id': gorilla,
+        'composite_type_hash': concept_hash,
+        'name': 'gorilla',
+        'named_type': 'Concept',
+    }
+    link_document = {
+        '_id': db.get_link_handle('Inheritance', [gorilla, mammal]),
+        'composite_type_hash': ExpressionHasher.composite_hash([inheritance_hash, concept_hash, concept_hash]),
+        'is_toplevel': True,
+        'composite_type': [inheritance_hash, concept_hash, concept_hash],
+        'named_type': 'Inheritance',
+        'named_type_hash': inheritance_hash,
+        'key_0': gorilla,
+        'key_1': mammal,
+    }
+    return node_document, link_document
+
+def _insert_documents(db: DBInterface, node_document, link_document):
+    db.mongo_nodes_collection.insert_one(handle_codec.encode_document(node_document))
+    db.mongo_link_collection['2'].insert_one(handle_codec.encode_document(link_document))
+
+def _delete_documents(db: DBInterface, node_document, link_document, marker):
+    db.mongo_nodes_collection.delete_one({'_id': handle_codec.encode_handle(node_document['_id'])})
+    db.mongo_link_collection['2'].delete_one({'_id': handle_codec.encode_handle(link_document['_id'])})
+    if marker is None:
+        db.redis.delete(LOAD_MARKER_KEY)
+    else:
+        db.redis.set(LOAD_MARKER_KEY, marker)
+
+def test_add_atoms(db: DBInterface):
+    node_document, link_document = _gorilla_documents(db)
+    gorilla = node_document['_id']
+    mammal = db.get_node_handle('Concept', 'mammal')
+    human = db.get_node_handle('Concept', 'human')
+    marker = db.redis.get(LOAD_MARKER_KEY)
+    _insert_documents(db, node_document, link_document)
+    try:
+        assert not db.node_exists('Concept', 'gorilla')
+        def no_atom_scan(*args, **kwargs):
+            assert False
+        db._prefetch_atoms = no_atom_scan
+        db.prefetch_load_marker = db.get_load_marker()
+        # Already known atoms are skipped
+        db.add_atoms([node_document, db.node_documents.get(human, None)], [link_document])
+        assert db.get_load_marker() != marker
+        assert db.prefetch_load_marker == db.get_load_marker()
+        assert db.node_documents.size() == 15
+        assert len(db.link_types) == 27
+        assert db.node_exists('Concept', 'gorilla')
+        assert db.link_exists('Inheritance', [gorilla, mammal])
+        assert db.get_node_type(gorilla) == 'Concept'
+        assert db.get_link_type(link_document['_id']) == 'Inheritance'
+        assert gorilla in db.get_all_nodes('Concept')
+        assert 'gorilla' in db.get_all_nodes('Concept', True)
+        assert db.count_nodes('Concept') == 15
+        assert db.get_matched_node_name('Concept', 'goril') == [gorilla]
+        assert db.get_atom_as_dict(gorilla)['name'] == 'gorilla'
+        assert db.get_atom_as_dict(link_document['_id'])['targets'] == [gorilla, mammal]
+        assert db.node_existence_filter.check(gorilla)
+        assert db.link_existence_filter.check(link_document['_id'])
+        assert not db.node_existence_filter.check(db.get_node_handle('Concept', 'blah'))
+    finally:
+        _delete_documents(db, node_document, link_document, marker)
+
+def test_existence_filter_load_marker(db: DBInterface, monkeypatch):
+    # Misses aren't final once other processes load atoms
+    monkeypatch.setattr(redis_mongo_db, 'LOAD_MARKER_CHECK_INTERVAL', 0)
+    node_document, link_document = _gorilla_documents(db)
+    mammal = db.get_node_handle('Concept', 'mammal')
+    marker = db.redis.get(LOAD_MARKER_KEY)
+    _insert_documents(db, node_document, link_document)
+    try:
+        db.prefetch_load_marker = db.get_load_marker()
+        assert not db.node_exists('Concept', 'gorilla')
+        assert not db.link_exists('Inheritance', [node_document['_id'], mammal])
+        RedisMongoDB(db.redis, db.mongo_db).mark_load()
+        assert db.node_exists('Concept', 'gorilla')
+        assert db.link_exists('Inheritance', [node_document['_id'], mammal])
+        assert not db.node_exists('Concept', 'blah')
+        # Atoms found in Mongo are added to the filters
+        def no_mongo_access(*args, **kwargs):
+            assert False
+        db._retrieve_mongo_document = no_mongo_access
+        assert db.node_exists('Concept', 'gorilla')
+        monkeypatch.setattr(redis_mongo_db, 'LOAD_MARKER_CHECK_INTERVAL', 60)
+        db.prefetch_load_marker = db.get_load_marker()
+        assert not db.node_exists('Concept', 'blah')
+    finally:
+        _delete_documents(db, node_document, link_document, marker)
+
+def test_prefetch_snapshot(redis_db, mongo_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(redis_mongo_db, 'PREFETCH_SNAPSHOT_DIR', str(tmp_path))
+    db = RedisMongoDB(redis_db, mongo_db)
+    db.prefetch()
+    assert (tmp_path / 'localhost_27017' / 'das' / 'manifest.json').exists()
+    def no_atom_scan(*args, **kwargs):
+        assert False
+    snapshot_db = RedisMongoDB(redis_db, mongo_db)
+    snapshot_db._prefetch_atoms = no_atom_scan
+    snapshot_db.prefetch()
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    assert snapshot_db.node_documents.size() == 14
+    assert len(snapshot_db.link_types) == 26
+    assert snapshot_db.get_atom_as_dict(human) == db.get_atom_as_dict(human)
+    assert snapshot_db.get_link_type(handle) == 'Inheritance'
+    assert sorted(snapshot_db.get_all_nodes('Concept', True)) == sorted(db.get_all_nodes('Concept', True))
+    assert snapshot_db.node_exists('Concept', 'human')
+    assert not snapshot_db.link_exists('Inheritance', [mammal, human])
+    assert snapshot_db._get_mongo_collections(-1, handle) == [db.mongo_link_collection['2']]
+    monkeypatch.setattr(redis_mongo_db, 'USE_CACHED_NODES', False)
+    with pytest.raises(AssertionError):
+        snapshot_db.prefetch()
+
+def test_prefetch_snapshot_load_marker(redis_db, mongo_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(redis_mongo_db, 'PREFETCH_SNAPSHOT_DIR', str(tmp_path))
+    marker = redis_db.get(LOAD_MARKER_KEY)
+    db = RedisMongoDB(redis_db, mongo_db)
+    db.prefetch()
+    scans = []
+    snapshot_db = RedisMongoDB(redis_db, mongo_db)
+    prefetch_atoms = snapshot_db._prefetch_atoms
+    def counting_atom_scan():
+        scans.append(True)
+        prefetch_atoms()
+    snapshot_db._prefetch_atoms = counting_atom_scan
+    snapshot_db.prefetch()
+    assert not scans
+    try:
+        # Same number of documents after the reload
+        db.mark_load()
+        snapshot_db.prefetch()
+        assert len(scans) == 1
+        snapshot_db.prefetch()
+        assert len(scans) == 1
+    finally:
+        if marker is None:
+            redis_db.delete(LOAD_MARKER_KEY)
+        else:
+            redis_db.set(LOAD_MARKER_KEY, marker)
+
+def test_lazy_caches(redis_db, mongo_db, monkeypatch):
+    monkeypatch.setattr(redis_mongo_db, 'USE_CACHED_NODES', False)
+    monkeypatch.setattr(redis_mongo_db, 'USE_CACHED_NODE_TYPES', False)
+    monkeypatch.setattr(redis_mongo_db, 'USE_CACHED_LINK_TYPES', False)
+    db = RedisMongoDB(redis_db, mongo_db)
+    db.prefetch()
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    assert db.get_node_type(human) == 'Concept'
+    assert db.get_node_type(human) == 'Concept'
+    assert db.get_link_types_many([handle, handle]) == ['Inheritance', 'Inheritance']
+    assert db.get_link_type(handle) == 'Inheritance'
+    with pytest.raises(ValueError):
+        db.get_link_type(human)
+    assert db.get_atom_as_dict(human)['name'] == 'human'
+    assert db.get_atom_as_dict(handle)['type'] == 'Inheritance'
+    assert db.get_atom_as_dict(handle)['type'] == 'Inheritance'
+    stats = db.cache_stats()
+    assert stats['node_types']['hits'] == 1
+    assert stats['link_types']['hits'] == 1
+    # The link handle is remembered as missing in the nodes cache
+    assert stats['nodes']['hits'] >= 1
+    assert stats['nodes']['entries'] >= 2
+    monkeypatch.setattr(redis_mongo_db, 'NODE_CACHE_MEMORY_BUDGET', 1000)
+    db.prefetch()
+    for node_type, node_name in NODE_SPECS:
+        handle = db.get_node_handle(node_type, node_name)
+        assert db.get_atoms_as_dict([handle])[0]['name'] == node_name
+    stats = db.cache_stats()
+    assert stats['nodes']['bytes'] <= 1000
+    assert stats['nodes']['evictions'] > 0
+
+def test_key_value_cache(redis_db, mongo_db, monkeypatch):
+    monkeypatch.setattr(redis_mongo_db, 'KEY_VALUE_CACHE_MEMORY_BUDGET', 1024 * 1024)
+    db = RedisMongoDB(redis_db, mongo_db)
+    db.prefetch()
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    before = db.get_matched_links('Inheritance', [human, WILDCARD])
+    assert db.get_matched_links('Inheritance', [human, WILDCARD]) == before
+    # Outgoing sets are Redis sets so targets come in no particular order
+    targets = sorted(db.get_link_targets(handle))
+    assert targets == sorted([human, mammal])
+    assert [sorted(t) for t in db.get_link_targets_many([handle, handle])] == [targets, targets]
+    stats = db.cache_stats()['key_values']
+    assert stats['hits'] == 3
+    assert stats['hit_rate'] > 0
+    assert RedisMongoDB(redis_db, mongo_db).key_value_cache is not None
+    monkeypatch.setattr(redis_mongo_db, 'KEY_VALUE_CACHE_MEMORY_BUDGET', 0)
+    assert RedisMongoDB(redis_db, mongo_db).key_value_cache is None
+    # Callers may change the answers without affecting the cache
+    db.get_link_targets(handle).append(handle)
+    assert sorted(db.get_link_targets(handle)) == targets
+    # Writes through the loaders invalidate the cached sets
+    pattern = db._get_pattern('Inheritance', [human, WILDCARD])
+    pattern_hash = db._get_pattern_hash('Inheritance', [human, WILDCARD])
+    redis_key = db._build_redis_key(KeyPrefix.PATTERNS, pattern_hash, pattern_key_tag(pattern, WILDCARD))
+    member = handle_codec.encode_redis_members(KeyPrefix.PATTERNS, [(handle, (mammal, human))])
+    db.redis.sadd(redis_key, *member)
+    try:
+        assert db.get_matched_links('Inheritance', [human, WILDCARD]) == before
+        db.invalidate_key_value(KeyPrefix.PATTERNS, pattern_hash)
+        assert len(db.get_matched_links('Inheritance', [human, WILDCARD])) == len(before) + 1
+    finally:
+        db.redis.srem(redis_key, *member)
+        db.invalidate_key_values()
+    assert sorted(db.get_matched_links('Inheritance', [human, WILDCARD])) == sorted(before)
+    # Loads by other processes (or other RedisMongoDB objects) are detected
+    # through the load marker, which is read at most once per
+    # LOAD_MARKER_CHECK_INTERVAL
+    marker = redis_db.get(LOAD_MARKER_KEY)
+    db.redis.sadd(redis_key, *member)
+    try:
+        monkeypatch.setattr(redis_mongo_db, 'LOAD_MARKER_CHECK_INTERVAL', 3600)
+        assert sorted(db.get_matched_links('Inheritance', [human, WILDCARD])) == sorted(before)
+        RedisMongoDB(redis_db, mongo_db).mark_load()
+        gets = []
+        get = db.redis.get
+        monkeypatch.setattr(db.redis, 'get', lambda key: gets.append(key) or get(key))
+        for _ in range(3):
+            assert sorted(db.get_matched_links('Inheritance', [human, WILDCARD])) == sorted(before)
+        assert not gets
+        monkeypatch.setattr(redis_mongo_db, 'LOAD_MARKER_CHECK_INTERVAL', 0)
+        assert len(db.get_matched_links('Inheritance', [human, WILDCARD])) == len(before) + 1
+        assert len(gets) == 1
+        assert db.count_matched_links('Inheritance', [human, WILDCARD]) == len(before) + 1
+        # Loads of this object keep the cache (their keys are invalidated
+        # as they are written)
+        hits = db.cache_stats()['key_values']['hits']
+        db.mark_load()
+        db.get_matched_links('Inheritance', [human, WILDCARD])
+        assert db.cache_stats()['key_values']['hits'] == hits + 1
+    finally:
+        db.redis.srem(redis_key, *member)
+        if marker is None:
+            redis_db.delete(LOAD_MARKER_KEY)
+        else:
+            redis_db.set(LOAD_MARKER_KEY, marker)
+
 def _check_link(db: DBInterface, handle: str, link_type: str, target1: str, target2: str):
     collection = db.mongo_db.get_collection(MongoCollectionNames.LINKS_ARITY_2)
     document = collection.find_one({'_id': handle})
@@ -189,6 +491,41 @@ def test_get_all_nodes(db: DBInterface):
     nodes_in_db = db.get_all_nodes('blah')
     assert len(nodes_in_db) == 0
     
+def test_count_nodes(db: DBInterface, monkeypatch):
+    assert db.count_nodes('Concept') == 14
+    assert db.count_nodes('Similarity') == 0
+    assert db.count_nodes('blah') == 0
+    assert sorted(db.get_all_nodes('Concept', True)) == sorted(name for _, name in NODE_SPECS)
+    monkeypatch.setattr(redis_mongo_db, 'USE_CACHED_NODES', False)
+    assert db.count_nodes('Concept') == 14
+    assert sorted(db.get_all_nodes('Concept')) == sorted(db.node_types.handles_at(np.arange(14)))
+    monkeypatch.setattr(redis_mongo_db, 'USE_CACHED_NODE_TYPES', False)
+    assert db.count_nodes('Concept') == 14
+    assert sorted(db.get_all_nodes('Concept', True)) == sorted(name for _, name in NODE_SPECS)
+    assert len(db.get_all_nodes('Concept')) == 14
+
+def test_get_atoms_as_dict(db: DBInterface):
+    human = db.get_node_handle('Concept', 'human')
+    monkey = db.get_node_handle('Concept', 'monkey')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handles = [
+        human,
+        db.get_link_handle('Inheritance', [human, mammal]),
+        db.get_link_handle('Similarity', [human, monkey]),
+        db.get_link_handle('Inheritance', [human, monkey]),
+        monkey,
+    ]
+    answer = db.get_atoms_as_dict(handles)
+    assert answer == [db.get_atom_as_dict(handle) for handle in handles]
+    assert answer[0]['name'] == 'human'
+    assert answer[3] == {}
+    links = handles[1:3]
+    assert db.get_atoms_as_dict(links, 2) == [db.get_atom_as_dict(handle, 2) for handle in links]
+    assert db.get_link_targets_many(links) == [db.get_link_targets(handle) for handle in links]
+    assert db.get_link_types_many(links) == ['Inheritance', 'Similarity']
+    with pytest.raises(ValueError):
+        db.get_link_targets_many([handles[1], handles[3]])
+
 def test_get_matched_links(db: DBInterface):
     # TODO: once we have API to add nodes/links, add a
     #       testcase like Eval(PN, List(X, Y)) where the
@@ -219,6 +556,163 @@ def test_get_matched_links(db: DBInterface):
     assert len(db.get_matched_links('Similarity', [human, mammal])) == 0
     assert len(db.get_matched_links('Similarity', [mammal, human])) == 0
 
+def test_binary_pattern_members(db: DBInterface):
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    pattern = db._get_pattern('Inheritance', [WILDCARD, mammal])
+    pattern_hash = db._get_pattern_hash('Inheritance', [WILDCARD, mammal])
+    members = db.redis.smembers(db._build_redis_key(KeyPrefix.PATTERNS, pattern_hash, pattern_key_tag(pattern, WILDCARD)))
+    assert all(member[0] == MEMBER_MAGIC for member in members)
+    assert (handle, (human, mammal)) in db._decode_key_value(KeyPrefix.PATTERNS, members)
+    digests = member_digests(list(members))
+    assert list(digests.keys()) == [2]
+    assert digests[2].shape == (len(members), 3, 16)
+    # Sets written with pickled members are still readable, also when mixed
+    # with binary members
+    legacy = [pickle.dumps((handle, (human, mammal))), pickle.dumps(('a' * 5, ('b', 'c')))]
+    decoded = db._decode_key_value(KeyPrefix.PATTERNS, [*members, *legacy])
+    assert len(decoded) == len(members) + 1
+    assert ('a' * 5, ('b', 'c')) in decoded
+    assert db._decode_key_value(KeyPrefix.PATTERNS, legacy[:1]) == [(handle, (human, mammal))]
+    values = [(handle, ()), (handle, (human,)), (handle, (human, mammal, human))]
+    assert decode_members(encode_members(values)) == values
+
+def test_member_array(db: DBInterface, redis_db, mongo_db, monkeypatch):
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    values = [(handle, (human, mammal)), (handle, (mammal, human)), (handle, (mammal, mammal))]
+    members = decode_members(encode_members(values) + [pickle.dumps(('a', ('b', 'c')))])
+    assert isinstance(members, MemberArray)
+    assert members.digests[2].shape == (3, 3, 16)
+    assert len(members) == 4
+    assert members[0] == values[0]
+    assert members[-1] == ('a', ('b', 'c'))
+    assert members[1:3] == values[1:]
+    assert list(members.targets([1])) == [(mammal,), (human,), (mammal,), ('c',)]
+    assert list(members.targets([])) == [(), (), (), ()]
+    both = concat_members([members, [(None, [human, human])]])
+    assert len(both) == 5
+    assert both.digests[2].shape == (3, 3, 16)
+    assert both[-1] == (None, [human, human])
+    # Matched links are kept as digests, also in the key-value cache
+    monkeypatch.setattr(redis_mongo_db, 'KEY_VALUE_CACHE_MEMORY_BUDGET', 1024 * 1024)
+    db = RedisMongoDB(redis_db, mongo_db)
+    db.prefetch()
+    matched = db.get_matched_links('Inheritance', [WILDCARD, mammal])
+    assert isinstance(matched, MemberArray)
+    assert db.get_matched_links('Inheritance', [WILDCARD, mammal]) is db.key_value_cache.get(
+        (KeyPrefix.PATTERNS, db._get_pattern_hash('Inheritance', [WILDCARD, mammal])))
+    assert (handle, (human, mammal)) in matched
+
+def test_binary_handle_codec(monkeypatch):
+    monkeypatch.setattr(handle_codec, 'USE_BINARY_HANDLES', True)
+    monkeypatch.setattr(key_value_schema, 'REDIS_KEY_LAYOUT', KeyLayout.FLAT)
+    h1, h2, h3 = ['0123456789abcdef0123456789abcdef', 'fedcba9876543210fedcba9876543210', '00' * 16]
+    document = {
+        '_id': h1,
+        'composite_type_hash': h2,
+        'composite_type': [h2, [h3, h1]],
+        'named_type': 'Evaluation',
+        'named_type_hash': h3,
+        'key_0': h1,
+        'key_1': h2,
+    }
+    encoded = handle_codec.encode_document(document)
+    assert encoded['_id'] == bytes.fromhex(h1)
+    assert encoded['composite_type'] == [bytes.fromhex(h2), [bytes.fromhex(h3), bytes.fromhex(h1)]]
+    assert encoded['key_1'] == bytes.fromhex(h2)
+    assert encoded['named_type'] == 'Evaluation'
+    assert handle_codec.decode_document(encoded) == document
+    document = {'_id': h1, 'keys': [h1, h2, h3]}
+    assert handle_codec.decode_document(handle_codec.encode_document(document)) == document
+    assert build_redis_key(KeyPrefix.OUTGOING_SET, handle_codec.encode_handle(h1)) == b'outgoing_set:' + bytes.fromhex(h1)
+    assert handle_codec.encode_redis_members(KeyPrefix.NAMED_ENTITIES, ['human']) == ['human']
+    assert handle_codec.encode_redis_members(KeyPrefix.INCOMING_SET, [h1]) == [bytes.fromhex(h1)]
+    assert handle_codec.decode_handle(bytes.fromhex(h1)) == h1
+    assert handle_codec.decode_handle(h1.encode()) == h1
+
+def test_iter_matched_links(db: DBInterface):
+    mammal = db.get_node_handle('Concept', 'mammal')
+    expected = db.get_matched_links('Inheritance', [WILDCARD, mammal])
+    assert len(expected) > 1
+    assert sorted(db.iter_matched_links('Inheritance', [WILDCARD, mammal], page_size=1)) == sorted(expected)
+    assert sorted(db.iter_matched_type('Similarity', page_size=2)) == sorted(db.get_matched_type('Similarity'))
+    template = ['Inheritance', 'Concept', 'Concept']
+    assert sorted(db.iter_matched_type_template(template)) == sorted(db.get_matched_type_template(template))
+    # The first N results can be taken without scanning the whole set
+    iterator = db.iter_matched_links('Inheritance', [WILDCARD, WILDCARD], page_size=1)
+    first = [next(iterator), next(iterator)]
+    assert all(link in db.get_matched_links('Inheritance', [WILDCARD, WILDCARD]) for link in first)
+    cursor, page = db.get_matched_links_page('Inheritance', [WILDCARD, mammal], page_size=1000)
+    assert cursor == 0 and sorted(page) == sorted(expected)
+    assert list(db.iter_matched_links('Inheritance', [mammal, mammal])) == []
+    assert list(db.iter_matched_links('blah', [WILDCARD, mammal])) == []
+
+def test_count_matched_links(db: DBInterface, monkeypatch):
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    patterns = [
+        ('Inheritance', [WILDCARD, mammal]),
+        ('Inheritance', [WILDCARD, WILDCARD]),
+        (WILDCARD, [human, WILDCARD]),
+        ('Inheritance', [human, mammal]),
+        ('Inheritance', [mammal, human]),
+        ('blah', [WILDCARD, mammal]),
+    ]
+    expected = [len(links) for links in db.get_matched_links_many(patterns)]
+    assert db.count_matched_links_many(patterns) == expected
+    assert [db.count_matched_links(*pattern) for pattern in patterns] == expected
+    assert expected[3] == 1 and expected[4] == 0
+    template = ['Inheritance', 'Concept', 'Concept']
+    assert db.count_matched_type_template(template) == len(db.get_matched_type_template(template))
+    assert db.count_matched_type('Similarity') == len(db.get_matched_type('Similarity'))
+    # Counts of cached keys don't hit Redis
+    monkeypatch.setattr(redis_mongo_db, 'KEY_VALUE_CACHE_MEMORY_BUDGET', 1024 * 1024)
+    db = RedisMongoDB(db.redis, db.mongo_db)
+    db.prefetch()
+    db.get_matched_type('Similarity')
+    hits = db.cache_stats()['key_values']['hits']
+    assert db.count_matched_type('Similarity') == len(db.get_matched_type('Similarity'))
+    assert db.cache_stats()['key_values']['hits'] == hits + 2
+
+def test_hash_tag_key_layout(monkeypatch):
+    h1, h2 = ['0123456789abcdef0123456789abcdef', 'fedcba9876543210fedcba9876543210']
+    monkeypatch.setattr(key_value_schema, 'REDIS_KEY_LAYOUT', KeyLayout.FLAT)
+    assert build_redis_key(KeyPrefix.PATTERNS, h1, h2) == f'patterns:{h1}'
+    monkeypatch.setattr(key_value_schema, 'REDIS_KEY_LAYOUT', KeyLayout.HASH_TAG)
+    assert build_redis_key(KeyPrefix.PATTERNS, h1, h2) == f'patterns:{{{h2}}}:{h1}'
+    assert build_redis_key(KeyPrefix.OUTGOING_SET, h1) == f'outgoing_set:{{{h1}}}'
+    assert build_redis_key(KeyPrefix.OUTGOING_SET, h1, h1) == f'outgoing_set:{{{h1}}}'
+    assert build_redis_key(KeyPrefix.PATTERNS, bytes.fromhex(h1), WILDCARD) == b'patterns:{*}:' + bytes.fromhex(h1)
+    # Pattern keys of the same link type share the tag
+    assert pattern_key_tag([h2, h1, WILDCARD], WILDCARD) == h2
+    assert pattern_key_tag([h2, WILDCARD, WILDCARD], WILDCARD) == h2
+    assert pattern_key_tag([WILDCARD, WILDCARD, h1], WILDCARD) == h1
+    assert pattern_key_tag([WILDCARD, WILDCARD], WILDCARD) == WILDCARD
+    assert key_value_schema.split_tagged_key(f'{h2}/{h1}') == (h1, h2)
+    assert key_value_schema.split_tagged_key(h1) == (h1, None)
+
+def test_get_matched_links_many(db: DBInterface):
+    mammal = db.get_node_handle('Concept', 'mammal')
+    animal = db.get_node_handle('Concept', 'animal')
+    human = db.get_node_handle('Concept', 'human')
+    patterns = [
+        ('Inheritance', ['*', '*']),
+        ('Inheritance', ['*', mammal]),
+        ('Inheritance', [animal, '*']),
+        ('Inheritance', [mammal, animal]),
+        ('Inheritance', [animal, mammal]),
+        ('Similarity', ['*', human]),
+        ('*', [human, '*']),
+    ]
+    answer = db.get_matched_links_many(patterns)
+    assert len(answer) == len(patterns)
+    for (link_type, targets), matched in zip(patterns, answer):
+        assert sorted(matched) == sorted(db.get_matched_links(link_type, targets))
+    assert db.get_matched_links_many([]) == []
+
 def test_build_hash_template(db: DBInterface):
     v1 = db._build_named_type_hash_template(['Inheritance', 'Concept', 'Concept'])
     v2 = db._build_named_type_hash_template(['Similarity', 'Concept', 'Concept'])
@@ -270,6 +764,65 @@ def test_get_matched_node_name(db: DBInterface):
     assert sorted(db.get_matched_node_name('blah', 'Concept')) == []
     assert sorted(db.get_matched_node_name('Concept', 'blah')) == []
 
+def test_node_name_index(db: DBInterface, monkeypatch):
+    def handles(*names):
+        return sorted(db.get_node_handle('Concept', name) for name in names)
+    queries = [
+        (('Concept', 'mal'), {}, handles('mammal', 'animal')),
+        (('Concept', 'MAL'), {}, []),
+        (('Concept', 'MAL'), {'case_sensitive': False}, handles('mammal', 'animal')),
+        (('Concept', 'r'), {'prefix': True}, handles('rhino', 'reptile')),
+        (('Concept', '^rep'), {}, handles('reptile')),
+        (('Concept', 'Ma'), {'prefix': True, 'case_sensitive': False}, handles('mammal')),
+        (('Concept', 'ine'), {}, handles('vine')),
+        (('Concept', 'human'), {}, handles('human')),
+        (('Concept', 'humans'), {}, []),
+        (('Similarity', 'human'), {}, []),
+        (('Concept', 'm.n'), {}, handles('human', 'monkey')),
+        (('Concept', 'hu|ma'), {'prefix': True}, handles('human', 'mammal')),
+    ]
+    def no_mongo_scan(*args, **kwargs):
+        assert False
+    def is_regex(substring):
+        return any(c in redis_mongo_db.REGEX_METACHARACTERS for c in substring.lstrip('^'))
+    with monkeypatch.context() as patch:
+        patch.setattr(db.mongo_nodes_collection, 'find', no_mongo_scan)
+        for args, kwargs, expected in queries:
+            if not is_regex(args[1]):
+                assert sorted(db.get_matched_node_name(*args, **kwargs)) == expected
+    for args, kwargs, expected in queries:
+        assert sorted(db.get_matched_node_name(*args, **kwargs)) == expected
+    monkeypatch.setattr(redis_mongo_db, 'USE_NODE_NAME_INDEX', False)
+    for args, kwargs, expected in queries:
+        assert sorted(db.get_matched_node_name(*args, **kwargs)) == expected
+
+def test_get_atoms_as_deep_representation(redis_db, mongo_db, monkeypatch):
+    monkeypatch.setattr(redis_mongo_db, 'DEEP_REPRESENTATION_CACHE_MEMORY_BUDGET', 1024 * 1024)
+    db = RedisMongoDB(redis_db, mongo_db)
+    db.prefetch()
+    human = db.get_node_handle('Concept', 'human')
+    monkey = db.get_node_handle('Concept', 'monkey')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    link1 = db.get_link_handle('Inheritance', [human, mammal])
+    link2 = db.get_link_handle('Similarity', [human, monkey])
+    answer = db.get_atoms_as_deep_representation([link1, human, link2, link1])
+    assert answer[0] == {
+        'type': 'Inheritance',
+        'targets': [{'type': 'Concept', 'name': 'human'}, {'type': 'Concept', 'name': 'mammal'}]}
+    assert answer[1] == {'type': 'Concept', 'name': 'human'}
+    assert answer[2]['type'] == 'Similarity'
+    assert answer[3] == answer[0]
+    # Shared subtrees are expanded once
+    assert answer[0]['targets'][0] is answer[1]
+    assert db.get_atom_as_deep_representation(link2, 2) == answer[2]
+    with pytest.raises(ValueError):
+        db.get_atom_as_deep_representation(db.get_link_handle('Inheritance', [mammal, human]))
+    def no_mongo_access(*args, **kwargs):
+        assert False
+    db._retrieve_mongo_documents = no_mongo_access
+    assert db.get_atom_as_deep_representation(link1) == answer[0]
+    assert db.cache_stats()['deep_representations']['hits'] == 2
+
 def test_atom_count(db: DBInterface):
     node_count, link_count = db.count_atoms()
     assert node_count == 14
@@ -166,15 +166,25 @@ class StubDB(DBInterface):
         _, name = _split_node_handle(node)
         return name
 
-    def get_matched_node_name(self, node_type: str, substring: str) -> str:
+    def get_matched_node_name(self, node_type: str, substring: str, prefix: bool = False, case_sensitive: bool = True) -> str:
         answer = []
+        if not case_sensitive:
+            substring = substring.lower()
         if node_type == 'Concept':
             for node in self.all_nodes:
                 _, name = _split_node_handle(node)
-                if substring in name:
+                if not case_sensitive:
+                    name = name.lower()
+                if (name.startswith(substring) if prefix else substring in name):
                     answer.append(node)
         return answer
 
+    def get_node_type(self, node_handle: str) -> str:
+        if node_handle not in self.all_nodes:
+            raise ValueError(f"Invalid handle: {node_handle}")
+        node_type, _ = _split_node_handle(node_handle)
+        return node_type
+
     def get_matched_type(self, link_named_type: str):
         pass
 
@@ -5,55 +5,107 @@ Distributed Atom Space
 
 import os
 import json
-from time import sleep
+import asyncio
+from threading import Lock
+from time import monotonic, sleep
+from weakref import WeakKeyDictionary
 from typing import List, Optional, Union, Tuple, Dict
-from pymongo import MongoClient as MongoDBClient
-from redis import Redis
-from redis.cluster import RedisCluster
 from enum import Enum, auto
 from das.parser_actions import KnowledgeBaseFile, MultiThreadParsing
 from das.database.mongo_schema import CollectionNames as MongoCollections
+from das.database.handle_codec import decode_document
 from das.parser_threads import SharedData, ParserThread, FlushNonLinksToDBThread, BuildConnectivityThread, \
     BuildPatternsThread, BuildTypeTemplatesThread, PopulateMongoDBLinksThread, PopulateRedisCollectionThread
 from das.database.redis_mongo_db import RedisMongoDB
+from das.database.memory_db import MemoryDB
+from das.database.async_redis_mongo_db import AsyncRedisMongoDB
+from das.database.handle_interning import interning_scope
+from das.database.connections import get_mongo_client, get_redis_client, new_async_redis_client
 from das.logger import logger
-from das.database.key_value_schema import CollectionNames as KeyPrefix
-from das.database.db_interface import WILDCARD
+from das.database.key_value_schema import CollectionNames as KeyPrefix, REDIS_KEY_LAYOUT
+from das.database.db_interface import DBInterface, WILDCARD
 from das.transaction import Transaction
 from das.canonical_parser import CanonicalParser
-from das.pattern_matcher.pattern_matcher import PatternMatchingAnswer, LogicalExpression
+from das.pattern_matcher.pattern_matcher import PatternMatchingAnswer, LogicalExpression, Assignment, \
+    OrderedAssignment, UnorderedAssignment
+
+# When set, the loaders also write the indexes they build (one subdirectory
+# per database) as memory mapped index files which can be served with no
+# Redis or MongoDB (see MemoryDB.open_index())
+MMAP_INDEX_DIR = os.environ.get('DAS_MMAP_INDEX_DIR', None)
+# Rewriting the index files takes time proportional to the whole index, so
+# the atoms of committed transactions are written at most once per this
+# number of seconds (on the next commit or load after it, or when
+# write_mmap_index() is called). Loads of knowledge bases are written
+# right away.
+MMAP_INDEX_WRITE_INTERVAL = float(os.environ.get('DAS_MMAP_INDEX_WRITE_INTERVAL', 60))
 
 class QueryOutputFormat(int, Enum):
     HANDLE = auto()
     ATOM_INFO = auto()
     JSON = auto()
 
+def _assignment_mapping(assignment: Assignment) -> Dict[str, str]:
+    if isinstance(assignment, OrderedAssignment):
+        return assignment.mapping
+    elif isinstance(assignment, UnorderedAssignment):
+        symbols = [symbol for symbol, count in assignment.symbols.items() for _ in range(count)]
+        values = [value for value, count in assignment.values.items() for _ in range(count)]
+        return dict(zip(symbols, values))
+    else:
+        answer = {}
+        for unordered_assignment in assignment.unordered_mappings:
+            answer.update(_assignment_mapping(unordered_assignment))
+        if assignment.ordered_mapping:
+            answer.update(assignment.ordered_mapping.mapping)
+        return answer
+
 class DistributedAtomSpace:
 
     def __init__(self, **kwargs):
         self.database_name = kwargs.get("database_name", "das")
+        # Keeps the whole knowledge base in this process (see MemoryDB)
+        # instead of in Redis and MongoDB, optionally starting from the
+        # memory mapped index files written by a loader
+        mmap_index = kwargs.get("mmap_index", None)
+        self.in_memory = kwargs.get("in_memory", False) or mmap_index is not None
         self.db = None
-        logger().info(f"New Distributed Atom Space. Database name: {self.database_name}")
-        self._setup_database()
+        # event loop -> AsyncRedisMongoDB (see query_async())
+        self.async_dbs = WeakKeyDictionary()
+        self.async_dbs_lock = Lock()
         self.pattern_black_list = []
+        # Atoms (see MemoryDB.read_key_value_files()) not written to the
+        # index files yet
+        self.mmap_index_pending = []
+        self.mmap_index_time = None
+        if self.in_memory:
+            logger().info(f"New in-memory Distributed Atom Space")
+            self.mongo_db = None
+            self.redis = None
+            if mmap_index is not None:
+                logger().info(f"Opening index files in {mmap_index}")
+                self.db = MemoryDB.open_index(mmap_index)
+            else:
+                self.db = MemoryDB(self.pattern_black_list)
+        else:
+            logger().info(f"New Distributed Atom Space. Database name: {self.database_name}")
+            self._setup_database()
 
     def _setup_database(self):
         hostname = os.environ.get('DAS_MONGODB_HOSTNAME')
         port = os.environ.get('DAS_MONGODB_PORT')
         username = os.environ.get('DAS_DATABASE_USERNAME')
         password = os.environ.get('DAS_DATABASE_PASSWORD')
-        logger().info(f"Connecting to MongoDB at {hostname}:{port}")
-        self.mongo_db = MongoDBClient(f'mongodb://{username}:{password}@{hostname}:{port}')[self.database_name]
+        self.mongo_db = get_mongo_client(hostname, port, username, password)[self.database_name]
 
         hostname = os.environ.get('DAS_REDIS_HOSTNAME')
         port = os.environ.get('DAS_REDIS_PORT')
         #TODO fix this to use a proper parameter
-        if port == "7000":
-            logger().info(f"Connecting to Redis cluster at {hostname}:{port}")
-            self.redis = RedisCluster(host=hostname, port=port, decode_responses=False)
-        else:
-            self.redis = Redis(host=hostname, port=port, decode_responses=False)
-            logger().info(f"Connecting to standalone Redis at {hostname}:{port}")
+        cluster = port == "7000"
+        if cluster:
+            logger().info(f"Redis key layout: {REDIS_KEY_LAYOUT.value}")
+        self.redis = get_redis_client(hostname, port, cluster)
+        self.redis_endpoint = (hostname, port, cluster)
 
         self.db = RedisMongoDB(self.redis, self.mongo_db)
         logger().info(f"Prefetching data")
@@ -61,6 +113,11 @@ class DistributedAtomSpace:
         logger().info(f"Database setup finished")
 
     def _log_mongodb_counts(self):
+        if self.in_memory:
+            node_count, link_count = self.db.count_atoms()
+            logger().info(f"Number of nodes: {node_count}")
+            logger().info(f"Number of links: {link_count}")
+            return
         tags = [
             MongoCollections.ATOM_TYPES, 
             MongoCollections.NODES, 
@@ -109,34 +166,46 @@ class DistributedAtomSpace:
     def _to_link_dict_list(self, db_answer: Union[List[str], List[Dict]]) -> List[Dict]:
         if not db_answer:
             return []
-        flat_handle = isinstance(db_answer[0], str)
-        answer = []
-        for atom in db_answer:
-            if flat_handle:
-                handle = atom
-                arity = -1
-            else:
-                handle, targets = atom
-                arity = len(targets)
-            answer.append(self.db.get_atom_as_dict(handle, arity))
-        return answer
+        if isinstance(db_answer[0], str):
+            return self.db.get_atoms_as_dict(db_answer)
+        arities = set(len(targets) for _, targets in db_answer)
+        arity = arities.pop() if len(arities) == 1 else -1
+        return self.db.get_atoms_as_dict([handle for handle, _ in db_answer], arity)
 
     def _to_json(self, db_answer: Union[List[str], List[Dict]]) -> List[Dict]:
         answer = []
         if db_answer:
-            flat_handle = isinstance(db_answer[0], str)
-            for atom in db_answer:
-                if flat_handle:
-                    handle = atom
-                    arity = -1
-                else:
-                    handle, targets = atom
-                    arity = len(targets)
-                answer.append(self.db.get_atom_as_deep_representation(handle, arity))
+            if isinstance(db_answer[0], str):
+                answer = self.db.get_atoms_as_deep_representation(db_answer)
+            else:
+                arities = set(len(targets) for _, targets in db_answer)
+                arity = arities.pop() if len(arities) == 1 else -1
+                answer = self.db.get_atoms_as_deep_representation([handle for handle, _ in db_answer], arity)
         return json.dumps(answer, sort_keys=False, indent=4)
 
+    def _format_links(self, db_answer: Union[List[str], List[Dict]], output_format: QueryOutputFormat):
+        if output_format == QueryOutputFormat.HANDLE:
+            return self._to_handle_list(db_answer)
+        elif output_format == QueryOutputFormat.ATOM_INFO:
+            return self._to_link_dict_list(db_answer)
+        elif output_format == QueryOutputFormat.JSON:
+            return self._to_json(db_answer)
+        else:
+            raise ValueError(f"Invalid output format: '{output_format}'")
+
     def _process_parsed_data(self, shared_data: SharedData, update: bool):
+        if self.in_memory:
+            self.db.pattern_black_list = self.pattern_black_list
+            self.db.add_expressions([
+                *shared_data.typedef_expressions,
+                *shared_data.terminals,
+                *shared_data.regular_expressions])
+            return
         shared_data.replicate_regular_expressions()
+        if update:
+            # Terminals are consumed by FlushNonLinksToDBThread
+            node_documents = [terminal.to_dict() for terminal in shared_data.terminals]
+            link_documents = [expression.to_dict() for expression in shared_data.regular_expressions_list]
         file_builder_threads = [
             FlushNonLinksToDBThread(self.db, shared_data, update),
             BuildConnectivityThread(shared_data),
@@ -165,19 +234,77 @@ class DistributedAtomSpace:
         for thread in file_processor_threads:
             thread.join()
         assert shared_data.process_ok_count == len(file_processor_threads)
-        self.db.prefetch()
+        if update:
+            # Transactions are usually small so the new atoms are added to
+            # the prefetched data instead of prefetching the whole DB again
+            self.db.add_atoms(node_documents, link_documents)
+        else:
+            self.db.mark_load()
+            self.db.prefetch()
+        self._write_mmap_index(shared_data.temporary_file_name, update)
+
+    def _get_type_documents(self):
+        return map(decode_document, self.mongo_db[MongoCollections.ATOM_TYPES].find())
+
+    def _write_mmap_index(self, file_names: Dict[str, str], update: bool = False):
+        if not MMAP_INDEX_DIR:
+            return
+        reader = MemoryDB(self.pattern_black_list)
+        self.mmap_index_pending.append(reader.read_key_value_files(file_names, self._get_type_documents()))
+        if update and self.mmap_index_time is not None and \
+           monotonic() - self.mmap_index_time < MMAP_INDEX_WRITE_INTERVAL:
+            return
+        self.write_mmap_index()
 
 
     # Public API
 
+    def write_mmap_index(self):
+        # Writes the atoms loaded since the last call to the index files in
+        # DAS_MMAP_INDEX_DIR
+        if not MMAP_INDEX_DIR or not self.mmap_index_pending:
+            return
+        directory = os.path.join(MMAP_INDEX_DIR, self.database_name)
+        logger().info(f"Writing index files in {directory}")
+        try:
+            # Atoms of previous loads are kept. The files are merged as arrays
+            # (see MemoryDB._add_atoms()) so this needs RAM for the arrays of
+            # the whole index plus the Python objects of the pending loads.
+            memory_db = MemoryDB.open_index(directory)
+        except ValueError:
+            memory_db = MemoryDB(self.pattern_black_list)
+        memory_db.add_type_documents(self._get_type_documents())
+        nodes, links, patterns = [], [], ([], [])
+        for pending_nodes, pending_links, pending_patterns in self.mmap_index_pending:
+            nodes.extend(pending_nodes)
+            links.extend(pending_links)
+            if patterns is not None and pending_patterns is not None:
+                patterns[0].extend(pending_patterns[0])
+                patterns[1].extend(pending_patterns[1])
+            else:
+                # Patterns are built from the links
+                patterns = None
+        memory_db.add_atom_records(nodes, links, patterns)
+        memory_db.save_index(directory)
+        self.mmap_index_pending = []
+        self.mmap_index_time = monotonic()
+
     def clear_database(self):
+        self.mmap_index_pending = []
+        if self.in_memory:
+            self.db.clear()
+            return
         for collection_name in self.mongo_db.collection_names():
             self.mongo_db.drop_collection(collection_name)
         self.redis.flushall()
+        self.db.invalidate_key_values()
 
     def count_atoms(self) -> Tuple[int, int]:
         return self.db.count_atoms()
 
+    def count_nodes(self, node_type: str) -> int:
+        return self.db.count_nodes(node_type)
+
     def get_atom(self,
         handle: str,
         output_format: QueryOutputFormat = QueryOutputFormat.HANDLE) -> Union[str, Dict]:
@@ -228,9 +355,9 @@ class DistributedAtomSpace:
         if output_format == QueryOutputFormat.HANDLE or not answer:
             return answer
         elif output_format == QueryOutputFormat.ATOM_INFO:
-            return [self.db.get_atom_as_dict(handle) for handle in answer]
+            return self.db.get_atoms_as_dict(answer)
         elif output_format == QueryOutputFormat.JSON:
-            answer = [self.db.get_atom_as_deep_representation(handle) for handle in answer]
+            answer = self.db.get_atoms_as_deep_representation(answer)
             return json.dumps(answer, sort_keys=False, indent=4)
         else:
             raise ValueError(f"Invalid output format: '{output_format}'")
@@ -260,28 +387,56 @@ class DistributedAtomSpace:
         link_type: str,
         target_types: str = None,
         targets: List[str] = None,
-        output_format: QueryOutputFormat = QueryOutputFormat.HANDLE) -> Union[List[str], List[Dict]]:
+        output_format: QueryOutputFormat = QueryOutputFormat.HANDLE,
+        cursor: Optional[int] = None,
+        page_size: Optional[int] = None) -> Union[List[str], List[Dict], Tuple[int, Union[List[str], List[Dict]]]]:
+
+        # When cursor or page_size are passed, only one page of the answer is
+        # returned, together with the cursor to fetch the next one (0 means
+        # that there are no more pages)
+        paged = cursor is not None or page_size is not None
+        cursor = cursor or 0
 
         if link_type is None:
             link_type = WILDCARD
 
         if target_types is not None and link_type != WILDCARD:
-            db_answer = self.db.get_matched_type_template([link_type, *target_types])
+            if paged:
+                cursor, db_answer = self.db.get_matched_type_template_page([link_type, *target_types], cursor, page_size)
+            else:
+                db_answer = self.db.get_matched_type_template([link_type, *target_types])
         elif targets is not None:
-            db_answer = self.db.get_matched_links(link_type, targets)
+            if paged:
+                cursor, db_answer = self.db.get_matched_links_page(link_type, targets, cursor, page_size)
+            else:
+                db_answer = self.db.get_matched_links(link_type, targets)
         elif link_type != WILDCARD:
-            db_answer = self.db.get_matched_type(link_type)
+            if paged:
+                cursor, db_answer = self.db.get_matched_type_page(link_type, cursor, page_size)
+            else:
+                db_answer = self.db.get_matched_type(link_type)
         else:
             raise ValueError("Invalid parameters")
 
-        if output_format == QueryOutputFormat.HANDLE:
-            return self._to_handle_list(db_answer)
-        elif output_format == QueryOutputFormat.ATOM_INFO:
-            return self._to_link_dict_list(db_answer)
-        elif output_format == QueryOutputFormat.JSON:
-            return self._to_json(db_answer)
+        answer = self._format_links(db_answer, output_format)
+        return (cursor, answer) if paged else answer
+
+    def count_links(self,
+        link_type: str,
+        target_types: str = None,
+        targets: List[str] = None) -> int:
+
+        if link_type is None:
+            link_type = WILDCARD
+
+        if target_types is not None and link_type != WILDCARD:
+            return self.db.count_matched_type_template([link_type, *target_types])
+        elif targets is not None:
+            return self.db.count_matched_links(link_type, targets)
+        elif link_type != WILDCARD:
+            return self.db.count_matched_type(link_type)
         else:
-            raise ValueError(f"Invalid output format: '{output_format}'")
+            raise ValueError("Invalid parameters")
 
     def get_link_type(self, link_handle: str) -> str:
         return self.db.get_link_type(link_handle)
@@ -297,10 +452,70 @@ class DistributedAtomSpace:
 
     def query(self,
         query: LogicalExpression,
-        output_format: QueryOutputFormat = QueryOutputFormat.HANDLE) -> str:
+        output_format: QueryOutputFormat = QueryOutputFormat.HANDLE,
+        limit: Optional[int] = None) -> str:
+
+        # With a limit, matching stops as soon as enough assignments are
+        # found (see LogicalExpression.iter_matches()). A negated answer
+        # lists the assignments excluded by the query, and dropping some
+        # of them would accept those, so limit doesn't apply to it and it's
+        # evaluated in full. Handles are interned in a table released with
+        # the answer (see handle_interning).
+        with interning_scope():
+            query_answer = PatternMatchingAnswer()
+            if limit is None or query.negated():
+                matched = query.matched(self.db, query_answer)
+            else:
+                matched = self._matched_limit(query, self.db, query_answer, limit)
+            return self._format_query_answer(matched, query_answer, output_format)
+
+    async def query_async(self,
+        query: LogicalExpression,
+        output_format: QueryOutputFormat = QueryOutputFormat.HANDLE,
+        limit: Optional[int] = None) -> str:
+
+        # limit works as in query()
+        if self.in_memory:
+            # Nothing to wait for
+            return self.query(query, output_format, limit)
+        async_db = self._get_async_db()
+        with interning_scope():
+            query_answer = PatternMatchingAnswer()
+            if limit is None or query.negated():
+                matched = await query.matched_async(async_db, query_answer)
+            else:
+                matched = await async_db.run_sync(self._matched_limit, query, async_db.db, query_answer, limit)
+            if output_format == QueryOutputFormat.HANDLE:
+                return self._format_query_answer(matched, query_answer, output_format)
+            return await async_db.run_sync(self._format_query_answer, matched, query_answer, output_format)
+
+    def _matched_limit(
+        self,
+        query: LogicalExpression,
+        db: DBInterface,
+        answer: PatternMatchingAnswer,
+        limit: int) -> bool:
+
+        assignments = list(query.iter_matches(db, limit))
+        answer.assignments = {assignment for assignment in assignments if assignment.variables}
+        return bool(assignments)
+
+    def _get_async_db(self) -> AsyncRedisMongoDB:
+        # asyncio Redis clients can only be used in the event loop they were
+        # created in, so there's one per loop
+        loop = asyncio.get_running_loop()
+        with self.async_dbs_lock:
+            async_db = self.async_dbs.get(loop, None)
+            if async_db is None:
+                async_db = AsyncRedisMongoDB(self.db, new_async_redis_client(*self.redis_endpoint))
+                self.async_dbs[loop] = async_db
+            return async_db
+
+    def _format_query_answer(self,
+        matched: bool,
+        query_answer: PatternMatchingAnswer,
+        output_format: QueryOutputFormat) -> str:
 
-        query_answer = PatternMatchingAnswer()
-        matched = query.matched(self.db, query_answer)
         tag_not = ""
         mapping = ""
         if matched:
@@ -309,13 +524,17 @@ class DistributedAtomSpace:
             if output_format == QueryOutputFormat.HANDLE:
                 mapping = str(query_answer.assignments)
             elif output_format == QueryOutputFormat.ATOM_INFO:
-                mapping = str({
-                    var: self.db.get_atom_as_dict(handle)
-                    for var, handle in query_answer.assignments.items()})
+                mappings = [_assignment_mapping(assignment) for assignment in query_answer.assignments]
+                handles = list(set(handle for m in mappings for handle in m.values()))
+                atoms = dict(zip(handles, self.db.get_atoms_as_dict(handles)))
+                mapping = str([{var: atoms[handle] for var, handle in m.items()} for m in mappings])
             elif output_format == QueryOutputFormat.JSON:
-                mapping = json.dumps({
-                    var: self.db.get_atom_as_deep_representation(handle)
-                    for var, handle in query_answer.assignments.items()}, sort_keys=False, indent=4)
+                mappings = [_assignment_mapping(assignment) for assignment in query_answer.assignments]
+                handles = list(set(handle for m in mappings for handle in m.values()))
+                atoms = dict(zip(handles, self.db.get_atoms_as_deep_representation(handles)))
+                mapping = json.dumps([
+                    {var: atoms[handle] for var, handle in m.items()}
+                    for m in mappings], sort_keys=False, indent=4)
             else:
                 raise ValueError(f"Invalid output format: '{output_format}'")
         return f"{tag_not}{mapping}"
@@ -401,6 +620,8 @@ class DistributedAtomSpace:
         Typically this method is used to load huge knowledge bases generated (or translated
         to MeTTa) by an automated tool.
         """
+        if self.in_memory:
+            raise ValueError("Canonical knowledge bases can't be loaded in in-memory DAS")
         logger().info(f"Loading canonical knowledge base")
         knowledge_base_file_list = sorted(self._get_file_list(source), reverse=True)
         for file_name in knowledge_base_file_list:
@@ -410,6 +631,8 @@ class DistributedAtomSpace:
         for file_name in knowledge_base_file_list:
             canonical_parser.parse(file_name)
         canonical_parser.populate_indexes()
+        self.db.mark_load()
+        self._write_mmap_index(canonical_parser.temporary_file_name)
         logger().info(f"Finished loading canonical knowledge base")
         self._log_mongodb_counts()
 
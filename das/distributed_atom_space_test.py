@@ -1,9 +1,12 @@
+import json
 import tempfile
 import shutil
 import os
 import pytest
 from das.distributed_atom_space import DistributedAtomSpace, WILDCARD, QueryOutputFormat
 from das.database.db_interface import UNORDERED_LINK_TYPES
+from das.database.handle_interning import interned_count
+from das.pattern_matcher.pattern_matcher import Link, Node, Not, Variable
 
 das = DistributedAtomSpace()
 
@@ -125,6 +128,37 @@ def test_get_nodes():
     assert sorted(concepts) == sorted(all_nodes)
     
 
+def test_query():
+    query = Link(inheritance, [Variable("V1"), Node(concept, "mammal")], True)
+    answer = eval(das.query(query, output_format=QueryOutputFormat.ATOM_INFO))
+    assert sorted(a["V1"]["name"] for a in answer) == ["chimp", "human", "monkey", "rhino"]
+    assert all(a["V1"]["type"] == concept for a in answer)
+    answer = json.loads(das.query(query, output_format=QueryOutputFormat.JSON))
+    assert sorted(a["V1"]["name"] for a in answer) == ["chimp", "human", "monkey", "rhino"]
+    answer = json.loads(das.get_links(inheritance, None, [WILDCARD, das.get_node(concept, "mammal")], QueryOutputFormat.JSON))
+    assert sorted(a["targets"][0]["name"] for a in answer) == ["chimp", "human", "monkey", "rhino"]
+    assert all(a["targets"][1] == {"type": concept, "name": "mammal"} for a in answer)
+
+def test_query_limit():
+    query = Link(inheritance, [Variable("V1"), Node(concept, "mammal")], True)
+    answer = eval(das.query(query, output_format=QueryOutputFormat.ATOM_INFO, limit=2))
+    assert len(answer) == 2
+    assert all(a["V1"]["name"] in ["chimp", "human", "monkey", "rhino"] for a in answer)
+    assert len(eval(das.query(query, output_format=QueryOutputFormat.ATOM_INFO, limit=10))) == 4
+    assert das.query(Node(concept, "human"), limit=1) == "set()"
+    assert das.query(Node(concept, "blah"), limit=1) == ""
+    query = Not(Link(inheritance, [Variable("V1"), Node(concept, "mammal")], True))
+    assert das.query(query, limit=1).startswith("NOT ")
+    # Negated answers are not cut short
+    assert len(das.query(query, limit=1)) == len(das.query(query))
+
+def test_query_interning_scope():
+    query = Link(inheritance, [Variable("V1"), Variable("V2")], True)
+    count = interned_count()
+    answer = eval(das.query(query, output_format=QueryOutputFormat.ATOM_INFO))
+    assert len(answer) == len(all_inheritances)
+    assert interned_count() == count
+
 def test_get_link():
     link_handle = das.get_link(similarity, [human, monkey])
     link = das.get_link(similarity, [human, monkey], output_format=QueryOutputFormat.ATOM_INFO)
@@ -254,3 +288,33 @@ def test_get_links_with_patterns():
         set([human, ent]),
         [human, mammal],
     ])
+
+def test_get_links_paged():
+    expected = set(das.get_links(link_type=inheritance, targets=[WILDCARD, WILDCARD]))
+    answer = []
+    cursor = 0
+    while True:
+        cursor, page = das.get_links(link_type=inheritance, targets=[WILDCARD, WILDCARD], cursor=cursor, page_size=3)
+        answer.extend(page)
+        if cursor == 0:
+            break
+    assert set(answer) == expected
+    cursor, page = das.get_links(link_type=similarity, page_size=100, output_format=QueryOutputFormat.ATOM_INFO)
+    assert cursor == 0
+    assert len(page) == len(das.get_links(link_type=similarity))
+    assert all(link["type"] == similarity for link in page)
+    cursor, page = das.get_links(link_type=similarity, target_types=[concept, concept], page_size=100)
+    assert cursor == 0
+    assert set(page) == set(das.get_links(link_type=similarity, target_types=[concept, concept]))
+    assert das.get_links(link_type=inheritance, targets=[human, mammal], page_size=10) == \
+        (0, das.get_links(link_type=inheritance, targets=[human, mammal]))
+
+def test_count_links():
+    assert das.count_links(link_type=inheritance, targets=[WILDCARD, WILDCARD]) == len(all_inheritances)
+    assert das.count_links(link_type=inheritance, targets=[WILDCARD, mammal]) == \
+        len(das.get_links(link_type=inheritance, targets=[WILDCARD, mammal]))
+    assert das.count_links(link_type=similarity) == len(das.get_links(link_type=similarity))
+    assert das.count_links(link_type=similarity, target_types=[concept, concept]) == \
+        len(das.get_links(link_type=similarity, target_types=[concept, concept]))
+    with pytest.raises(ValueError):
+        das.count_links(link_type=None)
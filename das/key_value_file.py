@@ -1,13 +1,17 @@
 from das.expression_hasher import ExpressionHasher
+from das.database.key_value_schema import KEY_TAG_SEPARATOR
 import os
 
 def sort_file(file_name):
     os.system(f"sort -t , -k 1,1 {file_name} > {file_name}.sorted")
     os.rename(f"{file_name}.sorted", file_name)
 
-def write_key_value(file, key, value):
+def write_key_value(file, key, value, tag=None):
     if isinstance(key, list):
         key = ExpressionHasher.composite_hash(key)
+    if tag is not None and tag != key:
+        # See key_value_schema.build_redis_key()
+        key = f"{tag}{KEY_TAG_SEPARATOR}{key}"
     if isinstance(value, list):
         value = "\t".join(value)
     line = f"{key}\t{value}"
@@ -1,11 +1,11 @@
 import os
 import datetime
 import time
-import pickle
 from threading import Thread, Lock
 from das.expression import Expression
 from das.database.mongo_schema import CollectionNames as MongoCollections
-from das.database.key_value_schema import CollectionNames as KeyPrefix, build_redis_key
+from das.database.key_value_schema import CollectionNames as KeyPrefix, build_redis_key, pattern_key_tag, split_tagged_key
+from das.database.handle_codec import encode_handle, encode_document, encode_redis_members
 from das.metta_yacc import MettaYacc
 from das.atomese_yacc import AtomeseYacc
 from das.database.db_interface import DBInterface
@@ -108,7 +108,7 @@ class FlushNonLinksToDBThread(Thread):
 
     def _insert_many(self, collection, bulk_insertion):
         try:
-            collection.insert_many(bulk_insertion, ordered=False)
+            collection.insert_many([encode_document(document) for document in bulk_insertion], ordered=False)
         except Exception as e:
             if not self.allow_duplicates:
                 logger().error(str(e))
@@ -216,7 +216,11 @@ class BuildPatternsThread(Thread):
                     keys.append([WILDCARD, WILDCARD, WILDCARD, expression.elements[2]])
                     keys.append([WILDCARD, WILDCARD, WILDCARD, WILDCARD])
             for key in keys:
-                write_key_value(patterns, key, [expression.hash_code, *expression.elements])
+                write_key_value(
+                    patterns,
+                    key,
+                    [expression.hash_code, *expression.elements],
+                    tag=pattern_key_tag(key, WILDCARD))
         patterns.close()
         os.system(f"sort -t , -k 1,1 {file_name} > {file_name}.sorted")
         os.rename(f"{file_name}.sorted", file_name)
@@ -240,7 +244,8 @@ class BuildTypeTemplatesThread(Thread):
             write_key_value(
                 template,
                 expression.composite_type_hash, 
-                [expression.hash_code, *expression.elements])
+                [expression.hash_code, *expression.elements],
+                tag=expression.named_type_hash)
             write_key_value(
                 template,
                 expression.named_type_hash,
@@ -262,7 +267,7 @@ class PopulateMongoDBLinksThread(Thread):
 
     def _insert_many(self, collection, bulk_insertion):
         try:
-            collection.insert_many(bulk_insertion, ordered=False)
+            collection.insert_many([encode_document(document) for document in bulk_insertion], ordered=False)
         except Exception as e:
             if not self.allow_duplicates:
                 logger().error(str(e))
@@ -325,10 +330,10 @@ class PopulateRedisCollectionThread(Thread):
         for key, value, block_count in generator(file_name, merge_rest=self.merge_rest):
             assert block_count == 0
             #print(f"file_name = {file_name} type(value) = {type(value)} type(value[0]) = {type(value[0])} value = {value}")
-            if self.use_targets:
-                self.db.redis.sadd(build_redis_key(self.collection_name, key), *[pickle.dumps(v) for v in value])
-            else:
-                self.db.redis.sadd(build_redis_key(self.collection_name, key), *value)
+            key, tag = split_tagged_key(key)
+            redis_key = build_redis_key(self.collection_name, encode_handle(key), encode_handle(tag))
+            self.db.redis.sadd(redis_key, *encode_redis_members(self.collection_name, value))
+            self.db.invalidate_key_value(self.collection_name, key)
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         self.shared_data.process_ok()
         logger().info(f"Redis collection uploader thread {self.name} (TID {self.native_id}) finished. " + \
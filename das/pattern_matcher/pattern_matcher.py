@@ -1,11 +1,15 @@
+import asyncio
+import math
 import time
 from abc import ABC, abstractmethod
-from copy import deepcopy
 from enum import Enum, auto
 from functools import cmp_to_key
-from typing import Dict, FrozenSet, List, Optional, Set, Union
+from itertools import islice
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple, Union
 
-from das.database.db_interface import DBInterface, WILDCARD
+from das.database.db_interface import DBInterface, UNORDERED_LINK_TYPES, WILDCARD
+from das.database.handle_interning import HandleTable, current_table
+from das.database.member_codec import MemberArray, concat_members
 
 DEBUG_AND = False
 DEBUG_OR = False
@@ -16,8 +20,19 @@ DEBUG_LINK_TEMPLATE = False
 CONFIG = {
     # Enforce different values for different variables in ordered assignments
     'no_overload': False, # Enforce different values for different variables in ordered assignments
+    # Join ordered assignments in AND by hashing the values of their shared
+    # variables instead of trying every pair
+    'hash_join': True,
+    # Evaluate the terms of AND starting from the ones expected to match
+    # fewer links and look up later terms using the values already assigned
+    # to their variables
+    'query_planner': True,
 }
 
+# Max number of assignments joined with the next term of AND at a time by
+# iter_matches() (the bound lookups of a page are sent in a single call)
+ITER_JOIN_PAGE_SIZE = 1000
+
 class CompatibilityStatus(int, Enum):
     """
     Enum for validate_match_only() warning messages.
@@ -33,6 +48,8 @@ class Assignment(ABC):
     TODO: documentation
     """
 
+    __slots__ = ('variables', 'hash', 'frozen')
+
     def __init__(self):
         self.variables: Union[Set[str], FrozenSet] = set()
         self.hash: int = 0
@@ -75,36 +92,66 @@ class OrderedAssignment(Assignment):
     TODO: documentation
     """
 
-    def __init__(self):
+    # Values are kept as ids interned in table (see handle_interning).
+    # mapping and values have the actual handles, built once the assignment
+    # is frozen.
+    __slots__ = ('mapping_ids', 'value_ids', 'table', '_mapping', '_values')
+
+    def __init__(self, table: Optional[HandleTable] = None):
         super().__init__()
-        self.mapping: Dict[str, str] = {}
-        self.values: Union[Set[str], FrozenSet] = set()
+        self.mapping_ids: Dict[str, int] = {}
+        self.value_ids: Union[Set[int], FrozenSet] = set()
+        self.table = current_table() if table is None else table
+        self._mapping = None
+        self._values = None
 
     def __repr__(self):
         return self.mapping.__repr__()
 
+    @property
+    def mapping(self) -> Dict[str, str]:
+        if self._mapping is not None:
+            return self._mapping
+        mapping = {variable: self.table.handle(value) for variable, value in self.mapping_ids.items()}
+        if self.frozen:
+            self._mapping = mapping
+        return mapping
+
+    @property
+    def values(self) -> FrozenSet[str]:
+        if self._values is not None:
+            return self._values
+        values = frozenset(self.table.handle(value) for value in self.value_ids)
+        if self.frozen:
+            self._values = values
+        return values
+
     def freeze(self):
         assert super().freeze()
-        self.values = frozenset(self.values)
-        self.hash = hash(frozenset(self.mapping.items()))
+        self.value_ids = frozenset(self.value_ids)
+        self.hash = hash(frozenset(self.mapping_ids.items()))
         return True
 
     def assign(self, variable: str, value: str) -> bool:
         if variable is None or value is None or self.frozen:
             raise ValueError(f'Invalid assignment: variable = {variable} value = {value} frozen = {self.frozen}')
+        return self._assign_id(variable, self.table.intern(value))
+
+    def _assign_id(self, variable: str, value: int) -> bool:
         if variable in self.variables:
-            return self.mapping[variable] == value
+            return self.mapping_ids[variable] == value
         else:
-            if CONFIG['no_overload'] and value in self.values:
+            if CONFIG['no_overload'] and value in self.value_ids:
                 return False
             self.variables.add(variable)
-            self.values.add(value)
-            self.mapping[variable] = value
+            self.value_ids.add(value)
+            self.mapping_ids[variable] = value
             return True
 
     def join(self, other: Assignment) -> Assignment:
         assert self.frozen and other.frozen
         if isinstance(other, OrderedAssignment):
+            assert self.table is other.table
             return self._join_ordered(other)
         else:
             return other.join(self)
@@ -126,12 +173,12 @@ class OrderedAssignment(Assignment):
         elif status == CompatibilityStatus.SECOND_COVERS_FIRST:
             return other
         elif status == CompatibilityStatus.NO_COVERING:
-            answer = OrderedAssignment()
-            for variable, value in self.mapping.items():
-                if not answer.assign(variable, value):
+            answer = OrderedAssignment(self.table)
+            for variable, value in self.mapping_ids.items():
+                if not answer._assign_id(variable, value):
                     return None
-            for variable, value in other.mapping.items():
-                if not answer.assign(variable, value):
+            for variable, value in other.mapping_ids.items():
+                if not answer._assign_id(variable, value):
                     return None
             answer.freeze()
             return answer
@@ -143,7 +190,7 @@ class OrderedAssignment(Assignment):
         if self.hash == other.hash:
             return CompatibilityStatus.EQUAL
         for variable in self.variables.intersection(other.variables):
-            if self.mapping[variable] != other.mapping[variable]:
+            if self.mapping_ids[variable] != other.mapping_ids[variable]:
                 return CompatibilityStatus.INCOMPATIBLE
         if other.variables < self.variables:
             return CompatibilityStatus.FIRST_COVERS_SECOND
@@ -159,10 +206,16 @@ class UnorderedAssignment(Assignment):
     """
     TODO: documentation
     """
-    def __init__(self):
+    # Counts of variables and of values (ids interned in table, see
+    # handle_interning). values has the counts of the actual handles.
+    __slots__ = ('symbols', 'value_ids', 'table', '_values')
+
+    def __init__(self, table: Optional[HandleTable] = None):
         super().__init__()
         self.symbols: Dict[str, int] = {}
-        self.values: Dict[str, int] = {}
+        self.value_ids: Dict[int, int] = {}
+        self.table = current_table() if table is None else table
+        self._values = None
 
     #def __repr__(self):
     #    return self.symbols.__repr__() + ' ' + self.values.__repr__()
@@ -181,13 +234,22 @@ class UnorderedAssignment(Assignment):
             mapping[symbol] = value
         return '*' + mapping.__repr__()
 
+    @property
+    def values(self) -> Dict[str, int]:
+        if self._values is not None:
+            return self._values
+        values = {self.table.handle(value): count for value, count in self.value_ids.items()}
+        if self.frozen:
+            self._values = values
+        return values
+
     def freeze(self):
         assert super().freeze()
         symbols_count = tuple(sorted(self.symbols.values()))
-        values_count = tuple(sorted(self.values.values()))
+        values_count = tuple(sorted(self.value_ids.values()))
         if symbols_count != values_count:
             return False
-        self.hash = hash(tuple([hash(frozenset(self.symbols.items())), hash(frozenset(self.values.items()))]))
+        self.hash = hash(tuple([hash(frozenset(self.symbols.items())), hash(frozenset(self.value_ids.items()))]))
         return True
 
     def assign(self, variable: str, value: str) -> bool:
@@ -195,8 +257,9 @@ class UnorderedAssignment(Assignment):
             raise ValueError(f'Invalid assignment: variable = {variable} value = {value} frozen = {self.frozen}')
         if variable in self.variables:
             return False
+        value = self.table.intern(value)
         self.symbols[variable] = self.symbols.get(variable, 0) + 1
-        self.values[value] = self.values.get(value, 0) + 1
+        self.value_ids[value] = self.value_ids.get(value, 0) + 1
         self.variables.add(variable)
         return True
 
@@ -218,29 +281,33 @@ class UnorderedAssignment(Assignment):
 
     def contains_ordered(self, ordered_assignment) -> bool:
         count_values = {}
-        for variable, value in ordered_assignment.mapping.items():
+        for variable, value in ordered_assignment.mapping_ids.items():
             if variable not in self.variables:
                 return False
             count_values[value] = count_values.get(value, 0) + 1
         for value in count_values.keys():
-            if self.values.get(value, 0) < count_values[value]:
+            if self.value_ids.get(value, 0) < count_values[value]:
                 return False
         return True
 
     def is_covered_by_ordered(self, ordered_assignment) -> bool:
-        copy = deepcopy(self)
-        for variable, value in ordered_assignment.mapping.items():
-            copy.symbols[variable] = copy.symbols.get(variable, 0) - 1
-            copy.values[value] = copy.values.get(value, 0) - 1
-        return all(count <= 0 for count in copy.symbols.values()) and all(count <= 0 for count in copy.values.values())
-        
+        # Each symbol and value must be matched at least as many times in
+        # ordered_assignment
+        mapping = ordered_assignment.mapping_ids
+        for symbol, count in self.symbols.items():
+            if count > (1 if symbol in mapping else 0):
+                return False
+        count_values = {}
+        for value in mapping.values():
+            count_values[value] = count_values.get(value, 0) + 1
+        return all(count <= count_values.get(value, 0) for value, count in self.value_ids.items())
 
     def contains_unordered(self, unordered_assignment) -> bool:
         for symbol, count in unordered_assignment.symbols.items():
             if self.symbols.get(symbol, 0) < count:
                 return False
-        for value, count in unordered_assignment.values.items():
-            if self.values.get(value, 0) < count:
+        for value, count in unordered_assignment.value_ids.items():
+            if self.value_ids.get(value, 0) < count:
                 return False
         return True
 
@@ -251,14 +318,14 @@ class UnorderedAssignment(Assignment):
         for variable in symbol_intersection:
             sum_symbol_count_self += self.symbols[variable]
             sum_symbol_count_other += other.symbols[variable]
-        values_self = set(self.values.keys())
-        values_other = set(other.values.keys())
+        values_self = set(self.value_ids.keys())
+        values_other = set(other.value_ids.keys())
         value_intersection = values_self.intersection(values_other)
         sum_value_count_self = 0
         sum_value_count_other = 0
         for value in value_intersection:
-            sum_value_count_self += self.values[value]
-            sum_value_count_other += other.values[value]
+            sum_value_count_self += self.value_ids[value]
+            sum_value_count_other += other.value_ids[value]
         return sum_value_count_other >= sum_symbol_count_self and sum_value_count_self >= sum_symbol_count_other
 
 class CompositeAssignment(Assignment):
@@ -266,15 +333,21 @@ class CompositeAssignment(Assignment):
     TODO: documentation
     """
 
+    __slots__ = ('unordered_mappings', 'ordered_mapping')
+
+    # Composite assignments are never changed after being built. The
+    # ordered and unordered assignments they are made of are frozen so
+    # joins share them with the joined assignments instead of copying.
+
     def __init__(self, assignment: UnorderedAssignment):
         super().__init__()
-        self.unordered_mappings: List[UnorderedAssignment] = [assignment]
+        self.unordered_mappings: Tuple[UnorderedAssignment, ...] = (assignment,)
         self.ordered_mapping: OrderedAssignment = None
-        self.variables = deepcopy(assignment.variables)
+        self.variables = frozenset(assignment.variables)
         assert self._freeze()
 
     def __repr__(self):
-        return f'Ordered = {self.ordered_mapping} | Unordered = {self.unordered_mappings}'
+        return f'Ordered = {self.ordered_mapping} | Unordered = {list(self.unordered_mappings)}'
 
     def _freeze(self):
         assert super().freeze()
@@ -331,16 +404,26 @@ class CompositeAssignment(Assignment):
             return False
         if any(not assignment.compatible(unordered_assignment) for assignment in self.unordered_mappings):
             return False
-        self.unordered_mappings.append(unordered_assignment)
+        self.unordered_mappings = self.unordered_mappings + (unordered_assignment,)
         self._recompute_hash()
         return True
 
     def _add_unordered_mappings(self, others) -> bool:
         return all(self._add_unordered_mapping(assignment) for assignment in others)
 
+    def _derive(self) -> 'CompositeAssignment':
+        # Shallow copy to be extended by join()
+        answer = CompositeAssignment.__new__(CompositeAssignment)
+        answer.variables = self.variables
+        answer.hash = self.hash
+        answer.frozen = True
+        answer.unordered_mappings = self.unordered_mappings
+        answer.ordered_mapping = self.ordered_mapping
+        return answer
+
     def join(self, other: Assignment) -> Assignment:
         assert self.frozen and other.frozen
-        answer = deepcopy(self)
+        answer = self._derive()
         if isinstance(other, OrderedAssignment):
             return answer if answer._add_ordered_mapping(other) else None
         elif isinstance(other, UnorderedAssignment):
@@ -375,6 +458,8 @@ class PatternMatchingAnswer:
     def __init__(self):
         self.assignments: Set[Assignment] = set()
         self.negation: bool = False
+        # Links matched by a batched lookup, keyed by id() of the Link term
+        self.prefetched_links: Dict[int, List[str]] = {}
 
     def __repr__(self):
         s = 'NOT\n' if self.negation else ''
@@ -392,6 +477,32 @@ class LogicalExpression(ABC):
     def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
         pass
 
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        # Same as matched() but using an AsyncRedisMongoDB. Independent DB
+        # lookups are awaited concurrently. Expressions without an asyncio
+        # version run matched() with the blocking DB in the executor.
+        return await db.run_sync(self.matched, db.db, answer)
+
+    def negated(self) -> bool:
+        # Whether the answers of matched() are negations
+        return False
+
+    def iter_matches(self, db: DBInterface, limit: Optional[int] = None) -> Iterator[Assignment]:
+        # Assignments of matched(), read from the DB only as needed. A match
+        # without variables (e.g. a Node) yields one empty assignment.
+        if self.negated():
+            raise ValueError(f"Can't iterate over the matches of a negation: {self}")
+        matches = self._iter_matches(db)
+        return matches if limit is None else islice(matches, limit)
+
+    def _iter_matches(self, db: DBInterface) -> Iterator[Assignment]:
+        answer = PatternMatchingAnswer()
+        if self.matched(db, answer):
+            if answer.assignments:
+                yield from answer.assignments
+            else:
+                yield _empty_assignment()
+
     def __repr__(self):
         return '<LogicalExpression>'
 
@@ -431,6 +542,9 @@ class Node(Atom):
     def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
         return db.node_exists(self.atom_type, self.name)
 
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        return await db.node_exists(self.atom_type, self.name)
+
 class Link(Atom):
     """
     TODO: documentation
@@ -463,6 +577,29 @@ class Link(Atom):
             self.handle = db.get_link_handle(self.atom_type, target_handles)
         return self.handle
 
+    def get_wildcard_pattern(self, db: DBInterface) -> Optional[Tuple[str, List[str]]]:
+        if any(isinstance(atom, LinkTemplate) for atom in self.targets):
+            return None
+        target_handles = [atom.get_handle(db) for atom in self.targets]
+        if not any(handle == WILDCARD for handle in target_handles):
+            return None
+        return (self.atom_type, target_handles)
+
+    def bound_lookup_allowed(self) -> bool:
+        return self.ordered and \
+            all(isinstance(atom, (Node, Variable)) for atom in self.targets) and \
+            any(isinstance(atom, Variable) for atom in self.targets)
+
+    def matched_bound(self, db: DBInterface, answer: PatternMatchingAnswer, bindings: List[Dict[str, str]]) -> bool:
+        # Same as matched() but only looks for the links whose variables have
+        # the values in one of the bindings
+        patterns = []
+        for binding in bindings:
+            patterns.append([
+                binding.get(atom.name, WILDCARD) if isinstance(atom, Variable) else atom.get_handle(db)
+                for atom in self.targets])
+        return self._assign_matched_links(db, answer, _get_bound_links(db, self.atom_type, patterns))
+
     def _assign_variables(self, db: DBInterface, link: str, link_targets: List[str]) -> Optional[Assignment]:
         #link_targets = db.get_link_targets(link)
         assert(len(link_targets) == len(self.targets)), f'link_targets = {link_targets} self.targets = {self.targets}'
@@ -476,6 +613,8 @@ class Link(Atom):
             return answer if answer.freeze() else None
         else:
             answer = UnorderedAssignment()
+            # link_targets may be shared with other callers (e.g. cached by the DB)
+            link_targets = list(link_targets)
             targets_to_match = []
             for atom in self.targets:
                 if isinstance(atom, Variable):
@@ -489,6 +628,11 @@ class Link(Atom):
             return answer if answer.freeze() else None
 
     def _typed_variable_matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
+        if not self._typed_variable_link_allowed():
+            return False
+        return all(target.matched(db, answer) for target in self.targets)
+
+    def _typed_variable_link_allowed(self) -> bool:
         first_typed_variable = True
         for target in self.targets:
             if isinstance(target, Variable):
@@ -497,10 +641,52 @@ class Link(Atom):
                 if not first_typed_variable:
                     return False
                 first_typed_variable = False
-        return all(target.matched(db, answer) for target in self.targets)
+        return True
+
+    def _assign_matched_links(self, db: DBInterface, answer: PatternMatchingAnswer, matched: List[Any]) -> bool:
+        if self.ordered:
+            positions = [i for i, atom in enumerate(self.targets) if isinstance(atom, Variable)]
+            variables = [self.targets[i].name for i in positions]
+            targets = _matched_targets(matched, len(self.targets), positions)
+            answer.assignments = _assign_targets(OrderedAssignment, variables, targets)
+            return bool(answer.assignments)
+        answer.assignments = set()
+        for link, targets in matched:
+            asn = self._assign_variables(db, link, targets)
+            if asn:
+                answer.assignments.add(asn)
+        return bool(answer.assignments)
+
+    def _iter_matches(self, db: DBInterface) -> Iterator[Assignment]:
+        if any(isinstance(atom, LinkTemplate) for atom in self.targets):
+            yield from super()._iter_matches(db)
+            return
+        if not all(atom.matched(db, PatternMatchingAnswer()) for atom in self.targets):
+            return
+        target_handles = [atom.get_handle(db) for atom in self.targets]
+        if WILDCARD not in target_handles:
+            if db.link_exists(self.atom_type, target_handles):
+                yield _empty_assignment()
+            return
+        yield from _iter_assignments(self, db, db.iter_matched_links(self.atom_type, target_handles))
+
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        if any(isinstance(atom, LinkTemplate) for atom in self.targets):
+            if not self._typed_variable_link_allowed():
+                return False
+            return all(await asyncio.gather(*[target.matched_async(db, answer) for target in self.targets]))
+        if not all(await asyncio.gather(*[atom.matched_async(db, answer) for atom in self.targets])):
+            return False
+        target_handles = [atom.get_handle(db) for atom in self.targets]
+        if any(handle == WILDCARD for handle in target_handles):
+            matched = await db.get_matched_links(self.atom_type, target_handles)
+            return self._assign_matched_links(db, answer, matched)
+        else:
+            return await db.link_exists(self.atom_type, target_handles)
 
     def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
         if DEBUG_LINK: print('link match', self)
+        prefetched_links = answer.prefetched_links.get(id(self), None)
         if any(isinstance(atom, LinkTemplate) for atom in self.targets):
             return self._typed_variable_matched(db, answer)
         if DEBUG_LINK: print('matched()', f'entering self = {self}')
@@ -514,21 +700,13 @@ class Link(Atom):
         if DEBUG_LINK: print(f'target_handles = {target_handles}')
         if any(handle == WILDCARD for handle in target_handles):
             if DEBUG_LINK: print(f'self.atom_type = {self.atom_type} target_handles = {target_handles}')
-            matched = db.get_matched_links(self.atom_type, target_handles)
+            if prefetched_links is None:
+                matched = db.get_matched_links(self.atom_type, target_handles)
+            else:
+                matched = prefetched_links
             if DEBUG_LINK: print(f'matched = {matched}')
             if DEBUG_LINK: print(f'len(matched) = {len(matched)}')
-            count = 1
-            total = len(matched)
-            start = time.perf_counter()
-            answer.assignments = set()
-            for match in matched:
-                link, targets = match
-                if DEBUG_LINK: print(f'match = {match}')
-                if DEBUG_LINK: print(f'link = {link}')
-                if DEBUG_LINK: print(f'targets = {targets}')
-                asn = self._assign_variables(db, link, targets)
-                if asn:
-                    answer.assignments.add(asn)
+            self._assign_matched_links(db, answer, matched)
             if DEBUG_LINK: print(f'len(answer.assignments) = {len(answer.assignments)}')
             if DEBUG_LINK: print(f'answer.assignments = {answer.assignments}')
             if DEBUG_LINK: print('matched()', f'leaving 1 self = {self}')
@@ -555,6 +733,9 @@ class Variable(Atom):
     def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
         return True
 
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        return True
+
 class TypedVariable(Variable):
     """
     TODO: documentation
@@ -604,13 +785,67 @@ class LinkTemplate(LogicalExpression):
         if DEBUG_LINK_TEMPLATE: print('link template match', self)
         matched = db.get_matched_type_template([self.link_type, *[v.type for v in self.targets]])
         if DEBUG_LINK_TEMPLATE: print('len(matched)', len(matched))
-        answer.assignments = set()
-        for match in matched:
-            link, targets = match
-            asn = self._assign_variables(db, link, targets)
-            if asn:
-                if DEBUG_LINK_TEMPLATE: print('asn', asn)
-                answer.assignments.add(asn)
+        return self._assign_matched_links(db, answer, matched)
+
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        matched = await db.get_matched_type_template([self.link_type, *[v.type for v in self.targets]])
+        return self._assign_matched_links(db, answer, matched)
+
+    def _iter_matches(self, db: DBInterface) -> Iterator[Assignment]:
+        matched = db.iter_matched_type_template([self.link_type, *[v.type for v in self.targets]])
+        yield from _iter_assignments(self, db, matched)
+
+    def bound_lookup_allowed(self) -> bool:
+        return self.ordered
+
+    def matched_bound(self, db: DBInterface, answer: PatternMatchingAnswer, bindings: List[Dict[str, str]]) -> bool:
+        # Same as matched() but only looks for the links whose variables have
+        # the values in one of the bindings. Links of types which aren't in
+        # the pattern index (pattern_black_list, arity above 3) or whose
+        # pattern keys have sorted targets are taken from the templates index
+        # and filtered.
+        wildcards = [WILDCARD] * len(self.targets)
+        if self.link_type in UNORDERED_LINK_TYPES or \
+           db.count_matched_links_many([(self.link_type, wildcards)])[0] == 0:
+            matched = db.get_matched_type_template([self.link_type, *[v.type for v in self.targets]])
+            return self._assign_matched_links(db, answer, self._filter_bound(matched, bindings))
+        patterns = [[binding.get(v.name, WILDCARD) for v in self.targets] for binding in bindings]
+        matched = _get_bound_links(db, self.link_type, patterns)
+        return self._assign_matched_links(db, answer, self._filter_types(db, matched))
+
+    def _filter_types(self, db: DBInterface, matched: List[Any]) -> List[Any]:
+        # Links whose targets are nodes of the types of the variables, as in
+        # the templates index
+        node_types = {}
+        def node_type(handle):
+            if handle not in node_types:
+                try:
+                    node_types[handle] = db.get_node_type(handle)
+                except ValueError:
+                    node_types[handle] = None
+            return node_types[handle]
+        return [
+            (link, targets) for link, targets in matched
+            if all(node_type(handle) == v.type for handle, v in zip(targets, self.targets))
+        ]
+
+    def _filter_bound(self, matched: List[Any], bindings: List[Dict[str, str]]) -> List[Any]:
+        # All the bindings have the same variables (see _get_bindings())
+        if not bindings:
+            return []
+        positions = [i for i, v in enumerate(self.targets) if v.name in bindings[0]]
+        values = {tuple(binding[self.targets[i].name] for i in positions) for binding in bindings}
+        return [
+            (link, targets) for link, targets in matched
+            if tuple(targets[i] for i in positions) in values
+        ]
+
+    def _assign_matched_links(self, db: DBInterface, answer: PatternMatchingAnswer, matched: List[Any]) -> bool:
+        assignment_class = OrderedAssignment if self.ordered else UnorderedAssignment
+        variables = [variable.name for variable in self.targets]
+        targets = _matched_targets(matched, len(self.targets), list(range(len(self.targets))))
+        answer.assignments = _assign_targets(assignment_class, variables, targets)
+        if DEBUG_LINK_TEMPLATE: print('answer.assignments', answer.assignments)
         return bool(answer.assignments)
 
 class Not(LogicalExpression):
@@ -630,6 +865,291 @@ class Not(LogicalExpression):
         answer.negation = not answer.negation
         return True
 
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        await self.term.matched_async(db, answer)
+        answer.negation = not answer.negation
+        return True
+
+    def negated(self) -> bool:
+        return not self.term.negated()
+
+def _prefetch_matched_links(db: DBInterface, terms: List[LogicalExpression]) -> Dict[int, List[str]]:
+    # Fetches the wildcard patterns of all sibling Link terms in a single
+    # batched call. Results are keyed by id() of each Link and handed to
+    # matched() through the term answers, so the query objects hold no
+    # per-call state and may be evaluated concurrently.
+    links = []
+    patterns = []
+    for term in terms:
+        if isinstance(term, Not):
+            term = term.term
+        if isinstance(term, Link):
+            pattern = term.get_wildcard_pattern(db)
+            if pattern is not None:
+                links.append(term)
+                patterns.append(pattern)
+    if len(links) < 2:
+        return {}
+    return {id(link): matched for link, matched in zip(links, db.get_matched_links_many(patterns))}
+
+def _term_answer(prefetched_links: Optional[Dict[int, List[str]]]) -> PatternMatchingAnswer:
+    answer = PatternMatchingAnswer()
+    if prefetched_links:
+        answer.prefetched_links = prefetched_links
+    return answer
+
+def _empty_assignment() -> OrderedAssignment:
+    # Answer of expressions matched without assigning variables
+    answer = OrderedAssignment()
+    answer.freeze()
+    return answer
+
+def _iter_assignments(term: Union[Link, 'LinkTemplate'], db: DBInterface, matched: Iterator[Any]) -> Iterator[Assignment]:
+    # Paged scans may return the same link more than once
+    seen = set()
+    for link, targets in matched:
+        assignment = term._assign_variables(db, link, targets)
+        if assignment and assignment not in seen:
+            seen.add(assignment)
+            yield assignment
+
+def _iter_term_matches(term: LogicalExpression, db: DBInterface) -> Iterator[Assignment]:
+    # Negated answers are taken as they are, as matched() does for the
+    # terms of OR
+    if term.negated():
+        return LogicalExpression._iter_matches(term, db)
+    return term._iter_matches(db)
+
+def _pages(items: Iterator[Any]) -> Iterator[List[Any]]:
+    items = iter(items)
+    size = 1
+    while True:
+        page = list(islice(items, size))
+        if not page:
+            return
+        yield page
+        size = min(2 * size, ITER_JOIN_PAGE_SIZE)
+
+def _join_page(assignments: List[Optional[Assignment]], matches: List[Assignment]) -> List[Optional[Assignment]]:
+    # Matches without variables keep the assignments as they are
+    variable_matches = [match for match in matches if match.variables]
+    keep = len(variable_matches) < len(matches)
+    answer = []
+    bound = []
+    for assignment in assignments:
+        if assignment is None:
+            answer.extend(variable_matches)
+            if keep:
+                answer.append(None)
+        else:
+            bound.append(assignment)
+    if bound:
+        answer.extend(_join_assignments(bound, variable_matches))
+        if keep:
+            answer.extend(bound)
+    return answer
+
+class _MatchedTerm(LogicalExpression):
+    # Term of AND whose assignments are already known
+
+    def __init__(self, assignments: List[Assignment]):
+        self.assignments = assignments
+
+    def __repr__(self):
+        return f'<Matched: {self.assignments}>'
+
+    def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
+        answer.assignments = set(self.assignments)
+        return bool(self.assignments)
+
+    def _iter_matches(self, db: DBInterface) -> Iterator[Assignment]:
+        return iter(self.assignments)
+
+def _get_bound_links(db: DBInterface, link_type: str, patterns: List[List[str]]) -> MemberArray:
+    # Links matching any of the patterns. Patterns without wildcards aren't
+    # in the pattern index so they are checked with link_exists().
+    wildcard_patterns = [(link_type, pattern) for pattern in patterns if WILDCARD in pattern]
+    groups = db.get_matched_links_many(wildcard_patterns) if wildcard_patterns else []
+    exact = [
+        (None, pattern) for pattern in patterns
+        if WILDCARD not in pattern and db.link_exists(link_type, pattern)
+    ]
+    return concat_members([*groups, exact])
+
+def _matched_targets(matched: List[Any], arity: int, positions: List[int]) -> Iterator[Tuple[str, ...]]:
+    # Targets at positions of each matched link. MemberArrays only convert
+    # the digests of those targets to hex.
+    if isinstance(matched, MemberArray):
+        assert all(link_arity == arity for link_arity in matched.digests), f'arity = {arity}'
+        return matched.targets(positions)
+    return (_select_targets(targets, arity, positions) for _, targets in matched)
+
+def _select_targets(targets: List[str], arity: int, positions: List[int]) -> Tuple[str, ...]:
+    assert len(targets) == arity, f'targets = {targets} arity = {arity}'
+    return tuple(targets[i] for i in positions)
+
+def _assign_targets(assignment_class, variables: List[str], matched_targets: Iterator[Tuple[str, ...]]) -> Set[Assignment]:
+    answer = set()
+    for targets in matched_targets:
+        assignment = assignment_class()
+        if all(assignment.assign(variable, handle) for variable, handle in zip(variables, targets)) and \
+           assignment.freeze():
+            answer.add(assignment)
+    return answer
+
+def _term_variables(term: LogicalExpression) -> Set[str]:
+    if isinstance(term, Variable):
+        return {term.name}
+    elif isinstance(term, (Link, LinkTemplate)):
+        return set().union(*[_term_variables(target) for target in term.targets])
+    elif isinstance(term, (And, Or)):
+        return set().union(*[_term_variables(t) for t in term.terms])
+    elif isinstance(term, Not):
+        return _term_variables(term.term)
+    else:
+        return set()
+
+def _bound_lookup_allowed(term: LogicalExpression) -> bool:
+    return isinstance(term, (Link, LinkTemplate)) and term.bound_lookup_allowed()
+
+def _plannable(term: LogicalExpression) -> bool:
+    # Terms whose answers are ordered assignments (or no assignments at all).
+    # Joins of those don't depend on the order of the terms.
+    if isinstance(term, Node):
+        return True
+    elif isinstance(term, Link):
+        return term.ordered and not any(isinstance(atom, LinkTemplate) for atom in term.targets)
+    elif isinstance(term, LinkTemplate):
+        return term.ordered
+    else:
+        return False
+
+def _estimate_cardinality(db: DBInterface, term: LogicalExpression) -> int:
+    if isinstance(term, Node):
+        return 1 if db.node_exists(term.atom_type, term.name) else 0
+    elif isinstance(term, LinkTemplate):
+        return db.count_matched_type_template([term.link_type, *[v.type for v in term.targets]])
+    else:
+        # Exact links (wildcard links are counted by _plan_terms())
+        target_handles = [atom.get_handle(db) for atom in term.targets]
+        if any(handle is None for handle in target_handles):
+            return 0
+        return db.count_matched_links(term.atom_type, target_handles)
+
+def _plan_terms(db: DBInterface, terms: List[LogicalExpression]) -> Optional[List[Tuple[LogicalExpression, float]]]:
+    """
+    Returns the terms of AND paired with their estimated cardinalities
+    (number of matched links). Plannable terms are sorted by cardinality
+    among the positions they take in terms, other terms (negations, nested
+    expressions and unordered links) are kept where they are. Returns None
+    when no term could be looked up with values assigned by another term.
+    """
+    positions = [i for i, term in enumerate(terms) if _plannable(term)]
+    positive = [term for term in terms if not isinstance(term, Not)]
+    variables = {id(term): _term_variables(term) for term in positive}
+    if not any(
+        _bound_lookup_allowed(terms[i]) and
+        any(variables[id(terms[i])] & variables[id(term)] for term in positive if term is not terms[i])
+        for i in positions):
+        return None
+    links = [terms[i] for i in positions if isinstance(terms[i], Link) and terms[i].get_wildcard_pattern(db) is not None]
+    link_counts = {}
+    if links:
+        counts = db.count_matched_links_many([link.get_wildcard_pattern(db) for link in links])
+        link_counts = {id(link): count for link, count in zip(links, counts)}
+    cardinalities = {
+        i: link_counts[id(terms[i])] if id(terms[i]) in link_counts else _estimate_cardinality(db, terms[i])
+        for i in positions
+    }
+    plan = [(term, math.inf) for term in terms]
+    for position, i in zip(positions, sorted(positions, key=lambda i: cardinalities[i])):
+        plan[position] = (terms[i], cardinalities[i])
+    return plan
+
+def _get_bindings(
+    term: LogicalExpression,
+    assignments: List[Assignment],
+    cardinality: float) -> Optional[List[Dict[str, str]]]:
+    # Distinct values already assigned to the variables of term when it's
+    # worth looking term up with them instead of fetching all its links
+    if not _bound_lookup_allowed(term) or not assignments:
+        return None
+    variables = _term_variables(term)
+    for assignment in assignments:
+        if not isinstance(assignment, OrderedAssignment):
+            return None
+        variables = variables.intersection(assignment.variables)
+        if not variables:
+            return None
+    variables = sorted(variables)
+    values = {tuple(assignment.mapping_ids[variable] for variable in variables) for assignment in assignments}
+    if len(values) >= cardinality:
+        return None
+    table = next(iter(assignments)).table
+    return [{variable: table.handle(value_id) for variable, value_id in zip(variables, value)} for value in values]
+
+def _group_ordered(
+    assignments: List[Assignment]) -> Tuple[Dict[FrozenSet[str], List[OrderedAssignment]], List[Assignment]]:
+    # Ordered assignments grouped by their variables, plus everything else
+    groups = {}
+    others = []
+    for assignment in assignments:
+        if isinstance(assignment, OrderedAssignment):
+            groups.setdefault(assignment.variables, []).append(assignment)
+        else:
+            others.append(assignment)
+    return groups, others
+
+def _hash_join(left: List[Assignment], right: List[Assignment], shared: List[str]) -> List[Assignment]:
+    answer = []
+    if not shared:
+        for left_assignment in left:
+            for right_assignment in right:
+                joint_assignment = left_assignment.join(right_assignment)
+                if joint_assignment is not None:
+                    answer.append(joint_assignment)
+        return answer
+    # The smaller side is bucketed and the other one probes the buckets
+    build_left = len(left) <= len(right)
+    buckets = {}
+    for assignment in (left if build_left else right):
+        key = tuple(assignment.mapping_ids[variable] for variable in shared)
+        buckets.setdefault(key, []).append(assignment)
+    for assignment in (right if build_left else left):
+        key = tuple(assignment.mapping_ids[variable] for variable in shared)
+        for other in buckets.get(key, ()):
+            if build_left:
+                joint_assignment = other.join(assignment)
+            else:
+                joint_assignment = assignment.join(other)
+            if joint_assignment is not None:
+                answer.append(joint_assignment)
+    return answer
+
+def _join_assignments(left: List[Assignment], right: List[Assignment]) -> List[Assignment]:
+    """
+    Joins every assignment in left with every assignment in right, dropping
+    the incompatible pairs. Ordered assignments with the same variables are
+    joined group by group using the values of the variables shared by both
+    groups as hash keys. Unordered and composite assignments are tried
+    against every assignment of the other side.
+    """
+    if not CONFIG['hash_join']:
+        return _hash_join(left, right, [])
+    left_groups, left_others = _group_ordered(left)
+    right_groups, right_others = _group_ordered(right)
+    answer = []
+    for left_variables, left_group in left_groups.items():
+        for right_variables, right_group in right_groups.items():
+            shared = sorted(left_variables.intersection(right_variables))
+            answer.extend(_hash_join(left_group, right_group, shared))
+    if left_others:
+        answer.extend(_hash_join(left_others, right, []))
+    if right_others:
+        ordered = [assignment for assignment in left if isinstance(assignment, OrderedAssignment)]
+        answer.extend(_hash_join(ordered, right_others, []))
+    return answer
+
 class Or(LogicalExpression):
     """
     TODO: documentation
@@ -646,16 +1166,72 @@ class Or(LogicalExpression):
         if not self.terms:
             return False
         assert not answer.assignments
+        prefetched_links = _prefetch_matched_links(db, [t for t in self.terms if not isinstance(t, Not)])
+        return self._matched(db, answer, prefetched_links)
+
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        if not self.terms:
+            return False
+        assert not answer.assignments
+        positive_terms, negative_terms = self._split_terms()
+        term_answers = [PatternMatchingAnswer() for _ in positive_terms]
+        negative_answer = PatternMatchingAnswer() if negative_terms else None
+        term_matches = [term.matched_async(db, term_answer) for term, term_answer in zip(positive_terms, term_answers)]
+        if negative_terms:
+            term_matches.append(And([t.term for t in negative_terms]).matched_async(db, negative_answer))
+        matched = await asyncio.gather(*term_matches)
+        return self._combine(positive_terms, matched, term_answers, negative_answer, answer)
+
+    def negated(self) -> bool:
+        return any(isinstance(term, Not) for term in self.terms)
+
+    def _iter_matches(self, db: DBInterface) -> Iterator[Assignment]:
+        seen = set()
+        matched_without_variables = False
+        for term in self.terms:
+            for assignment in _iter_term_matches(term, db):
+                if not assignment.variables:
+                    matched_without_variables = True
+                elif assignment not in seen:
+                    seen.add(assignment)
+                    yield assignment
+        if matched_without_variables and not seen:
+            yield _empty_assignment()
+
+    def _split_terms(self) -> Tuple[List[LogicalExpression], List['Not']]:
+        positive_terms = [term for term in self.terms if not isinstance(term, Not)]
+        negative_terms = [term for term in self.terms if isinstance(term, Not)]
+        return positive_terms, negative_terms
+
+    def _matched(
+        self,
+        db: DBInterface,
+        answer: PatternMatchingAnswer,
+        prefetched_links: Optional[Dict[int, List[str]]] = None) -> bool:
+
+        positive_terms, negative_terms = self._split_terms()
+        term_answers = [_term_answer(prefetched_links) for _ in positive_terms]
+        matched = [term.matched(db, term_answer) for term, term_answer in zip(positive_terms, term_answers)]
+        negative_answer = None
+        if negative_terms:
+            joint_negative_term = And([t.term for t in negative_terms])
+            if DEBUG_NOT: print(f'Joint negative term: {joint_negative_term}')
+            negative_answer = PatternMatchingAnswer()
+            joint_negative_term.matched(db, negative_answer)
+        return self._combine(positive_terms, matched, term_answers, negative_answer, answer)
+
+    def _combine(
+        self,
+        terms: List[LogicalExpression],
+        matched: List[bool],
+        term_answers: List[PatternMatchingAnswer],
+        negative_answer: Optional[PatternMatchingAnswer],
+        answer: PatternMatchingAnswer) -> bool:
+
         or_answer = PatternMatchingAnswer()
         or_matched = False
-        negative_terms = set()
-        for term in self.terms:
-            term_answer = PatternMatchingAnswer()
-            if isinstance(term, Not):
-                if DEBUG_OR: print(f'negative term: {term}')
-                negative_terms.add(term)
-                continue
-            if not term.matched(db, term_answer):
+        for term, term_matched, term_answer in zip(terms, matched, term_answers):
+            if not term_matched:
                 if DEBUG_OR: print(f'NOT MATCHED: {term}')
                 continue
             or_matched = True
@@ -671,14 +1247,10 @@ class Or(LogicalExpression):
             if DEBUG_OR: print(f'term_answer:\n{term_answer}')
             or_answer.assignments.update(term_answer.assignments)
             if DEBUG_OR: print(f'or_answer after extending:\n{or_answer}')
-        if negative_terms:
-            joint_negative_term = And([t.term for t in negative_terms])
-            if DEBUG_NOT: print(f'Joint negative term: {joint_negative_term}')
-            term_answer = PatternMatchingAnswer()
-            joint_negative_term.matched(db, term_answer)
-            if DEBUG_NOT: print(f'term_answer.assignments = {term_answer.assignments}')
+        if negative_answer is not None:
+            if DEBUG_NOT: print(f'negative_answer.assignments = {negative_answer.assignments}')
             if DEBUG_NOT: print(f'or_answer.assignments = {or_answer.assignments}')
-            answer.assignments = term_answer.assignments - or_answer.assignments
+            answer.assignments = negative_answer.assignments - or_answer.assignments
             if DEBUG_NOT: print(f'answer.assignments = {answer.assignments}')
             answer.negation = True
         else:
@@ -707,36 +1279,166 @@ class And(LogicalExpression):
         if not self.terms:
             return False
         assert not answer.assignments
+        plan = _plan_terms(db, self.terms) if CONFIG['query_planner'] else None
+        if plan is not None:
+            return self._matched_plan(db, answer, plan)
+        return self._matched(db, answer, _prefetch_matched_links(db, self.terms))
+
+    async def matched_async(self, db, answer: PatternMatchingAnswer) -> bool:
+        if not self.terms:
+            return False
+        assert not answer.assignments
+        # Terms are fetched concurrently and joined in order afterwards
+        term_answers = [PatternMatchingAnswer() for _ in self.terms]
+        matched = await asyncio.gather(*[
+            term.matched_async(db, term_answer) for term, term_answer in zip(self.terms, term_answers)])
         and_answer = PatternMatchingAnswer()
         forbidden_assignments = set()
+        for term, term_matched, term_answer in zip(self.terms, matched, term_answers):
+            if not self._join_term(term, term_matched, term_answer, and_answer, forbidden_assignments):
+                return False
+        return self._filter_forbidden(and_answer, forbidden_assignments, answer)
+
+    def _iter_matches(self, db: DBInterface) -> Iterator[Assignment]:
+        forbidden_assignments = set()
+        terms = []
         for term in self.terms:
+            if not term.negated():
+                terms.append(term)
+                continue
             term_answer = PatternMatchingAnswer()
             if not term.matched(db, term_answer):
-                if DEBUG_AND: print(f'NOT MATCHED: {term}')
-                return False
-            if not term_answer.assignments:
-                if DEBUG_AND: print(f'term_answer empty: {term}')
-                continue
+                return
             if term_answer.negation:
-                if DEBUG_AND: print(f'Negation: {term}')
-                #if DEBUG_AND: print(f'term_answer:\n{term_answer}')
                 forbidden_assignments.update(term_answer.assignments)
+            elif term_answer.assignments:
+                terms.append(_MatchedTerm(list(term_answer.assignments)))
+        plan = _plan_terms(db, terms) if CONFIG['query_planner'] else None
+        if plan is None:
+            plan = [(term, math.inf) for term in terms]
+        seen = set()
+        for assignment in self._iter_join(db, plan, 0, [None], {}):
+            # As in matched(), terms matched without variables don't make an answer
+            if assignment is None or not assignment.variables or assignment in seen:
                 continue
-            if not and_answer.assignments:
-                if DEBUG_AND: print(f'First term: {term}')
-                if DEBUG_AND: print(f'term_answer:\n{term_answer}')
-                and_answer.assignments = term_answer.assignments
-                continue
-            if DEBUG_AND: print(f'New term: {term}')
+            if all(assignment.check_negation(tabu) for tabu in forbidden_assignments):
+                seen.add(assignment)
+                yield self.post_process(assignment)
+
+    def _iter_join(
+        self,
+        db: DBInterface,
+        plan: List[Tuple[LogicalExpression, float]],
+        index: int,
+        assignments: Iterator[Optional[Assignment]],
+        term_matches: Dict[int, List[Assignment]]) -> Iterator[Optional[Assignment]]:
+
+        # Joins assignments (joins of the terms before index, None for no
+        # assignment) with the matches of the remaining terms. Assignments
+        # are taken in pages of growing size so the first answers come after
+        # a few lookups and the bound lookups of a page go in a single call.
+        if index == len(plan):
+            yield from assignments
+            return
+        term, cardinality = plan[index]
+        if index == 0:
+            for page in _pages(_iter_term_matches(term, db)):
+                yield from self._iter_join(db, plan, 1, _join_page([None], page), term_matches)
+            return
+        for page in _pages(assignments):
+            bindings = None
+            # Bound templates are read from the whole templates index anyway
+            # (see LinkTemplate.matched_bound()) so their cached matches are
+            # joined instead
+            if isinstance(term, Link) and CONFIG['query_planner']:
+                bindings = _get_bindings(term, page, cardinality)
+            if bindings is not None:
+                term_answer = PatternMatchingAnswer()
+                term.matched_bound(db, term_answer, bindings)
+                matches = list(term_answer.assignments)
+            else:
+                if index not in term_matches:
+                    term_matches[index] = list(_iter_term_matches(term, db))
+                matches = term_matches[index]
+            yield from self._iter_join(db, plan, index + 1, _join_page(page, matches), term_matches)
+
+    def _join_term(
+        self,
+        term: LogicalExpression,
+        term_matched: bool,
+        term_answer: PatternMatchingAnswer,
+        and_answer: PatternMatchingAnswer,
+        forbidden_assignments: Set[Assignment]) -> bool:
+
+        if not term_matched:
+            if DEBUG_AND: print(f'NOT MATCHED: {term}')
+            return False
+        if not term_answer.assignments:
+            if DEBUG_AND: print(f'term_answer empty: {term}')
+            return True
+        if term_answer.negation:
+            if DEBUG_AND: print(f'Negation: {term}')
+            #if DEBUG_AND: print(f'term_answer:\n{term_answer}')
+            forbidden_assignments.update(term_answer.assignments)
+            return True
+        if not and_answer.assignments:
+            if DEBUG_AND: print(f'First term: {term}')
             if DEBUG_AND: print(f'term_answer:\n{term_answer}')
-            joint_assignments = []
-            for and_assignment in and_answer.assignments:
-                for term_assignment in term_answer.assignments:
-                    joint_assignment = and_assignment.join(term_assignment)
-                    if joint_assignment is not None:
-                        joint_assignments.append(joint_assignment)
-            and_answer.assignments = joint_assignments
-            if DEBUG_AND: print(f'and_answer after join:\n{and_answer}')
+            and_answer.assignments = term_answer.assignments
+            return True
+        if DEBUG_AND: print(f'New term: {term}')
+        if DEBUG_AND: print(f'term_answer:\n{term_answer}')
+        and_answer.assignments = _join_assignments(list(and_answer.assignments), list(term_answer.assignments))
+        if DEBUG_AND: print(f'and_answer after join:\n{and_answer}')
+        return True
+
+    def _matched(
+        self,
+        db: DBInterface,
+        answer: PatternMatchingAnswer,
+        prefetched_links: Optional[Dict[int, List[str]]] = None) -> bool:
+
+        and_answer = PatternMatchingAnswer()
+        forbidden_assignments = set()
+        for term in self.terms:
+            term_answer = _term_answer(prefetched_links)
+            term_matched = term.matched(db, term_answer)
+            if not self._join_term(term, term_matched, term_answer, and_answer, forbidden_assignments):
+                return False
+        return self._filter_forbidden(and_answer, forbidden_assignments, answer)
+
+    def _matched_plan(
+        self,
+        db: DBInterface,
+        answer: PatternMatchingAnswer,
+        plan: List[Tuple[LogicalExpression, float]]) -> bool:
+
+        and_answer = PatternMatchingAnswer()
+        forbidden_assignments = set()
+        # Terms which may be looked up with bound values aren't prefetched
+        prefetched_links = _prefetch_matched_links(
+            db, [term for term, _ in plan if not _bound_lookup_allowed(term)])
+        for term, cardinality in plan:
+            term_answer = _term_answer(prefetched_links)
+            bindings = _get_bindings(term, and_answer.assignments, cardinality)
+            if bindings is None:
+                term_matched = term.matched(db, term_answer)
+            else:
+                if DEBUG_AND: print(f'Bound lookup: {term} {len(bindings)} bindings')
+                term_matched = term.matched_bound(db, term_answer, bindings)
+            if not self._join_term(term, term_matched, term_answer, and_answer, forbidden_assignments):
+                return False
+            if term_answer.assignments and not term_answer.negation and not and_answer.assignments:
+                # No assignment is compatible with all the terms so far
+                return False
+        return self._filter_forbidden(and_answer, forbidden_assignments, answer)
+
+    def _filter_forbidden(
+        self,
+        and_answer: PatternMatchingAnswer,
+        forbidden_assignments: Set[Assignment],
+        answer: PatternMatchingAnswer) -> bool:
+
         if DEBUG_NOT: print(f'FORBIDDEN = {forbidden_assignments}')
         for assignment in and_answer.assignments:
             if DEBUG_NOT: print(f'CHECK: {assignment}')
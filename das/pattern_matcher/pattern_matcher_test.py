@@ -1,12 +1,16 @@
+import asyncio
+import threading
 from copy import deepcopy
 
 import pytest
 
-from das.pattern_matcher.pattern_matcher import (And, CompatibilityStatus,
+from das.pattern_matcher.pattern_matcher import (CONFIG, And, CompatibilityStatus, CompositeAssignment,
                                                  Link, LogicalExpression, Node,
-                                                 Not, OrderedAssignment,
+                                                 Not, Or, OrderedAssignment,
                                                  PatternMatchingAnswer, LinkTemplate,
-                                                 UnorderedAssignment, Variable, TypedVariable)
+                                                 UnorderedAssignment, Variable, TypedVariable,
+                                                 _join_assignments, _plan_terms)
+from das.database.handle_interning import handle_from_id, intern_handle, interned_count, interning_scope
 from das.database.stub_db import StubDB
 
 
@@ -623,3 +627,416 @@ def test_patterns():
         ],
         -1
     )
+
+def test_batched_pattern_lookup():
+
+    class CountingStubDB(StubDB):
+        def __init__(self):
+            super().__init__()
+            self.single_lookups = 0
+            self.batched_lookups = 0
+        def get_matched_links(self, link_type, target_handles):
+            self.single_lookups += 1
+            return super().get_matched_links(link_type, target_handles)
+        def get_matched_links_many(self, patterns):
+            self.batched_lookups += 1
+            return [StubDB.get_matched_links(self, t, h) for t, h in patterns]
+
+    db = CountingStubDB()
+    mammal = Node('Concept', 'mammal')
+    query = And([
+        Link('Inheritance', [Variable('V1'), mammal], True),
+        Link('Inheritance', [Variable('V2'), mammal], True),
+        Not(Link('Similarity', [Variable('V1'), Variable('V2')], False)),
+    ])
+    answer = PatternMatchingAnswer()
+    assert query.matched(db, answer)
+    assert db.batched_lookups == 1
+    assert db.single_lookups == 0
+    assert all(not hasattr(link, 'prefetched_links') for link in query.terms[:2])
+    assert not hasattr(query.terms[2].term, 'prefetched_links')
+    assert len(answer.assignments) == 10
+
+def test_concurrent_batched_pattern_lookup():
+
+    # The first evaluation pauses inside its first Link until the second one
+    # has prefetched its (empty) results, and the second one pauses until
+    # the first is done
+    second_prefetched = threading.Event()
+    first_done = threading.Event()
+
+    class PausingStubDB(StubDB):
+        def __init__(self, empty):
+            super().__init__()
+            self.empty = empty
+        def get_matched_links(self, link_type, target_handles):
+            return [] if self.empty else super().get_matched_links(link_type, target_handles)
+        def get_matched_links_many(self, patterns):
+            return [self.get_matched_links(t, h) for t, h in patterns]
+        def node_exists(self, node_type, node_name):
+            if self.empty:
+                second_prefetched.set()
+                first_done.wait(timeout=10)
+            else:
+                second_prefetched.wait(timeout=10)
+            return super().node_exists(node_type, node_name)
+
+    mammal = Node('Concept', 'mammal')
+    query = And([
+        Link('Inheritance', [Variable('V1'), mammal], True),
+        Link('Inheritance', [Variable('V2'), mammal], True),
+    ])
+    counts = {}
+    def evaluate(empty):
+        answer = PatternMatchingAnswer()
+        query.matched(PausingStubDB(empty), answer)
+        counts[empty] = len(answer.assignments)
+        if not empty:
+            first_done.set()
+    threads = [threading.Thread(target=evaluate, args=(empty,)) for empty in [False, True]]
+    CONFIG['query_planner'] = False
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        CONFIG['query_planner'] = True
+    assert counts == {False: 16, True: 0}
+
+def test_matched_async():
+
+    class AsyncStubDB:
+        # Stand-in for AsyncRedisMongoDB: the StubDB methods used by the
+        # matcher as coroutines, recording how many lookups overlap
+        def __init__(self):
+            self.db = StubDB()
+            self.pending = 0
+            self.max_pending = 0
+        def get_node_handle(self, node_type, node_name):
+            return self.db.get_node_handle(node_type, node_name)
+        def get_link_handle(self, link_type, target_handles):
+            return self.db.get_link_handle(link_type, target_handles)
+        async def _call(self, method, *args):
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            await asyncio.sleep(0)
+            self.pending -= 1
+            return getattr(self.db, method)(*args)
+        async def node_exists(self, *args):
+            return await self._call('node_exists', *args)
+        async def link_exists(self, *args):
+            return await self._call('link_exists', *args)
+        async def get_matched_links(self, *args):
+            return await self._call('get_matched_links', *args)
+        async def get_matched_type_template(self, *args):
+            return await self._call('get_matched_type_template', *args)
+
+    db = StubDB()
+    async_db = AsyncStubDB()
+    mammal = Node('Concept', 'mammal')
+    human = Node('Concept', 'human')
+    queries = [
+        Node('Concept', 'mammal'),
+        Node('Concept', 'blah'),
+        Link('Inheritance', [human, mammal], True),
+        Link('Inheritance', [Variable('V1'), mammal], True),
+        Link('Similarity', [Variable('V1'), human], False),
+        LinkTemplate('Similarity', [TypedVariable('V1', 'Concept'), TypedVariable('V2', 'Concept')], False),
+        And([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Inheritance', [Variable('V2'), mammal], True),
+            Not(Link('Similarity', [Variable('V1'), Variable('V2')], False)),
+        ]),
+        And([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Inheritance', [Variable('V1'), Node('Concept', 'blah')], True),
+        ]),
+        Or([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Similarity', [Variable('V1'), human], False),
+        ]),
+        Or([
+            Link('Similarity', [Variable('V1'), human], False),
+            Not(Link('Inheritance', [Variable('V1'), mammal], True)),
+        ]),
+        Not(Link('Inheritance', [Variable('V1'), mammal], True)),
+    ]
+    for query in queries:
+        answer = PatternMatchingAnswer()
+        async_answer = PatternMatchingAnswer()
+        assert query.matched(db, answer) == asyncio.run(query.matched_async(async_db, async_answer))
+        assert answer.assignments == async_answer.assignments
+        assert answer.negation == async_answer.negation
+    # Terms of And and Or are looked up concurrently
+    assert async_db.max_pending > 1
+
+def test_hash_join():
+
+    left = [
+        _build_ordered_assignment({'v1': '1', 'v2': '2'}),
+        _build_ordered_assignment({'v1': '1', 'v2': '3'}),
+        _build_ordered_assignment({'v1': '2', 'v2': '3'}),
+        _build_ordered_assignment({'v3': '1'}),
+        _build_unordered_assignment({'v1': '1', 'v4': '2'}),
+    ]
+    right = [
+        _build_ordered_assignment({'v2': '2', 'v5': '5'}),
+        _build_ordered_assignment({'v2': '3', 'v5': '5'}),
+        _build_ordered_assignment({'v1': '1'}),
+        _build_ordered_assignment({'v6': '6'}),
+        _build_unordered_assignment({'v2': '3', 'v7': '1'}),
+    ]
+    expected = []
+    for left_assignment in left:
+        for right_assignment in right:
+            joint_assignment = left_assignment.join(right_assignment)
+            if joint_assignment is not None:
+                expected.append(joint_assignment)
+    answer = _join_assignments(left, right)
+    assert len(answer) == len(expected)
+    assert set(answer) == set(expected)
+
+    query = And([
+        Link('Inheritance', [Variable('V1'), Variable('V2')], True),
+        Link('Inheritance', [Variable('V2'), Variable('V3')], True),
+        Link('Similarity', [Variable('V1'), Node('Concept', 'human')], False),
+        Not(Link('Inheritance', [Variable('V3'), Node('Concept', 'plant')], True)),
+    ])
+    db = StubDB()
+    answer = PatternMatchingAnswer()
+    assert query.matched(db, answer)
+    CONFIG['hash_join'] = False
+    try:
+        expected = PatternMatchingAnswer()
+        assert query.matched(db, expected)
+    finally:
+        CONFIG['hash_join'] = True
+    assert answer.assignments
+    assert answer.assignments == expected.assignments
+
+def test_query_planner():
+
+    class CountingStubDB(StubDB):
+        def __init__(self):
+            super().__init__()
+            self.patterns = []
+        def get_matched_links(self, link_type, target_handles):
+            self.patterns.append((link_type, target_handles))
+            return super().get_matched_links(link_type, target_handles)
+        def count_matched_links_many(self, patterns):
+            return [len(StubDB.get_matched_links(self, t, h)) for t, h in patterns]
+
+    human = Node('Concept', 'human')
+    queries = [
+        And([
+            Link('Inheritance', [Variable('V1'), Variable('V2')], True),
+            Link('Inheritance', [human, Variable('V1')], True),
+        ]),
+        And([
+            LinkTemplate('Inheritance', [TypedVariable('V1', 'Concept'), TypedVariable('V2', 'Concept')], True),
+            Link('Inheritance', [human, Variable('V1')], True),
+        ]),
+        And([
+            Link('Inheritance', [Variable('V1'), Variable('V3')], True),
+            Link('Inheritance', [Variable('V2'), Variable('V3')], True),
+            Link('Inheritance', [Variable('V3'), Node('Concept', 'animal')], True),
+            Not(Link('Similarity', [Variable('V1'), Variable('V2')], False)),
+        ]),
+        And([
+            Link('Inheritance', [Variable('V1'), Variable('V2')], True),
+            Link('Inheritance', [Variable('V2'), Node('Concept', 'blah')], True),
+        ]),
+    ]
+    for query in queries:
+        db = CountingStubDB()
+        answer = PatternMatchingAnswer()
+        matched = query.matched(db, answer)
+        CONFIG['query_planner'] = False
+        try:
+            expected = PatternMatchingAnswer()
+            assert matched == query.matched(StubDB(), expected)
+        finally:
+            CONFIG['query_planner'] = True
+        assert answer.assignments == expected.assignments
+        # Wildcard links are only looked up with the values found by the
+        # most selective term
+        assert all(pattern.count('*') < 2 for link_type, pattern in db.patterns if link_type == 'Inheritance')
+
+    db = CountingStubDB()
+    answer = PatternMatchingAnswer()
+    assert queries[0].matched(db, answer)
+    mammal = db.get_node_handle('Concept', 'mammal')
+    assert db.patterns == [('Inheritance', [db.get_node_handle('Concept', 'human'), '*']), ('Inheritance', [mammal, '*'])]
+    assert [a.mapping for a in answer.assignments] == [{'V1': mammal, 'V2': db.get_node_handle('Concept', 'animal')}]
+
+def test_query_planner_cardinalities():
+    db = StubDB()
+    human = Node('Concept', 'human')
+    mammal = Node('Concept', 'mammal')
+    terms = [
+        Link('Inheritance', [Variable('V1'), mammal], True),
+        Link('Inheritance', [human, mammal], True),
+        Link('Inheritance', [mammal, human], True),
+        Node('Concept', 'blah'),
+        LinkTemplate('Inheritance', [TypedVariable('V1', 'Concept'), TypedVariable('V2', 'Concept')], True),
+    ]
+    cardinalities = {id(term): cardinality for term, cardinality in _plan_terms(db, terms)}
+    assert [cardinalities[id(term)] for term in terms[:4]] == [4, 1, 0, 0]
+    assert cardinalities[id(terms[4])] == len(db.get_matched_type_template(['Inheritance', 'Concept', 'Concept']))
+    assert [term for term, _ in _plan_terms(db, terms)][:2] == [terms[2], terms[3]]
+
+def test_composite_join():
+
+    u1 = _build_unordered_assignment({'v1': '1', 'v2': '2'})
+    u2 = _build_unordered_assignment({'v2': '2', 'v3': '3'})
+    o1 = _build_ordered_assignment({'v1': '1', 'v2': '2', 'v3': '3'})
+    o2 = _build_ordered_assignment({'v1': '2', 'v2': '1', 'v3': '3'})
+    o3 = _build_ordered_assignment({'v1': '1', 'v2': '2', 'v3': '2'})
+    o4 = _build_ordered_assignment({'v1': '1'})
+
+    assert u1.is_covered_by_ordered(o1)
+    assert u1.is_covered_by_ordered(o2)
+    assert u1.is_covered_by_ordered(o3)
+    assert not u1.is_covered_by_ordered(o4)
+    assert not u2.is_covered_by_ordered(o4)
+
+    c1 = u1.join(u2)
+    assert isinstance(c1, CompositeAssignment)
+    hash_c1 = hash(c1)
+    c2 = c1.join(o1)
+    c3 = c1.join(o2)
+    assert c2 is not None and c3 is not None
+    # Joins build new assignments sharing their parts with the joined ones
+    assert c1.ordered_mapping is None
+    assert len(c1.unordered_mappings) == 2 and hash(c1) == hash_c1
+    assert c2.unordered_mappings is c1.unordered_mappings
+    assert c2.unordered_mappings[0] is u1
+    assert c2.ordered_mapping is o1
+    assert hash(c2) != hash(c3)
+    assert c2.join(o2) is None
+    c4 = _build_unordered_assignment({'v4': '2', 'v5': '1'}).join(c1)
+    assert len(c4.unordered_mappings) == 3
+    assert len(c1.unordered_mappings) == 2
+
+def test_interned_handles():
+
+    h1 = 'a' * 32
+    h2 = 'b' * 32
+    assert intern_handle(h1) == intern_handle('a' * 32)
+    assert intern_handle(h1) != intern_handle(h2)
+    assert handle_from_id(intern_handle(h2)) == h2
+
+    a1 = _build_ordered_assignment({'v1': h1, 'v2': h2})
+    a2 = _build_ordered_assignment({'v2': h2, 'v1': h1})
+    assert a1.mapping_ids == {'v1': intern_handle(h1), 'v2': intern_handle(h2)}
+    assert a1.mapping == {'v1': h1, 'v2': h2}
+    assert a1.values == frozenset([h1, h2])
+    assert a1 == a2 and hash(a1) == hash(a2)
+    assert not hasattr(a1, '__dict__')
+    u1 = _build_unordered_assignment({'v1': h1, 'v2': h2})
+    assert u1.values == {h1: 1, h2: 1}
+    assert u1.value_ids == {intern_handle(h1): 1, intern_handle(h2): 1}
+    assert a1.mapping is a1.mapping and a1.values is a1.values
+    assert u1.values is u1.values
+
+    count = interned_count()
+    with interning_scope():
+        assert interned_count() == 0
+        a3 = _build_ordered_assignment({'v1': h1, 'v2': 'c' * 32})
+        assert interned_count() == 2
+        assert deepcopy(a3).table is a3.table
+    assert interned_count() == count
+    assert a3.mapping == {'v1': h1, 'v2': 'c' * 32}
+
+def test_iter_matches():
+
+    class PagedStubDB(StubDB):
+        # One link per page
+        def __init__(self):
+            super().__init__()
+            self.pages = 0
+        def get_matched_links_page(self, link_type, target_handles, cursor=0, page_size=None):
+            self.pages += 1
+            links = self.get_matched_links(link_type, target_handles)
+            cursor += 1
+            return (cursor if cursor < len(links) else 0), links[cursor - 1:cursor]
+
+    mammal = Node('Concept', 'mammal')
+    human = Node('Concept', 'human')
+    queries = [
+        Node('Concept', 'mammal'),
+        Node('Concept', 'blah'),
+        Link('Inheritance', [human, mammal], True),
+        Link('Inheritance', [Variable('V1'), mammal], True),
+        Link('Similarity', [Variable('V1'), human], False),
+        LinkTemplate('Similarity', [TypedVariable('V1', 'Concept'), TypedVariable('V2', 'Concept')], False),
+        And([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Inheritance', [Variable('V2'), mammal], True),
+            Not(Link('Similarity', [Variable('V1'), Variable('V2')], False)),
+        ]),
+        And([
+            Link('Inheritance', [Variable('V1'), Variable('V3')], True),
+            Link('Inheritance', [Variable('V2'), Variable('V3')], True),
+            Link('Similarity', [Variable('V1'), Variable('V2')], False),
+        ]),
+        And([human, Link('Inheritance', [Variable('V1'), mammal], True)]),
+        Or([
+            Link('Inheritance', [Variable('V1'), mammal], True),
+            Link('Similarity', [Variable('V1'), human], False),
+        ]),
+        Or([human, Link('Inheritance', [Variable('V1'), Node('Concept', 'plant')], True)]),
+        And([
+            Link('Inheritance', [Variable('V1'), Variable('V2')], True),
+            Or([Link('Inheritance', [Variable('V1'), mammal], True), Not(Link('Inheritance', [Variable('V2'), mammal], True))]),
+        ]),
+    ]
+    for query in queries:
+        db = PagedStubDB()
+        answer = PatternMatchingAnswer()
+        matched = query.matched(db, answer)
+        assignments = list(query.iter_matches(db))
+        assert matched == bool(assignments)
+        assert len(assignments) == len(set(assignments))
+        assert set(a for a in assignments if a.variables) == answer.assignments
+        assert set(query.iter_matches(db, limit=2)) <= set(assignments)
+        assert len(list(query.iter_matches(db, limit=2))) == min(2, len(assignments))
+
+    # Iteration stops as soon as enough answers are found
+    query = Link('Inheritance', [Variable('V1'), Variable('V2')], True)
+    db = PagedStubDB()
+    assert len(list(query.iter_matches(db, limit=3))) == 3
+    assert db.pages == 3
+    query = And([
+        Link('Inheritance', [Variable('V1'), Variable('V2')], True),
+        Link('Inheritance', [Variable('V2'), Variable('V3')], True),
+    ])
+    db = PagedStubDB()
+    assert len(list(query.iter_matches(db, limit=1))) == 1
+    assert db.pages < len(db.get_matched_links('Inheritance', ['*', '*']))
+
+    # Bound lookups are batched per page of outer assignments
+    class CountingPagedStubDB(PagedStubDB):
+        def __init__(self):
+            super().__init__()
+            self.lookups = 0
+        def get_matched_links_many(self, patterns):
+            self.lookups += 1
+            return [StubDB.get_matched_links(self, t, h) for t, h in patterns]
+    query = And([
+        Link('Inheritance', [Variable('V1'), Variable('V2')], True),
+        Link('Inheritance', [Variable('V2'), Variable('V3')], True),
+    ])
+    db = CountingPagedStubDB()
+    outer = len(db.get_matched_links('Inheritance', ['*', '*']))
+    answer = PatternMatchingAnswer()
+    assert query.matched(db, answer)
+    db.lookups = 0
+    assert set(query.iter_matches(db)) == answer.assignments
+    assert db.pages == outer
+    assert db.lookups < outer
+
+    with pytest.raises(ValueError):
+        query = Not(Link('Inheritance', [Variable('V1'), mammal], True))
+        query.iter_matches(PagedStubDB())
@@ -60,6 +60,9 @@ def main():
              "whose targets are 'key1' and 'key2' are returned.")
     parser.add_argument("--query", type=str, 
         help="Query string for 'query' command.")
+    parser.add_argument("--limit", type=int, default=0,
+        help="Max number of answers returned by 'query' command. Matching stops as soon as they are found. " + \
+             "0 (default) means no limit.")
     parser.add_argument("--output-format", default=f"{OutputFormat.HANDLE}",
         choices=[fmt.value for fmt in OutputFormat],
         help=f"Tells how the query or node/link search output should be formatted. " + \
@@ -105,8 +108,12 @@ def main():
             response = _check(stub.clear(das_key))
         elif command == ClientCommands.COUNT:
             assert args.das_key
-            das_key = pb2.DASKey(key=args.das_key)
-            response = _check(stub.count(das_key))
+            count_request = pb2.CountRequest(
+                key=args.das_key,
+                link_type=args.link_type if args.link_type else None,
+                target_types=args.target_types.split(",") if args.target_types else None,
+                targets=args.targets.split(",") if args.targets else None)
+            response = _check(stub.count(count_request))
             print(f"{response.msg}")
         elif command == ClientCommands.ATOM:
             assert args.das_key
@@ -155,7 +162,8 @@ def main():
             query_request = pb2.Query(
                 key=das_key,
                 query=query,
-                output_format=output_format)
+                output_format=output_format,
+                limit=args.limit)
             response = _check(stub.query(query_request))
             print(f"{response.msg}")
     
@@ -209,7 +209,13 @@ class ServiceDefinition(pb2_grpc.ServiceDefinitionServicer):
 
     def count(self, request, context):
         with self.locked_scope:
-            return self._basic_das_call(request.key, "count_atoms", [])
+            link_type = request.link_type if request.link_type else None
+            target_types = request.target_types if request.target_types else None
+            targets = request.targets if request.targets else None
+            if link_type is None and target_types is None and targets is None:
+                return self._basic_das_call(request.key, "count_atoms", [])
+            return self._basic_das_call(request.key, "count_links",
+                [link_type, target_types, targets])
 
     def get_atom(self, request, context):
         with self.locked_scope:
@@ -239,10 +245,11 @@ class ServiceDefinition(pb2_grpc.ServiceDefinitionServicer):
             key = request.key
             query_str = request.query
             output_format = self.query_output_map[request.output_format]
+            limit = request.limit if request.limit > 0 else None
             query = _parse_query(query_str)
             if query is None:
                 return self._error(f"Invalid query")
-            return self._basic_das_call(request.key, "query", [query, output_format])
+            return self._basic_das_call(request.key, "query", [query, output_format, limit])
 
 def main():
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))